@@ -1,16 +1,95 @@
+import threading
+
 from numpy import ndarray
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
 from PyQt6.QtWidgets import QDialog, QVBoxLayout, QFormLayout, QLabel, QPushButton, QFileDialog
 from PyQt6.QtGui import QPixmap, QImage, QMouseEvent
 
-from core.path_maker import PathMaker
-from core.map_loader import MapLoader
+from core.path_maker import PathMaker, PathNotFoundError
+from core.path_renderer import draw_path, render_route
+from core.map_compiler import load_map
+
+
+class PathWorkerSignals(QObject):
+    """Signals of a PathWorker, created on the GUI thread, so the connected slots run there.
+    Every signal carries the worker first, so results of an abandoned worker can be told apart."""
+    map_loaded = pyqtSignal(object, str, object)  # Worker, image path, Map
+    route_found = pyqtSignal(object, object)  # Worker, door route positions (x, y)
+    leg_found = pyqtSignal(object, object)  # Worker, pixel leg (list of (y, x) tuples)
+    finished = pyqtSignal(object, object)  # Worker, image with the explored pixels and the whole path
+    failed = pyqtSignal(object, str)  # Worker, message - a point is outside the blank space, no path or an error
+
+
+class PathWorker(QRunnable):
+    """Path search run on a QThreadPool thread - loads the map if needed, then reports the door route and every pixel
+    leg as soon as they are found. cancel stops it before the next step, results of a step in progress are dropped."""
+
+    def __init__(self, img_path: str, loaded_map, start_point: tuple, end_point: tuple):
+        """
+        :arg loaded_map: Map of the image loaded by an earlier worker, None to load it here
+        :arg start_point: (x, y) start point, likewise end_point"""
+        super().__init__()
+        self.signals = PathWorkerSignals()
+        self.__img_path = img_path
+        self.__map = loaded_map
+        self.__start_point = start_point
+        self.__end_point = end_point
+        self.__cancelled = threading.Event()
+
+    def cancel(self):
+        self.__cancelled.set()
+
+    def is_cancelled(self) -> bool:
+        return self.__cancelled.is_set()
+
+    def run(self):
+        try:
+            self.__search()
+        except PathNotFoundError as error:
+            if not self.is_cancelled():
+                self.signals.failed.emit(self, str(error))
+        except Exception as error:  # A worker thread has no one to raise to, the UI would wait for the path forever
+            if not self.is_cancelled():
+                self.signals.failed.emit(self, f"{type(error).__name__}: {error}")
+
+    def __search(self):
+        if self.__map is None:
+            # Load the map, compiling it only once per image, the map is kept even if the search gets cancelled
+            self.__map = load_map(self.__img_path).to_map()
+            self.signals.map_loaded.emit(self, self.__img_path, self.__map)
+
+        # Locate the points and confirm that they're in the "blank" space, the map itself stays unchanged
+        query = self.__map.query(self.__start_point, self.__end_point)
+        if query is None:
+            raise PathNotFoundError("The start or end point is not in the blank space of a room")
+        # PathMaker renders the path onto a copy, the map keeps its clean image
+        maker = PathMaker.for_map(self.__map, headless=False)
+
+        # Legs are searched one at a time as they are taken, a cancelled search stops before the next one
+        chunks = maker.iter_path(query)
+        route = next(chunks)
+        if self.is_cancelled():
+            return
+        self.signals.route_found.emit(self, route)
+
+        pixel_path = []
+        for leg in chunks:
+            if self.is_cancelled():
+                return
+            self.signals.leg_found.emit(self, leg)
+            pixel_path += leg
+        self.signals.finished.emit(self, maker.render(pixel_path))
 
 
 class MapImage(QLabel):
-    """QLabel containing the image, used to easily determine the mouse click position in relation to the image"""
+    """QLabel containing the image, used to easily determine the mouse click position in relation to the image.
+    Paths are searched by a PathWorker, the door route and the pixel legs are drawn as they arrive."""
     def __init__(self):
         super().__init__()
         self.__img_path = ''
+        self.__map = None  # Loaded on the first query and reused by the following ones
+        self.__worker = None  # PathWorker of the path being searched
+        self.__rendered = None  # Image with the door route and the pixel legs found so far
         self.set_pixmap_from_path(self.__img_path)
 
         self.__click_count = 0
@@ -20,17 +99,26 @@ class MapImage(QLabel):
     def set_pixmap_from_path(self, img_path):
         """Setting the pixmap from the given path"""
         if img_path != '':
+            if img_path != self.__img_path:
+                self.__cancel_search()
+                self.__map = None
             self.__img_path = img_path
             map_pixmap = QPixmap(img_path)
             self.setPixmap(map_pixmap)
 
     def clear(self):
-        """Returning to the original image"""
+        """Cancelling the search in progress and returning to the original image"""
+        self.__cancel_search()
         self.set_pixmap_from_path(self.__img_path)
+        self.setToolTip('')
         self.__click_count = 0
 
     def mousePressEvent(self, click_event: QMouseEvent):
-        """Counting to two clicks in the event area and calculating the path, overriding the default mousePressEvent"""
+        """Counting to two clicks in the event area and starting the path search, a third click cancels the search
+        and starts a new path, overriding the default mousePressEvent"""
+        if self.__click_count == 2:
+            self.clear()
+
         if self.__click_count == 0:
             self.__start_point = click_event.pos()
             self.__click_count += 1
@@ -42,23 +130,51 @@ class MapImage(QLabel):
             start_point = (self.__start_point.x(), self.__start_point.y())
             end_point = (self.__end_point.x(), self.__end_point.y())
 
-            loader = MapLoader(self.__img_path)  # Load the map
-            map_from_image = loader.get_map()  # Get the waypoint/door map
-
-            # Add the points and confirm that they're in the "blank" space
-            start_confirmation = map_from_image.locate_and_add_point(start_point)
-            end_confirmation = map_from_image.locate_and_add_point(end_point)
-
-            if start_confirmation and end_confirmation:
-                door_waypoints = map_from_image.get_waypoints()  # Get the door map with start and end points
-                map_img = map_from_image.get_image()  # Get the preprocessed image
-
-                maker = PathMaker(map_img, door_waypoints)
-                pixel_path, image = maker.make_path()  # Calculate the path based on the waypoints and the image
-                pixmap = q_pixmap_from_cv_img(image)
-                self.setPixmap(pixmap)
-            else:
-                self.__click_count = 0
+            worker = self.__worker = PathWorker(self.__img_path, self.__map, start_point, end_point)
+            worker.signals.map_loaded.connect(self.__keep_map)
+            worker.signals.route_found.connect(self.__show_route)
+            worker.signals.leg_found.connect(self.__show_leg)
+            worker.signals.finished.connect(self.__show_path)
+            worker.signals.failed.connect(self.__search_failed)
+            QThreadPool.globalInstance().start(worker)
+
+    def __cancel_search(self):
+        if self.__worker is not None:
+            self.__worker.cancel()
+            self.__worker = None
+        self.__rendered = None
+
+    def __keep_map(self, worker: PathWorker, img_path: str, loaded_map):
+        if img_path == self.__img_path and self.__map is None:
+            self.__map = loaded_map
+
+    def __show_route(self, worker: PathWorker, route: list):
+        if worker is not self.__worker:  # Cancelled in the meantime
+            return
+        self.__rendered = render_route(self.__map.get_image(), route)
+        self.setPixmap(q_pixmap_from_cv_img(self.__rendered))
+
+    def __show_leg(self, worker: PathWorker, leg: list):
+        if worker is not self.__worker:
+            return
+        draw_path(self.__rendered, leg)
+        self.setPixmap(q_pixmap_from_cv_img(self.__rendered))
+
+    def __show_path(self, worker: PathWorker, image: ndarray):
+        if worker is not self.__worker:
+            return
+        self.__worker = None
+        self.__rendered = None
+        self.setPixmap(q_pixmap_from_cv_img(image))
+        self.setToolTip('')
+
+    def __search_failed(self, worker: PathWorker, message: str):
+        if worker is not self.__worker:
+            return
+        self.setToolTip(message)  # Why no path was drawn
+        self.__worker = None
+        self.__rendered = None
+        self.__click_count = 0
 
 
 class MapInterface(QDialog):
@@ -0,0 +1,125 @@
+"""Seeded generator of floor plans in the colour convention of MapLoader:
+white rooms, black walls, green doors and obstacles in the obstacle colour
+(all colours in BGR, as MapLoader reads them).
+
+    python -m benchmarks.map_generator out.png --width 2048 --height 2048 --rooms 200 --obstacles 0.05 --seed 1
+"""
+import argparse
+
+import cv2
+import numpy as np
+
+WALL = 3  # Wall thickness, doors span the whole wall
+DOOR_LENGTH = 7
+MIN_ROOM = 16  # Minimal interior width/height of a room
+OBSTACLE_MARGIN = 4  # Free corridor kept along the walls, so every door stays reachable
+
+WHITE = (255, 255, 255)
+DOOR_COLOUR = (0, 255, 0)  # MapLoader defaults
+OBSTACLE_COLOUR = (255, 0, 0)
+
+
+def generate_floor_plan(width: int, height: int, room_count: int, obstacle_density: float = 0.0,
+                        seed: int = 0) -> np.ndarray:
+    """Split the image into rectangular rooms (binary space partitioning) and connect every pair of sibling
+    partitions with a door, so all the rooms are reachable.
+    :arg room_count: number of rooms, fewer if the image is too small to split further
+    :arg obstacle_density: approximate fraction of every room interior covered with obstacles
+    :returns: BGR image"""
+    rng = np.random.default_rng(seed)
+    image = np.zeros((height, width, 3), dtype=np.uint8)
+
+    # Interiors (x_min, y_min, x_max, y_max), inclusive, separated by walls of WALL pixels
+    leaves = [(WALL, WALL, width - WALL - 1, height - WALL - 1)]
+    walls = []  # (vertical, wall start, line from, line to) of every split
+    while len(leaves) < room_count:
+        # Split the biggest room which can still be split, across its longer side
+        order = sorted(range(len(leaves)), key=lambda index: -(leaves[index][2] - leaves[index][0]) *
+                       (leaves[index][3] - leaves[index][1]))
+        for index in order:
+            x_min, y_min, x_max, y_max = leaves[index]
+            vertical = (x_max - x_min) >= (y_max - y_min)
+            low, high = (x_min, x_max) if vertical else (y_min, y_max)
+            if high - low + 1 >= 2 * MIN_ROOM + WALL:
+                break
+        else:
+            break  # Nothing left big enough to split
+
+        span = high - low + 1 - WALL
+        first_size = int(rng.integers(max(MIN_ROOM, int(span * 0.35)), min(span - MIN_ROOM, int(span * 0.65)) + 1))
+        wall_start = low + first_size
+        if vertical:
+            leaves[index:index + 1] = [(x_min, y_min, wall_start - 1, y_max), (wall_start + WALL, y_min, x_max, y_max)]
+            walls.append((True, wall_start, y_min, y_max))
+        else:
+            leaves[index:index + 1] = [(x_min, y_min, x_max, wall_start - 1), (x_min, wall_start + WALL, x_max, y_max)]
+            walls.append((False, wall_start, x_min, x_max))
+
+    for x_min, y_min, x_max, y_max in leaves:
+        image[y_min:y_max + 1, x_min:x_max + 1] = WHITE
+
+    white = (image == 255).all(axis=2)
+    for vertical, wall_start, line_from, line_to in walls:
+        # The door needs room interior on both sides along its whole length (not the end of a deeper wall)
+        if vertical:
+            both_sides = white[line_from:line_to + 1, wall_start - 1] & white[line_from:line_to + 1, wall_start + WALL]
+        else:
+            both_sides = white[wall_start - 1, line_from:line_to + 1] & white[wall_start + WALL, line_from:line_to + 1]
+        runs = np.convolve(both_sides, np.ones(DOOR_LENGTH, dtype=int), mode='valid') == DOOR_LENGTH
+        # Keep a pixel of wall between the door and the corner of the room
+        candidates = np.flatnonzero(runs[1:-1]) + 1 if len(runs) > 2 else np.array([], dtype=int)
+        if len(candidates) == 0:
+            continue
+        door_from = line_from + int(rng.choice(candidates))
+        if vertical:
+            image[door_from:door_from + DOOR_LENGTH, wall_start:wall_start + WALL] = DOOR_COLOUR
+        else:
+            image[wall_start:wall_start + WALL, door_from:door_from + DOOR_LENGTH] = DOOR_COLOUR
+
+    if obstacle_density > 0:
+        for x_min, y_min, x_max, y_max in leaves:
+            _place_obstacles(image, rng, x_min + OBSTACLE_MARGIN, y_min + OBSTACLE_MARGIN,
+                             x_max - OBSTACLE_MARGIN, y_max - OBSTACLE_MARGIN, obstacle_density)
+    return image
+
+
+def _place_obstacles(image: np.ndarray, rng: np.random.Generator, x_min: int, y_min: int, x_max: int, y_max: int,
+                     density: float):
+    """Scatter rectangular obstacles in the given inclusive bounds until about density of the area is covered"""
+    width = x_max - x_min + 1
+    height = y_max - y_min + 1
+    if width < 4 or height < 4:
+        return
+    target = density * width * height
+    covered = 0
+    while covered < target:
+        obstacle_width = int(rng.integers(2, max(3, width // 3)))
+        obstacle_height = int(rng.integers(2, max(3, height // 3)))
+        x = x_min + int(rng.integers(0, width - obstacle_width + 1))
+        y = y_min + int(rng.integers(0, height - obstacle_height + 1))
+        image[y:y + obstacle_height, x:x + obstacle_width] = OBSTACLE_COLOUR
+        covered += obstacle_width * obstacle_height
+
+
+def write_floor_plan(path: str, width: int, height: int, room_count: int, obstacle_density: float = 0.0,
+                     seed: int = 0) -> str:
+    """Generate a floor plan and save it as an image file, returns the path"""
+    cv2.imwrite(path, generate_floor_plan(width, height, room_count, obstacle_density, seed))
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic floor plan for MapLoader')
+    parser.add_argument('output', help='image path, e.g. map.png')
+    parser.add_argument('--width', type=int, default=1024)
+    parser.add_argument('--height', type=int, default=1024)
+    parser.add_argument('--rooms', type=int, default=50)
+    parser.add_argument('--obstacles', type=float, default=0.0, help='fraction of every room covered by obstacles')
+    parser.add_argument('--seed', type=int, default=0)
+    arguments = parser.parse_args()
+    write_floor_plan(arguments.output, arguments.width, arguments.height, arguments.rooms, arguments.obstacles,
+                     arguments.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+"""Headless benchmark of every stage of the pathfinding pipeline on seeded synthetic floor plans.
+Results are written as JSON, pass an earlier result file with --compare to see the change.
+
+    python -m benchmarks.run_benchmarks --output results.json
+    python -m benchmarks.run_benchmarks --scenario large --compare results.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from benchmarks.map_generator import write_floor_plan
+from core.instrumentation import Stats
+from core.jump_point_search import JumpPointSearch
+from core.map_compiler import CompiledMap
+from core.map_loader import MapLoader
+from core.occupancy import OccupancyGrid
+from core.path_maker import PathMaker, PathNotFoundError
+from core.pixel_search import PixelAStar
+
+# name -> generator parameters
+SCENARIOS = {
+    'small': {'width': 512, 'height': 512, 'room_count': 20, 'obstacle_density': 0.05},
+    'medium': {'width': 2048, 'height': 2048, 'room_count': 200, 'obstacle_density': 0.05},
+    'large': {'width': 4096, 'height': 4096, 'room_count': 800, 'obstacle_density': 0.05},
+}
+# Random pixels tried by _random_free_point before giving up
+MAX_POINT_ATTEMPTS = 100000
+# MapLoader stages between reading the image and building the waypoints
+AREA_DETECTION_STAGES = ('colour_masks', 'door_detection', 'room_detection', 'door_assignment')
+
+
+def _summary(samples: list[float]) -> dict:
+    if not samples:
+        return {'runs': 0}
+    ordered = sorted(samples)
+    return {'runs': len(ordered), 'mean': sum(ordered) / len(ordered), 'min': ordered[0],
+            'p50': ordered[len(ordered) // 2], 'p95': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+            'max': ordered[-1]}
+
+
+def _random_free_point(image: np.ndarray, rng: random.Random) -> tuple[int, int]:
+    """:raises ValueError: if no free (white) pixel was hit in MAX_POINT_ATTEMPTS tries, e.g. the map has none"""
+    height, width = image.shape[:2]
+    for _ in range(MAX_POINT_ATTEMPTS):
+        x, y = rng.randrange(width), rng.randrange(height)
+        if (image[y, x] == 255).all():
+            return x, y
+    raise ValueError(f"No free pixel found in {MAX_POINT_ATTEMPTS} random tries")
+
+
+def run_scenario(name: str, parameters: dict, queries: int, repeats: int, seed: int, directory: str) -> dict:
+    """Time every stage of the pipeline on one generated map"""
+    img_path = os.path.join(directory, f'{name}_{seed}.png')
+    write_floor_plan(img_path, seed=seed, **parameters)
+
+    stages = {stage: [] for stage in ('image_load', 'area_detection', 'waypoint_graph', 'flow_fields',
+                                      'locate_and_add_point', 'waypoint_astar', 'pixel_astar', 'pixel_jps',
+                                      'pixel_flow')}
+    loaded_map = None
+    for _ in range(repeats):
+        stats = Stats()
+        loader = MapLoader(img_path, stats=stats)
+        loaded_map = loader.get_map()
+        stages['image_load'].append(stats.stages['image_load'])
+        stages['area_detection'].append(sum(stats.stages[stage] for stage in AREA_DETECTION_STAGES))
+        stages['waypoint_graph'].append(stats.stages['waypoint_graph'])
+
+    stats = Stats()
+    flow_fields = loaded_map.build_flow_fields(stats)
+    stages['flow_fields'].append(stats.stages['flow_fields'])
+
+    compiled_map = CompiledMap.from_map(loaded_map)
+    occupancy = compiled_map.occupancy
+    walkable = OccupancyGrid.from_thresholded(occupancy)  # Shared by every search, like the maps of a service
+    astar = PixelAStar(walkable)
+    jps = JumpPointSearch(walkable)
+    rng = random.Random(seed)
+    counters = {'queries': queries, 'unreachable': 0, 'legs': 0, 'path_pixels': 0, 'astar_expanded': 0,
+                'jps_expanded': 0, 'flow_legs': 0}
+
+    for _ in range(queries):
+        query_map = compiled_map.to_map()
+        start = _random_free_point(query_map.get_image(), rng)
+        end = _random_free_point(query_map.get_image(), rng)
+
+        started = time.perf_counter()
+        located = query_map.locate_and_add_point(start)
+        locates = 1
+        if located:  # The end isn't located if the start already failed
+            located = query_map.locate_and_add_point(end)
+            locates = 2
+        stages['locate_and_add_point'].append((time.perf_counter() - started) / locates)
+        if not located:
+            counters['unreachable'] += 1
+            continue
+
+        maker = PathMaker.for_map(query_map, waypoint_graph=None)  # Routes on the Waypoint objects
+        started = time.perf_counter()
+        try:
+            waypoint_path = maker.find_waypoint_path()
+        except PathNotFoundError:
+            counters['unreachable'] += 1
+            continue
+        stages['waypoint_astar'].append(time.perf_counter() - started)
+
+        for leg_start, leg_end in zip(waypoint_path, waypoint_path[1:]):
+            started = time.perf_counter()
+            flow_leg = flow_fields.leg(leg_start, leg_end)
+            if flow_leg is not None:  # Only the legs starting or ending at a door have a field
+                stages['pixel_flow'].append(time.perf_counter() - started)
+                counters['flow_legs'] += 1
+
+            leg_start = (int(leg_start[1]), int(leg_start[0]))
+            leg_end = (int(leg_end[1]), int(leg_end[0]))
+            for stage, engine in (('pixel_astar', astar), ('pixel_jps', jps)):
+                started = time.perf_counter()
+                leg = engine.search(leg_start, leg_end)
+                stages[stage].append(time.perf_counter() - started)
+            counters['astar_expanded'] += astar.expanded
+            counters['jps_expanded'] += jps.expanded
+            counters['legs'] += 1
+            counters['path_pixels'] += len(leg) if leg else 0
+
+    return {'name': name, 'parameters': {**parameters, 'seed': seed},
+            'rooms': len(loaded_map.get_room_index().room_areas), 'doors': len(loaded_map.get_waypoints()),
+            'stages': {stage: _summary(samples) for stage, samples in stages.items()}, 'counters': counters}
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def compare(previous: dict, current: dict):
+    """Print the mean time of every stage next to the one from an earlier run"""
+    previous_scenarios = {scenario['name']: scenario for scenario in previous['scenarios']}
+    for scenario in current['scenarios']:
+        old = previous_scenarios.get(scenario['name'])
+        if old is None:
+            continue
+        print(f"{scenario['name']} ({previous.get('commit', '')[:8]} -> {current.get('commit', '')[:8]})")
+        for stage, summary in scenario['stages'].items():
+            old_summary = old['stages'].get(stage, {})
+            if not summary.get('runs') or not old_summary.get('runs'):
+                continue
+            ratio = summary['mean'] / old_summary['mean'] if old_summary['mean'] else float('inf')
+            print(f"  {stage:<22}{old_summary['mean'] * 1000:>11.3f} ms{summary['mean'] * 1000:>11.3f} ms"
+                  f"{ratio:>9.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the pathfinding stages on synthetic maps')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='scenario to run, can be repeated, all by default')
+    parser.add_argument('--queries', type=int, default=20, help='random start/end pairs per scenario')
+    parser.add_argument('--repeats', type=int, default=3, help='repetitions of the map loading stages')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help='earlier result file to compare with')
+    arguments = parser.parse_args()
+
+    results = {'commit': _git_commit(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'python': platform.python_version(), 'numpy': np.__version__, 'opencv': cv2.__version__,
+               'machine': platform.machine(), 'scenarios': []}
+    with tempfile.TemporaryDirectory() as directory:
+        for name in arguments.scenario or SCENARIOS:
+            scenario = run_scenario(name, SCENARIOS[name], arguments.queries, arguments.repeats, arguments.seed,
+                                    directory)
+            results['scenarios'].append(scenario)
+            print(f"{name}: {scenario['rooms']} rooms, {scenario['doors']} doors")
+            for stage, summary in scenario['stages'].items():
+                if summary['runs']:
+                    print(f"  {stage:<22}{summary['mean'] * 1000:>11.3f} ms (p95 {summary['p95'] * 1000:.3f} ms)")
+
+    with open(arguments.output, 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+
+    if arguments.compare:
+        with open(arguments.compare) as previous_file:
+            compare(json.load(previous_file), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+import numpy as np
+from numpy import ndarray
+
+
+def line_pixels(start: tuple[int, int], end: tuple[int, int]) -> tuple[ndarray, ndarray]:
+    """Rows and columns of the Bresenham line between two (y, x) pixels, both included, computed at once.
+    Consecutive pixels of the line are 8-connected neighbours."""
+    start_y, start_x = int(start[0]), int(start[1])
+    dy, dx = int(end[0]) - start_y, int(end[1]) - start_x
+    steps = max(abs(dy), abs(dx))
+    if steps == 0:
+        return np.array([start_y]), np.array([start_x])
+    t = np.arange(steps + 1)
+    # Round half up of start + t * d / steps in integers
+    rows = start_y + (2 * t * dy + steps) // (2 * steps)
+    columns = start_x + (2 * t * dx + steps) // (2 * steps)
+    return rows, columns
+
+
+def line_of_sight(walkable: ndarray, start: tuple[int, int], end: tuple[int, int]) -> bool:
+    """Whether the straight line between two (y, x) pixels can be walked with the movement rules of PixelAStar -
+    every pixel of the line is free and no diagonal step cuts a wall corner
+    :arg walkable: (height, width) bool array, True on free pixels (OccupancyGrid.walkable)"""
+    rows, columns = line_pixels(start, end)
+    if not walkable[rows, columns].all():
+        return False
+    diagonal = (rows[1:] != rows[:-1]) & (columns[1:] != columns[:-1])
+    if not diagonal.any():
+        return True
+    before_rows, after_rows = rows[:-1][diagonal], rows[1:][diagonal]
+    before_columns, after_columns = columns[:-1][diagonal], columns[1:][diagonal]
+    return bool(walkable[before_rows, after_columns].all() and walkable[after_rows, before_columns].all())
+
+
+def turning_points(pixel_path: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    """Points of an 8-connected path where it changes direction, the first and last point included"""
+    if len(pixel_path) < 3:
+        return list(pixel_path)
+    steps = np.diff(np.asarray(pixel_path), axis=0)
+    turns = np.flatnonzero((steps[1:] != steps[:-1]).any(axis=1)) + 1
+    return [pixel_path[0]] + [pixel_path[index] for index in turns.tolist()] + [pixel_path[-1]]
+
+
+def smooth_path(walkable: ndarray, points: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    """Line of sight smoothing (string pulling) - drop every point which the previous kept point sees past.
+    :arg points: (y, x) points of a path, consecutive ones joined by a straight or diagonal line (a dense path,
+    jump points, or turning_points)
+    :returns: the kept (y, x) points, the first and last included, joined by walkable straight lines of any angle"""
+    if len(points) < 3:
+        return list(points)
+    smoothed = [points[0]]
+    for previous, point in zip(points[1:], points[2:]):
+        if not line_of_sight(walkable, smoothed[-1], point):
+            smoothed.append(previous)
+    smoothed.append(points[-1])
+    return smoothed
+
+
+def densify(points: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    """Join the consecutive (y, x) points with Bresenham lines into an 8-connected pixel path"""
+    if len(points) < 2:
+        return list(points)
+    path = [points[0]]
+    for start, end in zip(points, points[1:]):
+        rows, columns = line_pixels(start, end)
+        path += list(zip(rows[1:].tolist(), columns[1:].tolist()))
+    return path
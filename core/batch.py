@@ -0,0 +1,181 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from core.map import Map
+from core.map_compiler import CompiledMap
+from core.occupancy import OccupancyGrid
+from core.path_maker import PathMaker, PathNotFoundError
+
+# Arrays of CompiledMap placed in the shared memory block, the workers are headless so the image is left out
+SHARED_ARRAYS = ('waypoint_positions', 'room_areas', 'room_door_offsets', 'room_door_indices', 'adjacency_offsets',
+                 'adjacency_indices', 'door_mask', 'distances', 'next_hops', 'flow_keys', 'flow_regions',
+                 'flow_offsets', 'flow_distances', 'flow_directions')
+ALIGNMENT = 64
+
+
+class BatchResult:
+    """Result of one query of the batch, path is None if error is set"""
+
+    def __init__(self, index: int, start: tuple[int, int], end: tuple[int, int], path: list = None,
+                 error: str = None):
+        self.index = index  # Position of the query in the list of endpoint pairs
+        self.start = start
+        self.end = end
+        self.path = path  # List of (y, x) tuples, as returned by PathMaker.make_path
+        self.error = error
+
+
+class _SharedMap:
+    """Arrays of a CompiledMap copied once into a single shared memory block, with the padded cells of its
+    occupancy grid and the label image of its room index, which the workers read in place"""
+
+    def __init__(self, compiled_map: CompiledMap):
+        arrays = {name: getattr(compiled_map, name) for name in SHARED_ARRAYS}
+        arrays['occupancy_cells'] = compiled_map.get_occupancy_grid().padded
+        arrays['room_labels'] = compiled_map.get_room_index().labels
+        self.layout = []  # (name, dtype, shape, offset)
+        size = 0
+        for name, array in arrays.items():
+            if array is None:  # Optional array
+                continue
+            self.layout.append((name, array.dtype.str, array.shape, size))
+            size += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+
+        self.memory = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        for name, dtype, shape, offset in self.layout:
+            np.ndarray(shape, dtype=dtype, buffer=self.memory.buf, offset=offset)[...] = arrays[name]
+
+    def release(self):
+        self.memory.close()
+        self.memory.unlink()
+
+
+# State of a worker process, set once by _init_worker
+_worker_memories = []
+_worker_path_makers = {}  # Map name -> (Map, PathMaker)
+
+
+def _init_worker(shared_maps: list[tuple[str, str, list, str]], pixel_search: str):
+    """:arg shared_maps: (map name, shared memory name, layout, source hash) of every map"""
+    for map_name, memory_name, layout, source_hash in shared_maps:
+        memory = shared_memory.SharedMemory(name=memory_name)  # Owned and unlinked by the parent
+        _worker_memories.append(memory)
+
+        arrays = {}
+        for name, dtype, shape, offset in layout:
+            array = np.ndarray(shape, dtype=dtype, buffer=memory.buf, offset=offset)
+            array.flags.writeable = False
+            arrays[name] = array
+        # The searches and the room index read the block without copying it, nothing per pixel is built here
+        cells = arrays.pop('occupancy_cells')
+        occupancy_grid = OccupancyGrid(cells.shape[0] - 2, cells.shape[1] - 2, memoryview(cells.reshape(-1)))
+        compiled_map = CompiledMap(source_hash, None, None, occupancy_grid=occupancy_grid, **arrays)
+
+        worker_map = compiled_map.to_map(headless=True)
+        # Only the paths are sent back, so nothing is rendered
+        _worker_path_makers[map_name] = (worker_map, PathMaker.for_map(worker_map, pixel_search=pixel_search))
+
+
+def _solve_chunk(map_name: str, chunk: list[tuple[int, tuple, tuple]]) -> list[BatchResult]:
+    worker_map, path_maker = _worker_path_makers[map_name]
+    results = []
+    for index, start, end in chunk:
+        try:
+            query = worker_map.query(start, end)
+        except Exception as error:  # E.g. malformed points, fail this query only
+            results.append(BatchResult(index, start, end, error=repr(error)))
+            continue
+        if query is None:
+            results.append(BatchResult(index, start, end, error="Start or end point is not in the blank space "
+                                                                "of a room"))
+            continue
+        try:
+            path, _ = path_maker.make_path(query)
+        except PathNotFoundError as error:
+            results.append(BatchResult(index, start, end, error=str(error)))
+            continue
+        except Exception as error:  # Fail this query only, not the rest of the chunk
+            results.append(BatchResult(index, start, end, error=repr(error)))
+            continue
+        results.append(BatchResult(index, start, end, path))
+    return results
+
+
+class PathPool:
+    """Pool of worker processes with any number of maps put in shared memory once, for answering queries over
+    a long time (a service). Every worker holds a Map and a PathMaker per map.
+    Use as a context manager or call close, which also frees the shared memory."""
+
+    def __init__(self, maps: dict, workers: int = None, pixel_search: str = 'astar'):
+        """
+        :arg maps: map name -> CompiledMap (e.g. from load_map) or Map
+        :arg workers: number of processes, os.cpu_count() by default"""
+        self.workers = workers or os.cpu_count() or 1
+        self.__shared_maps = {}
+        try:
+            for map_name, loaded_map in maps.items():
+                if isinstance(loaded_map, Map):
+                    loaded_map = CompiledMap.from_map(loaded_map)
+                self.__shared_maps[map_name] = (_SharedMap(loaded_map), loaded_map.source_hash)
+            initargs = ([(map_name, shared_map.memory.name, shared_map.layout, source_hash)
+                         for map_name, (shared_map, source_hash) in self.__shared_maps.items()], pixel_search)
+            self.__executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                                  initargs=initargs)
+        except BaseException:
+            self.__release()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def map_names(self) -> list[str]:
+        return list(self.__shared_maps)
+
+    def submit(self, map_name: str, queries: list[tuple[int, tuple, tuple]]) -> Future:
+        """Solve the (index, start, end) queries on a map in one worker
+        :returns: Future of the list of BatchResult, in order of the queries
+        :raises KeyError: if the pool has no map of that name"""
+        if map_name not in self.__shared_maps:
+            raise KeyError(map_name)
+        return self.__executor.submit(_solve_chunk, map_name, queries)
+
+    def close(self):
+        self.__executor.shutdown(wait=True, cancel_futures=True)
+        self.__release()
+
+    def __release(self):
+        for shared_map, _ in self.__shared_maps.values():
+            shared_map.release()
+        self.__shared_maps = {}
+
+
+def find_paths(loaded_map, endpoint_pairs: list[tuple[tuple[int, int], tuple[int, int]]], workers: int = None,
+               chunk_size: int = None, pixel_search: str = 'astar'):
+    """Find the paths of many (start, end) point pairs in parallel, on a pool of processes.
+    The map is put in shared memory once, so only the endpoints travel to the workers.
+    :arg loaded_map: CompiledMap (e.g. from load_map) or Map
+    :arg workers: number of processes, os.cpu_count() by default
+    :arg chunk_size: queries sent to a worker at once, by default the pairs are split into ~4 chunks per worker
+    :returns: generator of BatchResult, in order of completion (use BatchResult.index to match the pairs)"""
+    queries = [(index, tuple(start), tuple(end)) for index, (start, end) in enumerate(endpoint_pairs)]
+    if not queries:
+        return
+
+    with PathPool({'': loaded_map}, workers, pixel_search) as pool:
+        if chunk_size is None:
+            chunk_size = max(1, len(queries) // (pool.workers * 4))
+        pending = {pool.submit('', queries[start:start + chunk_size]) for start in range(0, len(queries), chunk_size)}
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from future.result()
+        finally:
+            for future in pending:  # The consumer stopped early
+                future.cancel()
@@ -0,0 +1,276 @@
+import numpy as np
+from numpy import ndarray
+
+from core.pixel_search import NEIGHBOURS, SQRT2
+
+UNREACHABLE = np.iinfo(np.uint16).max  # Distance of the pixels which can't reach the door
+NO_DIRECTION = -1  # Direction of the door itself and of the unreachable pixels
+
+
+def _relax_row(row: ndarray, walkable: ndarray):
+    """Relax the distances of one row along itself, in both directions, in place.
+    Within a free run a pixel can be reached from any other one for the cost of the number of steps between them,
+    so the running minimum of (distance - column) gives the whole run in one pass per direction."""
+    if walkable.all():
+        runs = ((0, len(row)),)
+    else:
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], walkable.view(np.int8), [0]))))
+        runs = zip(edges[::2].tolist(), edges[1::2].tolist())
+    for start, end in runs:
+        if end - start < 2:
+            continue
+        steps = np.arange(end - start, dtype=np.float64)
+        for values in (row[start:end], row[end - 1:start - 1 if start else None:-1]):
+            np.minimum(values, np.minimum.accumulate(values - steps) + steps, out=values)
+
+
+def wavefront(walkable: ndarray, source: tuple[int, int]) -> ndarray:
+    """Cost of the cheapest path from every pixel to the (y, x) source, with the movement rules of PixelAStar
+    (8-connected, diagonal cost sqrt(2), no cutting wall corners). Alternates top-down and bottom-up sweeps,
+    each relaxing a whole row at once from its neighbouring row and along itself, until nothing changes.
+    :arg walkable: (height, width) bool array
+    :returns: (height, width) float64 array, inf where the source can't be reached"""
+    height = walkable.shape[0]
+    distances = np.full(walkable.shape, np.inf)
+    distances[source] = 0.0
+    _relax_row(distances[source[0]], walkable[source[0]])
+
+    # A row is relaxed from its neighbour only if the neighbour changed since the last time
+    clock = 1
+    changed_at = [0] * height
+    changed_at[source[0]] = clock
+    relaxed_at = {-1: [0] * height, 1: [0] * height}  # Side of the neighbour row -> time of the last relaxation
+    while True:
+        clock_before = clock
+        for rows, step in ((range(1, height), -1), (range(height - 2, -1, -1), 1)):
+            for y in rows:
+                if changed_at[y + step] <= relaxed_at[step][y]:
+                    continue
+                clock += 1
+                relaxed_at[step][y] = clock
+
+                previous = distances[y + step]
+                previous_walkable = walkable[y + step]
+                row_walkable = walkable[y]
+                candidates = previous + 1.0
+                # Diagonal steps are allowed if both corner pixels are free
+                left = previous_walkable[1:] & row_walkable[:-1]  # From the upper/lower left neighbour
+                np.minimum(candidates[1:], np.where(left, previous[:-1] + SQRT2, np.inf), out=candidates[1:])
+                right = previous_walkable[:-1] & row_walkable[1:]  # From the upper/lower right neighbour
+                np.minimum(candidates[:-1], np.where(right, previous[1:] + SQRT2, np.inf), out=candidates[:-1])
+                candidates[~row_walkable] = np.inf
+
+                row = distances[y]
+                improved = candidates < row
+                if improved.any():
+                    row[improved] = candidates[improved]
+                    _relax_row(row, row_walkable)
+                    changed_at[y] = clock
+        if clock == clock_before:
+            return distances
+
+
+def flow_directions(walkable: ndarray, distances: ndarray) -> ndarray:
+    """Index (in NEIGHBOURS) of the next step down the distance field from every pixel, NO_DIRECTION at the source
+    and at the unreachable pixels"""
+    height, width = walkable.shape
+    padded = np.full((height + 2, width + 2), np.inf)
+    padded[1:-1, 1:-1] = distances
+    padded_walkable = np.zeros((height + 2, width + 2), dtype=bool)
+    padded_walkable[1:-1, 1:-1] = walkable
+
+    candidates = np.empty((len(NEIGHBOURS), height, width))
+    for index, (dy, dx, cost) in enumerate(NEIGHBOURS):
+        candidate = padded[1 + dy:height + 1 + dy, 1 + dx:width + 1 + dx] + cost
+        if dy and dx:  # Diagonal steps may not cut a wall corner
+            corners = (padded_walkable[1 + dy:height + 1 + dy, 1:-1] &
+                       padded_walkable[1:-1, 1 + dx:width + 1 + dx])
+            candidate = np.where(corners, candidate, np.inf)
+        candidates[index] = candidate
+
+    directions = np.argmin(candidates, axis=0).astype(np.int8)
+    directions[~np.isfinite(distances) | (distances == 0)] = NO_DIRECTION
+    return directions
+
+
+def _compute_field(walkable: ndarray, source: tuple[int, int]) -> tuple[ndarray, ndarray]:
+    """Stored form (uint16 distances, int8 directions) of the field of the (y, x) source"""
+    if not walkable[source]:  # Door blocked by an obstacle
+        return (np.full(walkable.shape, UNREACHABLE, dtype=np.uint16),
+                np.full(walkable.shape, NO_DIRECTION, dtype=np.int8))
+    distances = wavefront(walkable, source)
+    finite = np.isfinite(distances)
+    stored = np.full(distances.shape, UNREACHABLE, dtype=np.uint16)
+    stored[finite] = np.minimum(np.rint(distances[finite]), UNREACHABLE - 1)
+    return stored, flow_directions(walkable, distances)
+
+
+class FlowFields:
+    """Distance and direction fields from every door over each room it belongs to.
+    Any point of a room reaches a door of the room by following the directions, without a search.
+    The fields of all the (room, door) pairs are stored back to back in flat arrays:
+    distances (uint16, rounded, UNREACHABLE if the door can't be reached) and directions (int8, NEIGHBOURS index)."""
+
+    def __init__(self, room_index, waypoint_positions: ndarray, keys: ndarray, regions: ndarray, offsets: ndarray,
+                 distances: ndarray, directions: ndarray):
+        """
+        :arg room_index: RoomIndex of the map, used to find the room of a point
+        :arg waypoint_positions: (n, 2) door positions (x, y)
+        :arg keys: (k, 2) (room, door waypoint index) of every field
+        :arg regions: (k, 4) (x, y, width, height) of the rectangle covered by every field
+        :arg offsets: field i is distances[offsets[i]:offsets[i + 1]] (and directions), row by row over its region
+        """
+        self.keys = np.asarray(keys, dtype=np.int32).reshape(-1, 2)
+        self.regions = np.asarray(regions, dtype=np.int32).reshape(-1, 4)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.distances = distances
+        self.directions = directions
+        self.__room_index = room_index
+        self.__positions = np.asarray(waypoint_positions).reshape(-1, 2)
+
+        self.__fields = {(room, door): field for field, (room, door) in enumerate(self.keys.tolist())}
+        self.__door_indices = {(x, y): door for door, (x, y) in enumerate(self.__positions.tolist())}
+        self.__door_rooms = {}  # Door -> rooms having a field of it
+        for room, door in self.__fields:
+            self.__door_rooms.setdefault(door, []).append(room)
+        self.__moves = [(dy, dx) for dy, dx, _ in NEIGHBOURS]
+
+    @classmethod
+    def build(cls, walkable_image: ndarray, room_index, waypoint_positions: ndarray):
+        """Compute the fields of every door of every room.
+        A field covers the room rectangle (its walls included), extended to the doors of the room, and is computed
+        on the free pixels inside it, so the legs it gives never leave the room.
+        Takes about 3 bytes per pixel of a room for each of its doors.
+        :arg walkable_image: (height, width) bool array, True on free pixels (OccupancyGrid.walkable)"""
+        height, width = walkable_image.shape[:2]
+        positions = np.asarray(waypoint_positions, dtype=np.int64).reshape(-1, 2)
+
+        keys, regions, offsets = [], [], [0]
+        distance_chunks, direction_chunks = [], []
+        for room, ((x_min, y_min), (x_max, y_max)) in enumerate(room_index.room_areas):
+            doors = room_index.room_doors[room]
+            if not doors:
+                continue
+            # The doors lie in the walls, possibly outside of the room area, the region covers all of them
+            door_xs, door_ys = positions[doors].T
+            left = max(min(x_min, int(door_xs.min())), 0)
+            top = max(min(y_min, int(door_ys.min())), 0)
+            right = min(max(x_max, int(door_xs.max())), width - 1)
+            bottom = min(max(y_max, int(door_ys.max())), height - 1)
+            for door in doors:
+                door_x, door_y = (int(value) for value in positions[door])
+                if not (left <= door_x <= right and top <= door_y <= bottom):
+                    continue
+
+                walkable = walkable_image[top:bottom + 1, left:right + 1]
+                source = (door_y - top, door_x - left)
+                if not walkable[source]:
+                    continue
+                stored, directions = _compute_field(walkable, source)
+
+                keys.append((room, door))
+                regions.append((left, top, right - left + 1, bottom - top + 1))
+                offsets.append(offsets[-1] + stored.size)
+                distance_chunks.append(stored.ravel())
+                direction_chunks.append(directions.ravel())
+
+        distances = np.concatenate(distance_chunks) if distance_chunks else np.zeros(0, dtype=np.uint16)
+        directions = np.concatenate(direction_chunks) if direction_chunks else np.zeros(0, dtype=np.int8)
+        return cls(room_index, positions, keys, regions, offsets, distances, directions)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def rebuilt(self, walkable_image: ndarray, rectangle: tuple):
+        """Copy of the fields with the ones overlapping the changed rectangle ((x_min, y_min), (x_max, y_max))
+        computed again from the walkable pixels (like in build), the other fields are copied unchanged"""
+        (x_min, y_min), (x_max, y_max) = rectangle
+        distances = self.distances.copy()
+        directions = self.directions.copy()
+        positions = self.__positions.tolist()
+
+        for field, ((room, door), (left, top, width, height)) in enumerate(zip(self.keys.tolist(),
+                                                                                 self.regions.tolist())):
+            if left > x_max or top > y_max or left + width <= x_min or top + height <= y_min:
+                continue
+            door_x, door_y = positions[door]
+            walkable = walkable_image[top:top + height, left:left + width]
+            stored, field_directions = _compute_field(walkable, (door_y - top, door_x - left))
+            start, end = self.offsets[field], self.offsets[field + 1]
+            distances[start:end] = stored.ravel()
+            directions[start:end] = field_directions.ravel()
+        return FlowFields(self.__room_index, self.__positions, self.keys, self.regions, self.offsets, distances,
+                          directions)
+
+    def distance(self, room: int, door: int, point: tuple[int, int]):
+        """Rounded cost of the path from the (x, y) point to the door inside the room, None if not known"""
+        field = self.__fields.get((room, door))
+        if field is None:
+            return None
+        index = self.__flat_index(field, point)
+        if index is None or self.distances[index] == UNREACHABLE:
+            return None
+        return int(self.distances[index])
+
+    def leg(self, start: tuple[int, int], end: tuple[int, int], dense: bool = True):
+        """Pixel path between two (x, y) points of one room, if one of them is a door with a field in that room.
+        :arg dense: if False, only the points where the path changes direction are returned (like the jump points
+        of JumpPointSearch, JumpPointSearch.expand makes them dense again)
+        :returns: list of (y, x) tuples from start to end, or None if no field covers the leg"""
+        end_door = self.__door_indices.get((int(end[0]), int(end[1])))
+        start_door = self.__door_indices.get((int(start[0]), int(start[1])))
+        if end_door is not None:
+            path = self.__walk_to_door(start, start_door, end_door)
+        elif start_door is not None:
+            path = self.__walk_to_door(end, None, start_door)
+            if path is not None:
+                path.reverse()
+        else:
+            return None
+        if path is None or dense:
+            return path
+        return [point for previous, point, following in zip([None] + path[:-1], path, path[1:] + [None])
+                if previous is None or following is None or
+                (point[0] - previous[0], point[1] - previous[1]) != (following[0] - point[0], following[1] - point[1])]
+
+    def __walk_to_door(self, point: tuple[int, int], point_door, door: int):
+        """Follow the field of the door in a room shared with the point (a plain point or another door)"""
+        if point_door is not None:
+            rooms = [room for room in self.__door_rooms.get(point_door, ()) if room in self.__door_rooms.get(door, ())]
+        else:
+            rooms = self.__room_index.rooms_at(point)
+        for room in rooms:
+            field = self.__fields.get((room, door))
+            if field is None:
+                continue
+            path = self.__walk(field, point)
+            if path is not None:
+                return path
+        return None
+
+    def __flat_index(self, field: int, point: tuple[int, int]):
+        left, top, width, height = self.regions[field].tolist()
+        column, row = int(point[0]) - left, int(point[1]) - top
+        if not (0 <= column < width and 0 <= row < height):
+            return None
+        return int(self.offsets[field]) + row * width + column
+
+    def __walk(self, field: int, point: tuple[int, int]):
+        index = self.__flat_index(field, point)
+        if index is None or self.distances[index] == UNREACHABLE:
+            return None
+        width = int(self.regions[field][2])
+        steps = [dy * width + dx for dy, dx in self.__moves]
+        directions = self.directions
+
+        y, x = int(point[1]), int(point[0])
+        path = [(y, x)]
+        direction = int(directions[index])
+        while direction != NO_DIRECTION:
+            dy, dx = self.__moves[direction]
+            y += dy
+            x += dx
+            index += steps[direction]
+            path.append((y, x))
+            direction = int(directions[index])
+        return path
@@ -0,0 +1,77 @@
+import time
+from contextlib import contextmanager, nullcontext
+
+_DISABLED = nullcontext()
+
+
+class LegStats:
+    """Search counters of one waypoint to waypoint pixel search"""
+
+    def __init__(self, start: tuple, end: tuple, seconds: float, expanded: int, generated: int, peak_open: int,
+                 path_length: int):
+        self.start = start  # (x, y)
+        self.end = end
+        self.seconds = seconds
+        self.expanded = expanded  # Nodes taken off the open list and expanded
+        self.generated = generated  # Nodes pushed onto the open list
+        self.peak_open = peak_open  # Largest size of the open list
+        self.path_length = path_length  # Number of points in the leg, 0 if no path was found
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+
+class StatsHook:
+    """Base class of the callbacks of Stats, override the methods to feed another metrics system"""
+
+    def on_stage(self, stage: str, seconds: float):
+        """Called when a timed stage finishes"""
+
+    def on_leg(self, leg: LegStats):
+        """Called when a pixel leg search finishes"""
+
+
+class Stats:
+    """Wall-clock time per stage and per leg search counters, filled by MapLoader, Map and PathMaker
+    when passed to them. Nothing is measured when no Stats object is given."""
+
+    def __init__(self, hooks: list[StatsHook] = ()):
+        self.stages = {}  # Stage name -> seconds, summed if a stage runs more than once
+        self.legs = []  # LegStats of every pixel leg, in order
+        self.hooks = list(hooks)
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time the code in the with block as the given stage"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - started)
+
+    def add_stage(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        for hook in self.hooks:
+            hook.on_stage(name, seconds)
+
+    def add_leg(self, leg: LegStats):
+        self.legs.append(leg)
+        for hook in self.hooks:
+            hook.on_leg(leg)
+
+    @property
+    def expanded(self) -> int:
+        return sum(leg.expanded for leg in self.legs)
+
+    @property
+    def generated(self) -> int:
+        return sum(leg.generated for leg in self.legs)
+
+    def as_dict(self) -> dict:
+        return {'stages': dict(self.stages), 'legs': [leg.as_dict() for leg in self.legs],
+                'expanded': self.expanded, 'generated': self.generated}
+
+
+def timed(stats: Stats, stage: str):
+    """stats.stage(stage), or a context manager doing nothing if stats is None"""
+    return _DISABLED if stats is None else stats.stage(stage)
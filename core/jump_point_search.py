@@ -0,0 +1,177 @@
+import heapq
+
+from core.pixel_search import SQRT2, GridSearch
+
+
+def _sign(value: int) -> int:
+    return (value > 0) - (value < 0)
+
+
+class JumpPointSearch(GridSearch):
+    """Jump Point Search over the walkable pixels of an OccupancyGrid (or a thresholded maze array, 255 - free pixel).
+    Uses the same movement rules and search state as PixelAStar (8-connected, diagonal cost sqrt(2), no cutting wall
+    corners), so both return paths of equal cost, but only the jump points are pushed onto the open list.
+    The grid is padded with a one pixel wall border, so the scans need no bounds checks."""
+
+    def search(self, start: tuple[int, int], end: tuple[int, int], expand: bool = True):
+        """Find the path between two (y, x) pixels.
+        :arg expand: if True, the jump points are joined back into a dense, pixel by pixel path
+        :returns: list of (y, x) tuples from start to end (both included) or None if the end is unreachable"""
+        start_index, end_index, open_heap = self._start_search(start, end)
+        seen_id = self._search_id
+        closed_id = seen_id + 1
+        width = self._width
+        g_score = self._g
+        parent = self._parent
+        stamps = self._stamps
+        end_y, end_x = divmod(end_index, width)
+
+        expanded = 0
+        generated = 1
+        peak_open = 1
+        while open_heap:
+            current = heapq.heappop(open_heap)[2]
+            if stamps[current] == closed_id:  # Stale heap entry
+                continue
+            stamps[current] = closed_id
+            expanded += 1
+            g = g_score[current]
+
+            if current == end_index:  # Found the destination
+                self._store_counters(expanded, generated, peak_open)
+                jump_points = self._reconstruct(current)
+                return self.expand(jump_points) if expand else jump_points
+
+            y, x = divmod(current, width)
+            for dy, dx in self.__pruned_directions(current, int(parent[current])):
+                jump_point = self.__jump(y, x, dy, dx, end_index)
+                if jump_point == -1 or stamps[jump_point] == closed_id:
+                    continue
+
+                jy, jx = divmod(jump_point, width)
+                distance_y = abs(jy - y)
+                distance_x = abs(jx - x)
+                new_g = g + max(distance_x, distance_y) + (SQRT2 - 1) * min(distance_x, distance_y)
+                if stamps[jump_point] == seen_id and new_g >= g_score[jump_point]:
+                    continue
+                stamps[jump_point] = seen_id
+                g_score[jump_point] = new_g
+                parent[jump_point] = current
+
+                ady = abs(jy - end_y)
+                adx = abs(jx - end_x)
+                h = max(adx, ady) + (SQRT2 - 1) * min(adx, ady)
+                heapq.heappush(open_heap, (new_g + h, h, jump_point))
+                generated += 1
+
+            if len(open_heap) > peak_open:
+                peak_open = len(open_heap)
+
+        self._store_counters(expanded, generated, peak_open)
+        return None
+
+    @staticmethod
+    def expand(jump_points: list[tuple[int, int]]) -> list[tuple[int, int]]:
+        """Join consecutive jump points, which always lie on one straight or diagonal line, pixel by pixel"""
+        if not jump_points:
+            return []
+        path = [jump_points[0]]
+        for (y, x), (next_y, next_x) in zip(jump_points, jump_points[1:]):
+            dy = _sign(next_y - y)
+            dx = _sign(next_x - x)
+            while (y, x) != (next_y, next_x):
+                y += dy
+                x += dx
+                path.append((y, x))
+        return path
+
+    def __pruned_directions(self, index: int, parent_index: int):
+        """Directions worth scanning from the given cell, depending on the direction it was reached from"""
+        grid = self._cells
+        width = self._width
+        directions = []
+
+        if parent_index == -1:  # Start node - every allowed move
+            for dy in (-1, 0, 1):
+                for dx in (-1, 0, 1):
+                    if (dy or dx) and grid[index + dy * width + dx] and (
+                            not (dy and dx) or (grid[index + dx] and grid[index + dy * width])):
+                        directions.append((dy, dx))
+            return directions
+
+        y, x = divmod(index, width)
+        parent_y, parent_x = divmod(parent_index, width)
+        dy = _sign(y - parent_y)
+        dx = _sign(x - parent_x)
+
+        if dy and dx:
+            vertical = grid[index + dy * width]
+            horizontal = grid[index + dx]
+            if vertical:
+                directions.append((dy, 0))
+            if horizontal:
+                directions.append((0, dx))
+            if vertical and horizontal:
+                directions.append((dy, dx))
+        elif dx:
+            ahead = grid[index + dx]
+            above = grid[index - width]
+            below = grid[index + width]
+            if ahead:
+                directions.append((0, dx))
+                if above:
+                    directions.append((-1, dx))
+                if below:
+                    directions.append((1, dx))
+            if above:
+                directions.append((-1, 0))
+            if below:
+                directions.append((1, 0))
+        else:
+            ahead = grid[index + dy * width]
+            left = grid[index - 1]
+            right = grid[index + 1]
+            if ahead:
+                directions.append((dy, 0))
+                if left:
+                    directions.append((dy, -1))
+                if right:
+                    directions.append((dy, 1))
+            if left:
+                directions.append((0, -1))
+            if right:
+                directions.append((0, 1))
+        return directions
+
+    def __jump(self, y: int, x: int, dy: int, dx: int, end_index: int) -> int:
+        """Scan from (y, x) in the given direction until a jump point is found.
+        :returns: flat index of the jump point or -1 if the scan hits a wall"""
+        grid = self._cells
+        width = self._width
+        step = dy * width + dx
+        index = y * width + x
+
+        while True:
+            index += step
+            if not grid[index]:
+                return -1
+            if index == end_index:
+                return index
+
+            if dy and dx:
+                # A diagonal cell is a jump point if any straight scan started from it finds one
+                cell_y, cell_x = divmod(index, width)
+                if (self.__jump(cell_y, cell_x, 0, dx, end_index) != -1 or
+                        self.__jump(cell_y, cell_x, dy, 0, end_index) != -1):
+                    return index
+                if not (grid[index + dx] and grid[index + dy * width]):
+                    return -1  # The next diagonal step would cut a wall corner
+            elif dx:
+                # Forced neighbour - a free cell beside the scan line which could not be reached diagonally before
+                if ((grid[index - width] and not grid[index - width - dx]) or
+                        (grid[index + width] and not grid[index + width - dx])):
+                    return index
+            else:
+                if ((grid[index - 1] and not grid[index - 1 - step]) or
+                        (grid[index + 1] and not grid[index + 1 - step])):
+                    return index
@@ -1,6 +1,15 @@
+import hashlib
+
+import numpy as np
 from numpy import ndarray
 from typing import Self
 
+from core.flow_field import FlowFields
+from core.instrumentation import Stats, timed
+from core.occupancy import OccupancyGrid, occupancy_grid_from_image
+from core.room_index import NO_ROOM, RoomIndex
+from core.waypoint_graph import WaypointGraph
+
 
 class Waypoint:
     """Used to create map of waypoints, similar concept to the double-linked array,
@@ -12,24 +21,112 @@ class Waypoint:
         self.position = position  # Waypoint position (x, y)
 
 
+class MapQuery:
+    """Start and end waypoints of a single path query, attached to the Map as an overlay.
+    The endpoints know their accessible waypoints, and the connections back to the endpoints are kept here
+    instead of in the shared waypoints, so the Map is never modified"""
+
+    def __init__(self, start: Waypoint, end: Waypoint):
+        self.start = start
+        self.end = end
+        self.__overlay = {}  # id(map waypoint) -> endpoints accessible from it
+        for endpoint in (start, end):
+            for waypoint in endpoint.accessible_waypoints:
+                if waypoint is not start and waypoint is not end:
+                    self.__overlay.setdefault(id(waypoint), []).append(endpoint)
+
+    def accessible_waypoints(self, waypoint: Waypoint) -> list[Waypoint]:
+        """Waypoints accessible from the given one, including the endpoints of this query"""
+        endpoints = self.__overlay.get(id(waypoint))
+        if endpoints is None:
+            return waypoint.accessible_waypoints
+        return waypoint.accessible_waypoints + endpoints
+
+
 class Map:
     """Built with Waypoint class elements and an Image,
     enables algorithms to find the way from Waypoint A to Waypoint B"""
 
-    def __init__(self, image: ndarray, waypoints: list[Waypoint]):
+    def __init__(self, image: ndarray, waypoints: list[Waypoint], occupancy: OccupancyGrid = None,
+                 room_index: RoomIndex = None, waypoint_graph: WaypointGraph = None, flow_fields: FlowFields = None,
+                 content_hash: str = None):
         self.__image = image
         self.__waypoints = waypoints
+        self.__occupancy = occupancy  # Walkable pixels, see get_occupancy_grid
+        self.__owns_occupancy = False  # The given occupancy may be shared, it is copied before the first update
+        self.__loaded_occupancy = None  # Occupancy before the first update, set by the copy
+        self.__room_index = room_index  # Without the index points are located by scanning all the waypoints
+        self.__base_waypoint_count = len(waypoints)  # Waypoints added later are not in the room index nor the graph
+        self.__waypoint_graph = waypoint_graph  # Built on demand if not given
+        self.__flow_fields = flow_fields  # Optional, see build_flow_fields
+        self.__open_waypoint_graph = None  # Waypoint graph with every door open, set once a door gets blocked
+        self.__closed_doors = set()  # Doors (waypoint indices) blocked by obstacles
+        self.__content_hash = content_hash  # See content_hash, computed on demand if None
 
-    def locate_and_add_point(self, point: tuple[int, int]):
+    def locate_and_add_point(self, point: tuple[int, int], stats: Stats = None):
         """Should be used for adding a starting or ending point of the path.
         Locate waypoint in one of the waypoints accessible areas,
         create a list of accessible waypoints for this point and add a point as a waypoint.
+        This modifies the map, use query to find paths without changing it.
+        :arg stats: if given, the time of locating the point is added to its 'locate' stage
         """
+        with timed(stats, 'locate'):
+            located = self.__locate(point)
+        if located is None:
+            return False
 
-        # Checking if the pixel value is [255, 255, 255] (white colour)
-        for pixel_value in self.__image[point[1]][point[0]]:  # Numpy would return an iterable of bool objects on __eq__
-            if pixel_value != 255:
-                return False
+        point_areas, point_accessible_waypoints = located
+        new_waypoint = Waypoint(point_accessible_waypoints, point_areas, point)
+        self.__waypoints.append(new_waypoint)
+        for waypoint in point_accessible_waypoints:
+            waypoint.accessible_waypoints.append(new_waypoint)
+
+        return True
+
+    def query(self, start_point: tuple[int, int], end_point: tuple[int, int], stats: Stats = None):
+        """Create the start and end waypoints of a path query without modifying the map.
+        Since the map is only read, any number of threads can run queries on one Map at the same time
+        (as long as nobody calls locate_and_add_point, add_waypoint or update_obstacles on it meanwhile - they change
+        the waypoints, the occupancy grid, the image and the waypoint graph shared by the queries).
+        :arg stats: if given, the time of locating the points is added to its 'locate' stage
+        :returns: MapQuery, or None if any of the points is not in the "blank" space of a room"""
+        with timed(stats, 'locate'):
+            located_start = self.__locate(start_point)
+            located_end = self.__locate(end_point)
+        if located_start is None or located_end is None:
+            return None
+
+        start = Waypoint(list(located_start[1]), located_start[0], start_point)
+        end = Waypoint(list(located_end[1]), located_end[0], end_point)
+        if any(area in end.accessible_areas for area in start.accessible_areas):  # Both points in the same room
+            start.accessible_waypoints.append(end)
+            end.accessible_waypoints.append(start)
+        return MapQuery(start, end)
+
+    def __locate(self, point: tuple[int, int]):
+        """Find the areas of the point and the waypoints accessible from it, without modifying the map.
+        :returns: (areas, accessible waypoints) or None if the point is not in the "blank" space of a room"""
+        if self.__image is None:  # Headless map (CompiledMap.to_map), located on the occupancy grid
+            occupancy = self.__occupancy
+            # Outside of the grid, negative coordinates would wrap around to the other side
+            if not (0 <= point[0] < occupancy.width and 0 <= point[1] < occupancy.height):
+                return None
+            # Free pixels are the white ones and the doors, which the room index rejects
+            if not occupancy.walkable[point[1], point[0]]:
+                return None
+        else:
+            # Outside of the image, negative coordinates would wrap around to the other side
+            height, width = self.__image.shape[:2]
+            if not (0 <= point[0] < width and 0 <= point[1] < height):
+                return None
+
+            # Checking if the pixel value is [255, 255, 255] (white colour)
+            for pixel_value in self.__image[point[1]][point[0]]:  # Numpy would return an iterable of bool objects
+                if pixel_value != 255:
+                    return None
+
+        if self.__room_index is not None:
+            return self.__locate_indexed(point)
 
         point_area = None
         point_accessible_waypoints = []
@@ -42,7 +139,7 @@ class Map:
                         point_area = waypoint_area
 
         if not point_area:  # The point is not in any of the available areas, thus, calculating the path is impossible
-            return False
+            return None
 
         for waypoint in self.__waypoints:
             waypoint_areas = waypoint.accessible_areas
@@ -50,20 +147,191 @@ class Map:
                 if point_area == waypoint_area:
                     point_accessible_waypoints.append(waypoint)
 
-        new_waypoint = Waypoint(point_accessible_waypoints, [point_area], point)
-        self.__waypoints.append(new_waypoint)
-        for waypoint in point_accessible_waypoints:
-            waypoint.accessible_waypoints.append(new_waypoint)
+        return [point_area], point_accessible_waypoints
 
-        return True
+    def __locate_indexed(self, point: tuple[int, int]):
+        """__locate using the room label image, a point in overlapping rooms gets access to all of them"""
+        rooms = self.__room_index.rooms_at(point)  # Empty for points on doors or outside of the rooms
+        if not rooms:
+            return None
+
+        point_areas = [self.__room_index.room_areas[room] for room in rooms]
+        point_accessible_waypoints = []
+        for room in rooms:
+            for waypoint_index in self.__room_index.room_doors[room]:
+                waypoint = self.__waypoints[waypoint_index]
+                if waypoint not in point_accessible_waypoints:
+                    point_accessible_waypoints.append(waypoint)
+
+        # Points added earlier with locate_and_add_point are not in the index
+        for waypoint in self.__waypoints[self.__base_waypoint_count:]:
+            if waypoint not in point_accessible_waypoints and any(
+                    area in point_areas for area in waypoint.accessible_areas):
+                point_accessible_waypoints.append(waypoint)
+
+        return point_areas, point_accessible_waypoints
+
+    def get_room_index(self):
+        return self.__room_index
+
+    def get_waypoint_graph(self) -> WaypointGraph:
+        """Array form of the waypoints the map was created with (without the points added later)"""
+        if self.__waypoint_graph is None:
+            self.__waypoint_graph = WaypointGraph.from_waypoints(self.__waypoints[:self.__base_waypoint_count])
+        return self.__waypoint_graph
+
+    def get_flow_fields(self) -> FlowFields:
+        """Per door flow fields of the rooms if they were built, None otherwise"""
+        return self.__flow_fields
+
+    def build_flow_fields(self, stats: Stats = None) -> FlowFields:
+        """Precompute the flow fields of every door over each of its rooms (see FlowFields.build),
+        so PathMaker can follow them instead of searching the legs which start or end at a door.
+        :arg stats: if given, the time of building the fields is added to its 'flow_fields' stage"""
+        with timed(stats, 'flow_fields'):
+            occupancy = self.get_occupancy_grid()
+            room_index = self.__room_index
+            if room_index is None:
+                room_index = RoomIndex.from_waypoints((occupancy.height, occupancy.width),
+                                                      self.__waypoints[:self.__base_waypoint_count])
+            self.__flow_fields = FlowFields.build(occupancy.walkable, room_index,
+                                                  self.get_waypoint_graph().positions)
+        return self.__flow_fields
+
+    def update_obstacles(self, mask: ndarray, origin: tuple[int, int] = (0, 0), blocked: bool = True,
+                         stats: Stats = None):
+        """Place obstacles on the pixels set in the mask (or remove them if blocked is False) without reloading the map.
+        The occupancy grid and the image (if any) are patched in place, the flow fields overlapping the change are
+        computed again and the doors whose position gets blocked are closed (get_closed_doors, the waypoint graph)
+        and opened again when cleared. Obstacles are only removed inside the rooms and from the doors, so walls can't
+        be cleared (without a room index only from the pixels which were free when the map was loaded).
+        PathMakers and replanners made before the update are refreshed with their update methods.
+        :arg mask: (height, width) bool array
+        :arg origin: (x, y) position of the upper left corner of the mask on the map
+        :arg stats: if given, the time of the update is added to its 'map_update' stage
+        :returns: changed rectangle ((x_min, y_min), (x_max, y_max)), None if no pixel changed"""
+        with timed(stats, 'map_update'):
+            occupancy = self.__writable_occupancy()
+            height, width = occupancy.height, occupancy.width
+            mask = np.asarray(mask, dtype=bool)
+            left, top = max(int(origin[0]), 0), max(int(origin[1]), 0)
+            right = min(int(origin[0]) + mask.shape[1], width)
+            bottom = min(int(origin[1]) + mask.shape[0], height)
+            if left >= right or top >= bottom:
+                return None
+
+            mask = mask[top - int(origin[1]):bottom - int(origin[1]), left - int(origin[0]):right - int(origin[0])]
+            region = occupancy.walkable[top:bottom, left:right]
+            doors = None
+            if blocked:
+                changed = mask & region
+            else:
+                changed = mask & ~region
+                if self.__room_index is not None:
+                    doors = np.zeros_like(changed)
+                    if self.__room_index.door_mask is not None:
+                        doors = changed & self.__room_index.door_mask[top:bottom, left:right]
+                    changed &= self.__room_index.labels[top:bottom, left:right] != NO_ROOM
+                    changed |= doors
+                else:
+                    changed &= self.__loaded_occupancy.walkable[top:bottom, left:right]
+            if not changed.any():
+                return None
+            if self.__image is not None:  # A headless map has no image to patch
+                image = self.__image[top:bottom, left:right]
+                # Obstacles are black on the prepared image, like walls
+                image[changed] = (0, 0, 0) if blocked else (255, 255, 255)
+                if doors is not None:
+                    image[doors] = (0, 255, 0)  # Default door colour of MapLoader
+            occupancy.write(left, top, region ^ changed)
+
+            rows, columns = np.nonzero(changed)
+            rectangle = ((left + int(columns.min()), top + int(rows.min())),
+                         (left + int(columns.max()), top + int(rows.max())))
+            self.__update_doors(rectangle)
+            if self.__content_hash is not None:
+                # Chained with the changed pixels instead of hashing the whole grid again
+                digest = hashlib.sha256(self.__content_hash.encode())
+                digest.update(repr(rectangle).encode())
+                (x_min, y_min), (x_max, y_max) = rectangle
+                digest.update(np.ascontiguousarray(occupancy.walkable[y_min:y_max + 1, x_min:x_max + 1]))
+                self.__content_hash = digest.hexdigest()
+            if self.__flow_fields is not None:
+                self.__flow_fields = self.__flow_fields.rebuilt(occupancy.walkable, rectangle)
+        return rectangle
+
+    def update_rectangle(self, left_upper_corner: tuple[int, int], right_bottom_corner: tuple[int, int],
+                         blocked: bool = True, stats: Stats = None):
+        """update_obstacles on every pixel of the rectangle, corners (x, y) included"""
+        width = right_bottom_corner[0] - left_upper_corner[0] + 1
+        height = right_bottom_corner[1] - left_upper_corner[1] + 1
+        if width <= 0 or height <= 0:
+            return None
+        return self.update_obstacles(np.ones((height, width), dtype=bool), left_upper_corner, blocked, stats)
+
+    def __update_doors(self, rectangle: tuple):
+        """Close the doors of the rectangle whose position is blocked, open the others"""
+        (x_min, y_min), (x_max, y_max) = rectangle
+        open_graph = self.__open_waypoint_graph
+        if open_graph is None:
+            open_graph = self.get_waypoint_graph()
+        positions = open_graph.positions
+        inside = np.flatnonzero((positions[:, 0] >= x_min) & (positions[:, 0] <= x_max) &
+                                (positions[:, 1] >= y_min) & (positions[:, 1] <= y_max))
+        closed_doors = set(self.__closed_doors)
+        for door in inside.tolist():
+            x, y = positions[door].tolist()
+            if self.__occupancy.walkable[y, x]:
+                closed_doors.discard(door)
+            else:
+                closed_doors.add(door)
+        if closed_doors == self.__closed_doors:
+            return
+
+        self.__open_waypoint_graph = open_graph
+        self.__closed_doors = closed_doors
+        self.__waypoint_graph = open_graph.without_doors(closed_doors) if closed_doors else open_graph
+
+    def get_closed_doors(self) -> frozenset[int]:
+        """Doors (indices in get_waypoints) blocked by obstacles, closed in the waypoint graph too"""
+        return frozenset(self.__closed_doors)
+
+    def __writable_occupancy(self) -> OccupancyGrid:
+        """The occupancy grid, copied first if it may be shared - searches made before keep the grid they were given"""
+        occupancy = self.get_occupancy_grid()
+        if not self.__owns_occupancy:
+            self.__loaded_occupancy = occupancy
+            self.__occupancy = occupancy.copy()
+            self.__owns_occupancy = True
+        return self.__occupancy
+
+    def content_hash(self) -> str:
+        """Hash of the map content the paths depend on (the occupancy grid and the doors), the key of the map in
+        QueryCache. Maps compiled from one image share the hash of the image, every update_obstacles changes it."""
+        if self.__content_hash is None:
+            walkable = np.ascontiguousarray(self.get_occupancy_grid().walkable)
+            digest = hashlib.sha256(repr(walkable.shape).encode())
+            digest.update(walkable)
+            digest.update(np.ascontiguousarray(self.get_waypoint_graph().positions))
+            self.__content_hash = digest.hexdigest()
+        return self.__content_hash
 
     def get_waypoints(self) -> list[Waypoint]:
         """Get all waypoints from this map"""
         return self.__waypoints
 
     def get_image(self):
+        """Prepared BGR image, None for a headless map (CompiledMap.to_map(headless=True))"""
         return self.__image
 
+    def get_occupancy_grid(self) -> OccupancyGrid:
+        """Walkable pixels of the map, read-only and handed to every search without copying (its walkable view is
+        the (height, width) bool array). Thresholded from the image on the first call if the map was not compiled,
+        update_obstacles patches it (a copy of it on the first update)."""
+        if self.__occupancy is None:
+            self.__occupancy = OccupancyGrid.from_thresholded(occupancy_grid_from_image(self.__image))
+        return self.__occupancy
+
     def add_waypoint(self, accessible_waypoints: list, waypoint_areas: list, waypoint_position: tuple[int, int]):
         """Add a waypoint to the waypoints list"""
         waypoint = Waypoint(accessible_waypoints, waypoint_areas, waypoint_position)
@@ -0,0 +1,253 @@
+import hashlib
+import os
+import zipfile
+
+import numpy as np
+from numpy import ndarray
+
+from core.flow_field import FlowFields
+from core.map import Map, Waypoint
+from core.map_loader import Area, MapLoader
+from core.occupancy import OccupancyGrid, occupancy_grid_from_image
+from core.room_index import RoomIndex
+from core.waypoint_graph import WaypointGraph
+
+COMPILED_MAP_VERSION = 3
+CACHE_DIRECTORY_NAME = '.map_cache'
+FLOW_FIELD_ARRAYS = ('flow_keys', 'flow_regions', 'flow_offsets', 'flow_distances', 'flow_directions')
+
+
+def image_hash(img_path: str) -> str:
+    """SHA-256 of the image file content, used as the key of the compiled map"""
+    digest = hashlib.sha256()
+    with open(img_path, 'rb') as image_file:
+        for chunk in iter(lambda: image_file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _offsets_and_indices(lists: list[list[int]]) -> tuple[ndarray, ndarray]:
+    """Pack a list of index lists into (offsets, indices), list i is indices[offsets[i]:offsets[i + 1]]"""
+    offsets = np.zeros(len(lists) + 1, dtype=np.int32)
+    offsets[1:] = np.cumsum([len(indices) for indices in lists])
+    indices = np.fromiter((index for indices in lists for index in indices), dtype=np.int32, count=int(offsets[-1]))
+    return offsets, indices
+
+
+class CompiledMap:
+    """Processed map - rooms, doors, waypoint adjacency, occupancy grid and image - stored as flat arrays.
+    Can be saved to / loaded from a single .npz file and turned into a ready Map without running MapLoader."""
+
+    def __init__(self, source_hash: str, image: ndarray, occupancy: ndarray, waypoint_positions: ndarray,
+                 room_areas: ndarray, room_door_offsets: ndarray, room_door_indices: ndarray,
+                 adjacency_offsets: ndarray, adjacency_indices: ndarray, door_mask: ndarray,
+                 distances: ndarray = None, next_hops: ndarray = None, flow_keys: ndarray = None,
+                 flow_regions: ndarray = None, flow_offsets: ndarray = None, flow_distances: ndarray = None,
+                 flow_directions: ndarray = None, occupancy_grid: OccupancyGrid = None, room_labels: ndarray = None):
+        """
+        :arg occupancy_grid, room_labels: the padded grid and the label image of the RoomIndex if they already exist,
+        e.g. as views of the shared memory of core.batch - image and occupancy can then be None (headless to_map)"""
+        self.source_hash = source_hash
+        self.image = image  # Prepared BGR image (obstacles black)
+        self.occupancy = occupancy  # Thresholded image, 255 - free pixel
+        self.waypoint_positions = waypoint_positions  # (n, 2) door positions (x, y)
+        self.room_areas = room_areas  # (r, 4) room rectangles (x_min, y_min, x_max, y_max)
+        self.room_door_offsets = room_door_offsets  # Waypoints of room i are
+        self.room_door_indices = room_door_indices  # room_door_indices[room_door_offsets[i]:room_door_offsets[i + 1]]
+        self.adjacency_offsets = adjacency_offsets  # Same layout for the waypoints accessible from waypoint i
+        self.adjacency_indices = adjacency_indices
+        self.door_mask = door_mask  # (height, width) bool, True on door pixels
+        self.distances = distances  # Optional all-pairs waypoint distances and next hops, see WaypointGraph
+        self.next_hops = next_hops
+        # Optional per door flow fields, the arrays of FlowFields (keys, regions, offsets, distances, directions)
+        self.flow_keys = flow_keys
+        self.flow_regions = flow_regions
+        self.flow_offsets = flow_offsets
+        self.flow_distances = flow_distances
+        self.flow_directions = flow_directions
+        # Built on the first to_map and shared by every Map made afterwards
+        self.__room_index = None
+        self.__room_labels = room_labels
+        self.__waypoint_graph = None
+        self.__flow_fields = None
+        self.__occupancy_grid = occupancy_grid
+
+    @classmethod
+    def from_loader(cls, loader: MapLoader, source_hash: str = '', all_pairs: bool = False,
+                    flow_fields: bool = False):
+        """Flatten the Map created by the given loader"""
+        return cls.from_map(loader.get_map(), source_hash, all_pairs, flow_fields)
+
+    @classmethod
+    def from_map(cls, loaded_map: Map, source_hash: str = '', all_pairs: bool = False, flow_fields: bool = False):
+        """Flatten the given Map (its waypoints, rooms and image).
+        :arg all_pairs: precompute the all-pairs waypoint routing table (WaypointGraph.compute_all_pairs)
+        :arg flow_fields: precompute the per door flow fields (Map.build_flow_fields), if the map has none yet.
+        Fields the map already has are always kept"""
+        waypoints = loaded_map.get_waypoints()
+        waypoint_indices = {id(waypoint): index for index, waypoint in enumerate(waypoints)}
+
+        positions = []
+        for waypoint in waypoints:
+            position = waypoint.position
+            if isinstance(position, Area):
+                position = position.middle
+            positions.append((int(position[0]), int(position[1])))
+
+        image = loaded_map.get_image()
+        room_index = loaded_map.get_room_index()
+        if room_index is None:
+            room_index = RoomIndex.from_waypoints(image.shape, waypoints)
+
+        room_areas = np.array([(*area[0], *area[1]) for area in room_index.room_areas],
+                              dtype=np.int32).reshape(-1, 4)
+        room_door_offsets, room_door_indices = _offsets_and_indices(room_index.room_doors)
+        adjacency_offsets, adjacency_indices = _offsets_and_indices(
+            [[waypoint_indices[id(other)] for other in waypoint.accessible_waypoints] for waypoint in waypoints])
+
+        door_mask = room_index.door_mask
+        if door_mask is None:
+            door_mask = np.zeros(image.shape[:2], dtype=bool)
+        waypoint_positions = np.array(positions, dtype=np.int32).reshape(-1, 2)
+
+        distances = next_hops = None
+        if all_pairs:
+            graph = WaypointGraph(waypoint_positions, adjacency_offsets, adjacency_indices)
+            graph.compute_all_pairs()
+            distances, next_hops = graph.distances, graph.next_hops
+
+        fields = loaded_map.get_flow_fields()
+        if fields is None and flow_fields:
+            fields = loaded_map.build_flow_fields()
+        flow_arrays = {} if fields is None else {
+            'flow_keys': fields.keys, 'flow_regions': fields.regions, 'flow_offsets': fields.offsets,
+            'flow_distances': fields.distances, 'flow_directions': fields.directions}
+
+        return cls(source_hash, image, occupancy_grid_from_image(image), waypoint_positions, room_areas,
+                   room_door_offsets, room_door_indices, adjacency_offsets, adjacency_indices, door_mask,
+                   distances, next_hops, **flow_arrays)
+
+    @classmethod
+    def load(cls, path: str):
+        """Load the map saved with save"""
+        with np.load(path, allow_pickle=False) as data:
+            if int(data['version']) != COMPILED_MAP_VERSION:
+                raise ValueError(f"Compiled map '{path}' has version {int(data['version'])}, "
+                                 f"expected {COMPILED_MAP_VERSION}")
+            all_pairs = 'next_hops' in data.files
+            flow_arrays = {name: data[name] for name in FLOW_FIELD_ARRAYS if name in data.files}
+            return cls(str(data['source_hash']), data['image'], data['occupancy'], data['waypoint_positions'],
+                       data['room_areas'], data['room_door_offsets'], data['room_door_indices'],
+                       data['adjacency_offsets'], data['adjacency_indices'], data['door_mask'],
+                       data['distances'] if all_pairs else None, data['next_hops'] if all_pairs else None,
+                       **flow_arrays)
+
+    def save(self, path: str):
+        """Save the map as a single uncompressed .npz file (uncompressed, so loading is a plain read)"""
+        # Write to a temporary file first, so a concurrent reader never sees a half written artifact
+        temporary_path = f'{path}.{os.getpid()}.tmp.npz'
+        all_pairs = {} if self.next_hops is None else {'distances': self.distances, 'next_hops': self.next_hops}
+        flow_arrays = {} if self.flow_keys is None else {name: getattr(self, name) for name in FLOW_FIELD_ARRAYS}
+        np.savez(temporary_path, version=np.array(COMPILED_MAP_VERSION), source_hash=np.array(self.source_hash),
+                 image=self.image, occupancy=self.occupancy, waypoint_positions=self.waypoint_positions,
+                 room_areas=self.room_areas, room_door_offsets=self.room_door_offsets,
+                 room_door_indices=self.room_door_indices, adjacency_offsets=self.adjacency_offsets,
+                 adjacency_indices=self.adjacency_indices, door_mask=self.door_mask, **all_pairs, **flow_arrays)
+        os.replace(temporary_path, path)
+
+    def get_occupancy_grid(self) -> OccupancyGrid:
+        """Padded walkable grid of the map, built once and shared by every Map made by to_map"""
+        if self.__occupancy_grid is None:
+            self.__occupancy_grid = OccupancyGrid.from_thresholded(self.occupancy)
+        return self.__occupancy_grid
+
+    def get_room_index(self) -> RoomIndex:
+        """RoomIndex of the rooms, built once (its label image only if not given) and shared like the grid"""
+        if self.__room_index is None:
+            areas = [((int(x_min), int(y_min)), (int(x_max), int(y_max))) for x_min, y_min, x_max, y_max in
+                     self.room_areas.tolist()]
+            room_door_offsets = self.room_door_offsets.tolist()
+            room_door_indices = self.room_door_indices.tolist()
+            room_doors = [room_door_indices[room_door_offsets[room]:room_door_offsets[room + 1]]
+                          for room in range(len(areas))]
+            grid = self.get_occupancy_grid()
+            self.__room_index = RoomIndex((grid.height, grid.width), areas, room_doors, self.door_mask,
+                                          self.__room_labels)
+        return self.__room_index
+
+    def to_map(self, headless: bool = False) -> Map:
+        """Create a new Map (with its own image copy and waypoints) ready for locate_and_add_point and PathMaker.
+        The occupancy grid, room index, waypoint graph and flow fields are shared with the other Maps made.
+        :arg headless: the Map gets no image (nor a copy of it), only for searches - like the workers of core.batch"""
+        if not headless and self.image is None:
+            raise ValueError("The compiled map has no image, only a headless Map can be made")
+        room_index = self.get_room_index()
+        areas, room_doors = room_index.room_areas, room_index.room_doors
+        waypoints = [Waypoint([], [], (x, y)) for x, y in self.waypoint_positions.tolist()]
+        for area, doors in zip(areas, room_doors):
+            for index in doors:
+                waypoints[index].accessible_areas.append(area)
+
+        adjacency_offsets = self.adjacency_offsets.tolist()
+        adjacency_indices = self.adjacency_indices.tolist()
+        for index, waypoint in enumerate(waypoints):
+            waypoint.accessible_waypoints = [waypoints[other] for other in
+                                             adjacency_indices[adjacency_offsets[index]:adjacency_offsets[index + 1]]]
+
+        if self.__waypoint_graph is None:
+            self.__waypoint_graph = WaypointGraph(self.waypoint_positions, self.adjacency_offsets,
+                                                  self.adjacency_indices, distances=self.distances,
+                                                  next_hops=self.next_hops)
+        if self.__flow_fields is None and self.flow_keys is not None:
+            self.__flow_fields = FlowFields(room_index, self.waypoint_positions, self.flow_keys,
+                                            self.flow_regions, self.flow_offsets, self.flow_distances,
+                                            self.flow_directions)
+        image = None if headless else self.image.copy()
+        return Map(image, waypoints, occupancy=self.get_occupancy_grid(), room_index=room_index,
+                   waypoint_graph=self.__waypoint_graph, flow_fields=self.__flow_fields,
+                   content_hash=self.source_hash or None)
+
+
+def compile_map(img_path: str, output_path: str = None, all_pairs: bool = False, flow_fields: bool = False) -> str:
+    """Run MapLoader on the image and save the result.
+    :arg output_path: artifact path, by default <image directory>/.map_cache/<image hash>.npz
+    :arg all_pairs: also precompute the all-pairs waypoint routing table
+    :arg flow_fields: also precompute the per door flow fields
+    :returns: path of the saved artifact"""
+    source_hash = image_hash(img_path)
+    if output_path is None:
+        output_path = default_compiled_map_path(img_path, source_hash)
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    CompiledMap.from_loader(MapLoader(img_path), source_hash, all_pairs, flow_fields).save(output_path)
+    return output_path
+
+
+def default_compiled_map_path(img_path: str, source_hash: str = None) -> str:
+    if source_hash is None:
+        source_hash = image_hash(img_path)
+    return os.path.join(os.path.dirname(os.path.abspath(img_path)), CACHE_DIRECTORY_NAME, f'{source_hash}.npz')
+
+
+_loaded_maps: dict[str, CompiledMap] = {}  # Image hash -> compiled map, shared by every caller in this process
+
+
+def load_map(img_path: str) -> CompiledMap:
+    """Get the compiled map of the image - from memory, from the artifact cache or by compiling it.
+    Changing the image changes its hash, so a stale artifact is never used."""
+    source_hash = image_hash(img_path)
+    if source_hash in _loaded_maps:
+        return _loaded_maps[source_hash]
+
+    artifact_path = default_compiled_map_path(img_path, source_hash)
+    compiled_map = None
+    if os.path.exists(artifact_path):
+        try:
+            compiled_map = CompiledMap.load(artifact_path)
+        except (ValueError, OSError, KeyError, zipfile.BadZipFile):  # Outdated version or damaged file, compile again
+            compiled_map = None
+    if compiled_map is None or compiled_map.source_hash != source_hash:
+        compile_map(img_path, artifact_path)
+        compiled_map = CompiledMap.load(artifact_path)
+
+    _loaded_maps[source_hash] = compiled_map
+    return compiled_map
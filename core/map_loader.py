@@ -1,8 +1,9 @@
 import cv2
+import numpy as np
 
-from copy import copy
-
+from core.instrumentation import Stats, timed
 from core.map import Map, Waypoint
+from core.room_index import RoomIndex
 
 
 class Area:
@@ -34,63 +35,68 @@ class Room:
 
 class MapLoader:
     """Class for loading the map out of the given image"""
-    def __init__(self, img_path: str, door_colour: tuple = (0, 255, 0), obstacle_colour: tuple = (255, 0, 0)):
-        """Class for loading map from image path and creating Map object"""
-        self.__image = cv2.imread(img_path)
-        self.__obstacle_colour = obstacle_colour
-
-        self.__door_positions = self.__detect_areas(door_colour)
-        self.__rooms = []
-        self.__room_positions = self.__detect_areas((255, 255, 255), True)
-
-        self.__create_rooms()
-        self.__assign_doors_to_rooms()
+    def __init__(self, img_path: str, door_colour: tuple = (0, 255, 0), obstacle_colour: tuple = (255, 0, 0),
+                 stats: Stats = None):
+        """Class for loading map from image path and creating Map object
+        :arg stats: if given, the time of every loading stage is recorded in it (get_map included)"""
+        self.__stats = stats
+        with timed(stats, 'image_load'):
+            self.__image = cv2.imread(img_path)
+
+        # Every colour mask is computed once and shared by all the detection steps
+        with timed(stats, 'colour_masks'):
+            self.__obstacle_pixels = cv2.inRange(self.__image, obstacle_colour, obstacle_colour)
+            self.__door_pixels = cv2.inRange(self.__image, door_colour, door_colour)
+            # Obstacles are a part of the room they stand in, doors separate the rooms
+            room_pixels = cv2.bitwise_or(cv2.inRange(self.__image, (255, 255, 255), (255, 255, 255)),
+                                         self.__obstacle_pixels)
+
+        with timed(stats, 'door_detection'):
+            self.__door_positions = self.__detect_areas(self.__door_pixels)
+        with timed(stats, 'room_detection'):
+            self.__room_positions = self.__detect_areas(room_pixels, True)
+            self.__room_labels = RoomIndex.label_rooms(self.__image.shape, [
+                (room.left_upper_corner, room.right_bottom_corner) for room in self.__room_positions])
+
+        with timed(stats, 'door_assignment'):
+            self.__rooms = []
+            self.__create_rooms()
+            self.__assign_doors_to_rooms()
 
     def __prepare_image(self):
         """Change obstacle colour to black, so it will be treated the same as a wall"""
-        obstacle_pixels = cv2.inRange(self.__image, self.__obstacle_colour, self.__obstacle_colour)
-        self.__image[obstacle_pixels > 0] = (0, 0, 0)
+        cv2.subtract(self.__image, self.__image, dst=self.__image, mask=self.__obstacle_pixels)
         return self.__image
 
-    def __detect_areas(self, colour: tuple, room: bool = False, door_colour: tuple = (0, 255, 0)):
-        """Detect square areas based on the borders of certain colour"""
-        image_for_detection = copy(self.__image)
-        obstacle_pixels = cv2.inRange(self.__image, self.__obstacle_colour, self.__obstacle_colour)
-        image_for_detection[obstacle_pixels > 0] = (255, 255, 255)
-
-        door_pixels = cv2.inRange(image_for_detection, door_colour, door_colour)
-        if room:
-            image_for_detection[door_pixels > 0] = (0, 0, 0)
-
-        colour_pixels = cv2.inRange(image_for_detection, colour, colour)
-        ret, green_threshold = cv2.threshold(colour_pixels, 0, 255, 0)
-        contours, im2 = cv2.findContours(green_threshold, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-
-        area_list = []
-        for contour in contours:
-            x_min = contour[0][0][0]
-            y_min = contour[0][0][1]
-            x_max = contour[2][0][0]
-            y_max = contour[2][0][1]
-            if room:
-                area = Area((x_min - 1, y_min - 1), (x_max + 1, y_max + 1), [])
-            else:
-                area = Area((x_min, y_min), (x_max, y_max), [])
-
-            area_width = x_max - x_min
-            area_height = y_max - y_min
-
-            if room:
-                # in the used map, objects have border thicker than 3 pixels,
-                # and there were  detections of rooms with too small thickness
-                if not (area_width < 7) and not (area_height < 7) and (
-                        area_width < image_for_detection.shape[0] - 1) and (
-                        area_height < image_for_detection.shape[1] - 1):
-                    area_list.append(area)
-            else:  # case of door, doors have 3 pixels in width/height
-                area_list.append(area)
-
-        return area_list
+    @staticmethod
+    def __detect_areas(mask: np.ndarray, room: bool = False):
+        """Detect rectangular areas as the bounding boxes of the outer contours of the mask components"""
+        contours, hierarchy = cv2.findContours(mask, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
+        if not contours:
+            return []
+        # RETR_CCOMP gives outer boundaries (no parent) and holes, only the outer ones bound a component
+        boxes = np.array([cv2.boundingRect(contour) for contour, relations in zip(contours, hierarchy[0])
+                          if relations[3] == -1], dtype=np.int64).reshape(-1, 4)
+        x_min, y_min = boxes[:, 0], boxes[:, 1]
+        x_max = x_min + boxes[:, 2] - 1
+        y_max = y_min + boxes[:, 3] - 1
+
+        if not room:  # case of door, doors have 3 pixels in width/height
+            return [Area((x0, y0), (x1, y1), []) for x0, y0, x1, y1 in
+                    zip(x_min.tolist(), y_min.tolist(), x_max.tolist(), y_max.tolist())]
+
+        # in the used map, objects have border thicker than 3 pixels,
+        # and there were detections of rooms with too small thickness
+        area_width = x_max - x_min
+        area_height = y_max - y_min
+        image_height, image_width = mask.shape
+        accepted = (area_width >= 7) & (area_height >= 7) & (area_width < image_width - 1) & (
+                area_height < image_height - 1)
+
+        # The room area includes the surrounding wall pixels
+        return [Area((x0 - 1, y0 - 1), (x1 + 1, y1 + 1), []) for x0, y0, x1, y1 in
+                zip(x_min[accepted].tolist(), y_min[accepted].tolist(), x_max[accepted].tolist(),
+                    y_max[accepted].tolist())]
 
     def __create_rooms(self):
         """Create list of Room objects"""
@@ -98,63 +104,61 @@ class MapLoader:
             self.__rooms.append(Room(room_area))
 
     def __assign_doors_to_rooms(self):
-        """Calculate doors lying on the borders of rooms and assign them"""
-        for room_pos in self.__room_positions:
-            self.__rooms.append(Room(room_pos))
-
-        for room in self.__rooms:
-            for door in self.__door_positions:
-
-                if room.area.left_upper_corner[0] == door.right_bottom_corner[0]:
-                    if (door.right_bottom_corner[1] > room.area.left_upper_corner[1]) and (
-                            door.left_upper_corner[1] < room.area.right_bottom_corner[1]):
-                        room.add_door(door)
-
-                elif room.area.left_upper_corner[1] == door.right_bottom_corner[1]:
-                    if (door.right_bottom_corner > room.area.left_upper_corner) and (
-                            door.left_upper_corner[0] < room.area.right_bottom_corner[0]):
-                        room.add_door(door)
-
-                elif room.area.right_bottom_corner[0] == door.left_upper_corner[0]:
-                    if (door.right_bottom_corner[1] > room.area.left_upper_corner[1]) and (
-                            door.left_upper_corner[1] < room.area.right_bottom_corner[1]):
-                        room.add_door(door)
-
-                elif room.area.right_bottom_corner[1] == door.left_upper_corner[1]:
-                    if (door.right_bottom_corner > room.area.left_upper_corner) and (
-                            door.left_upper_corner[0] < room.area.right_bottom_corner[0]):
-                        room.add_door(door)
+        """Assign every door to the rooms found right behind each of its four sides in the room label image"""
+        if not self.__door_positions or not self.__rooms:
+            return
+        corners = np.array([(*door.left_upper_corner, *door.right_bottom_corner) for door in self.__door_positions])
+        x_min, y_min, x_max, y_max = corners.T
+        x_mid = (x_min + x_max) // 2
+        y_mid = (y_min + y_max) // 2
+
+        # Pixels just outside the right, left, bottom and top side of every door, shape (4, doors)
+        sample_x = np.stack([x_max + 1, x_min - 1, x_mid, x_mid])
+        sample_y = np.stack([y_mid, y_mid, y_max + 1, y_min - 1])
+        height, width = self.__room_labels.shape
+        inside = (sample_x >= 0) & (sample_x < width) & (sample_y >= 0) & (sample_y < height)
+        rooms = np.full(sample_x.shape, -1, dtype=np.int32)
+        rooms[inside] = self.__room_labels[sample_y[inside], sample_x[inside]]
+
+        for side_rooms in rooms:
+            for door_index, room_index in enumerate(side_rooms.tolist()):
+                if room_index >= 0 and self.__door_positions[door_index] not in self.__rooms[room_index].doors:
+                    self.__rooms[room_index].add_door(self.__door_positions[door_index])
 
     def get_map(self):
         """Create full list of waypoints and return Map object"""
+        with timed(self.__stats, 'waypoint_graph'):
+            return self.__create_map()
+
+    def __create_map(self):
         waypoints = []
+        waypoint_indices = {}  # Door position -> index of its waypoint
+        room_areas = []
+        room_waypoints = []  # Indices of the waypoints of every room
         for room in self.__rooms:
             accessible_area = tuple((room.area.left_upper_corner, room.area.right_bottom_corner))
+            indices = []
             for door in room.doors:
                 door_position = door.middle
-
-                if len(waypoints) == 0:
-                    waypoints.append(Waypoint([], [accessible_area], door))
-
-                new_waypoint = True
-                for waypoint in waypoints:
-                    if door_position == waypoint.position:
-                        new_waypoint = False
-                        if accessible_area not in waypoint.accessible_areas:
-                            waypoint.accessible_areas.append(accessible_area)
-
-                if new_waypoint:
-                    waypoints.append(Waypoint([], [accessible_area], door_position))
-
-        # Adding accessible waypoints to waypoints (creating connections)
-        for ind_current_waypoint, current_waypoint in enumerate(waypoints):
-            areas = current_waypoint.accessible_areas
-            for area in areas:
-                for ind_other_waypoint, other_waypoint in enumerate(waypoints):
-                    # The waypoint is different but has access to the same area
-                    if (not (ind_current_waypoint == ind_other_waypoint) and
-                            (area in other_waypoint.accessible_areas) and
-                            (other_waypoint not in current_waypoint.accessible_waypoints)):
-                        current_waypoint.accessible_waypoints.append(other_waypoint)
-
-        return Map(self.__prepare_image(), waypoints)
+                index = waypoint_indices.get(door_position)
+                if index is None:
+                    index = waypoint_indices[door_position] = len(waypoints)
+                    waypoints.append(Waypoint([], [], door_position))
+                if accessible_area not in waypoints[index].accessible_areas:
+                    waypoints[index].accessible_areas.append(accessible_area)
+                if index not in indices:
+                    indices.append(index)
+            room_areas.append(accessible_area)
+            room_waypoints.append(indices)
+
+        # Adding accessible waypoints to waypoints (creating connections), every pair of doors of a room is connected
+        connections = [dict() for _ in waypoints]  # Insertion ordered sets of accessible waypoint indices
+        for indices in room_waypoints:
+            for index in indices:
+                connections[index].update(dict.fromkeys(other for other in indices if other != index))
+        for waypoint, accessible in zip(waypoints, connections):
+            waypoint.accessible_waypoints = [waypoints[other] for other in accessible]
+
+        image = self.__prepare_image()
+        room_index = RoomIndex(image.shape, room_areas, room_waypoints, self.__door_pixels > 0, self.__room_labels)
+        return Map(image, waypoints, room_index=room_index)
@@ -0,0 +1,91 @@
+import cv2
+import numpy as np
+from numpy import ndarray
+
+
+def occupancy_grid_from_image(image: ndarray) -> ndarray:
+    """Thresholded greyscale image, 255 - free pixel, 0 - wall (the format used by the pixel searches)"""
+    return cv2.threshold(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), 128, 255, cv2.THRESH_BINARY)[1]
+
+
+class OccupancyGrid:
+    """Walkable pixels of a map (1 - free, 0 - wall) padded with a one pixel wall border, so the neighbour loops
+    of the searches need no bounds checks. The cells live in one buffer handed out without copying:
+    cells (flat read-only memoryview, fast to index from Python loops), padded and walkable (read-only NumPy views).
+    Pixel (y, x) is cell (y + 1) * padded_width + x + 1. Only the owner (Map) writes to it, through write."""
+
+    def __init__(self, height: int, width: int, buffer: bytearray = None):
+        """
+        :arg buffer: (height + 2) * (width + 2) cells, all walls if None - a bytearray, or any flat buffer read in
+        place, e.g. a read-only view of shared memory (write then fails, copy makes a writable grid)"""
+        self.height = height
+        self.width = width
+        self.padded_width = width + 2
+        self.__buffer = buffer if buffer is not None else bytearray((height + 2) * (width + 2))
+        self.cells = memoryview(self.__buffer).toreadonly()
+        self.padded = np.frombuffer(self.cells, dtype=np.uint8).reshape(height + 2, width + 2)
+        self.walkable = self.padded[1:-1, 1:-1].view(bool)  # (height, width)
+
+    @classmethod
+    def from_thresholded(cls, maze_array: ndarray):
+        """Grid of a thresholded image (255 - free pixel, anything else - wall), e.g. Map.get_occupancy_grid"""
+        height, width = maze_array.shape[:2]
+        grid = cls(height, width)
+        grid.write(0, 0, maze_array == 255)
+        return grid
+
+    @classmethod
+    def from_packed(cls, bits: ndarray, height: int, width: int):
+        """Grid of the bit-packed form made by packed"""
+        padded = np.unpackbits(bits, axis=1, count=width + 2)[:height + 2]
+        return cls(height, width, bytearray(padded.tobytes()))
+
+    def packed(self) -> ndarray:
+        """Bit-packed copy of the padded cells, (height + 2, ceil((width + 2) / 8)) uint8 - 1 bit per pixel to store
+        or send large maps, from_packed restores the grid"""
+        return np.packbits(self.padded, axis=1)
+
+    def copy(self):
+        return OccupancyGrid(self.height, self.width, bytearray(self.__buffer))
+
+    def write(self, left: int, top: int, free: ndarray):
+        """Set the pixels of the rectangle with the upper left corner (x, y) at (left, top) from the bool array"""
+        height, width = free.shape[:2]
+        cells = np.frombuffer(self.__buffer, dtype=np.uint8).reshape(self.height + 2, self.padded_width)
+        cells[top + 1:top + height + 1, left + 1:left + width + 1] = free
+
+    def is_free(self, point: tuple[int, int]) -> bool:
+        """Whether the (x, y) pixel is free, False outside of the map"""
+        x, y = int(point[0]), int(point[1])
+        if not (-1 <= x <= self.width and -1 <= y <= self.height):
+            return False
+        return self.cells[(y + 1) * self.padded_width + x + 1] == 1
+
+    def index(self, point: tuple[int, int]) -> int:
+        """Cell of the (y, x) pixel"""
+        return (int(point[0]) + 1) * self.padded_width + int(point[1]) + 1
+
+    def pixel(self, index: int) -> tuple[int, int]:
+        """(y, x) pixel of the cell"""
+        y, x = divmod(int(index), self.padded_width)
+        return y - 1, x - 1
+
+
+def as_occupancy_grid(occupancy) -> OccupancyGrid:
+    """The grid itself (not copied), or a new grid of a thresholded image"""
+    if isinstance(occupancy, OccupancyGrid):
+        return occupancy
+    return OccupancyGrid.from_thresholded(occupancy)
+
+
+def patched_grid(grid: OccupancyGrid, owned: bool, occupancy, rectangle: tuple) -> tuple[OccupancyGrid, bool]:
+    """Grid of a search after a map update of the rectangle ((x_min, y_min), (x_max, y_max)) - an OccupancyGrid is
+    taken as it is, the pixels of a thresholded image are written to the search's own grid (copied first if it was
+    not owned). :returns: the grid and whether the search owns it"""
+    if isinstance(occupancy, OccupancyGrid):
+        return occupancy, False
+    if not owned:
+        grid = grid.copy()
+    (x_min, y_min), (x_max, y_max) = rectangle
+    grid.write(x_min, y_min, occupancy[y_min:y_max + 1, x_min:x_max + 1] == 255)
+    return grid, True
@@ -1,11 +1,25 @@
 import math
+import time
+from operator import attrgetter
 
-import cv2
-
+import numpy as np
 from numpy import ndarray
 
-from core.map import Waypoint
+from core.any_angle import densify, smooth_path, turning_points
+from core.flow_field import FlowFields
+from core.instrumentation import LegStats, Stats, timed
+from core.map import MapQuery, Waypoint
+from core.query_cache import QueryCache
 from core.map_loader import Area
+from core.occupancy import OccupancyGrid, occupancy_grid_from_image
+from core.jump_point_search import JumpPointSearch
+from core.path_renderer import render_path
+from core.pixel_search import PixelAStar
+from core.waypoint_graph import WaypointGraph
+
+
+class PathNotFoundError(Exception):
+    """Raised when there is no path between the start and end point"""
 
 
 class Node:
@@ -26,36 +40,238 @@ class Node:
 
 
 class PathMaker:
-    """Class for calculation of the most optimal path between two points on the map. Uses the A* algorithm."""
-
-    def __init__(self, image: ndarray, waypoint_list: list[Waypoint]):
+    """Class for calculation of the most optimal path between two points on the map. Uses the A* algorithm,
+    first on the waypoints (doors) and then on the pixels between each pair of consecutive waypoints.
+    PathMaker keeps per search state, so each thread should use its own instance. The given image is never drawn on."""
+
+    def __init__(self, image: ndarray, waypoint_list: list[Waypoint], pixel_search: str = 'astar',
+                 dense_path: bool = True, occupancy: OccupancyGrid = None, waypoint_graph: WaypointGraph = None,
+                 flow_fields: FlowFields = None, headless: bool = True, any_angle: bool = False,
+                 query_cache: QueryCache = None, map_hash: str = None, closed_doors: frozenset[int] = frozenset()):
+        """
+        :arg image: BGR map image, only read (to threshold it and as the background of the rendered path),
+        can be None if headless and the occupancy is given
+        :arg pixel_search: algorithm used for the pixel stage, 'astar' or 'jps' (Jump Point Search)
+        :arg dense_path: used with 'jps' or any_angle, if False the pixel path contains only the jump points
+        (or the any-angle waypoints) of each leg
+        :arg occupancy: walkable pixels the pixel search reads in place (Map.get_occupancy_grid), so PathMakers of one
+        map share them, thresholded from the image if None
+        :arg waypoint_graph: array form of the first len(waypoint_graph) waypoints (Map.get_waypoint_graph),
+        if given the doors are routed on it instead of with the A* on the Waypoint objects
+        :arg flow_fields: per door flow fields of the map (Map.get_flow_fields), if given every leg starting or ending
+        at a door is followed down the field of that door instead of searched, the other legs are still searched
+        :arg headless: if True (the default, like for_map), make_path only searches - no explored pixels are
+        collected and no image is rendered (core.path_renderer can still draw the returned path), pass False and
+        the image to get the rendered path too
+        :arg any_angle: if True, every leg is smoothed by line of sight into straight segments of any angle, with
+        dense_path the segments are filled in with Bresenham lines
+        :arg query_cache: cache of door routes and door to door legs, possibly shared with other PathMakers,
+        needs the waypoint_graph and the map_hash (Map.content_hash) of the map
+        :arg closed_doors: indices (in waypoint_list) of the doors blocked by obstacles (Map.get_closed_doors),
+        the A* on the Waypoint objects doesn't pass them (the waypoint_graph of the map has them closed already)
+        """
+        if not headless and image is None:
+            raise ValueError("PathMaker needs the image to render the paths on, or headless=True")
         # For conversion and visual representation
         self.__mazeImg = image
-        self.__mazeImgGrey = cv2.cvtColor(self.__mazeImg, cv2.COLOR_BGR2GRAY)
+        self.__headless = headless
+        self.__explored = None  # Pixels generated by the pixel searches of the last make_path, if not headless
 
         # For the algorithm
-        self.__mazeArray = cv2.threshold(self.__mazeImgGrey, 128, 255, cv2.THRESH_BINARY)[1]
+        if occupancy is None:
+            if image is None:
+                raise ValueError("PathMaker needs the image or the occupancy")
+            occupancy = OccupancyGrid.from_thresholded(occupancy_grid_from_image(image))
+        self.__occupancy = occupancy
         self.__waypoint_list = waypoint_list
-
-    def make_path(self):
-        """Calculate the path between two points"""
-        # Calculating the path using the waypoint map
-        waypoint_path = self.__astar_for_waypoints(len(self.__waypoint_list) - 2, len(self.__waypoint_list) - 1)
+        if pixel_search not in ('astar', 'jps'):
+            raise ValueError(f"Unknown pixel search algorithm '{pixel_search}', expected 'astar' or 'jps'")
+        self.__jps = pixel_search == 'jps'
+        self.__pixel_search = None  # Created on the first searched leg, its arrays are as large as the image
+        self.__dense_path = dense_path
+        self.__any_angle = any_angle
+        self.__flow_fields = flow_fields
+        self.__searched = False  # Whether the last leg was searched (not read from a flow field or the query cache)
+
+        self.__closed_waypoints = {id(waypoint_list[door]) for door in closed_doors}
+        self.__waypoint_graph = waypoint_graph
+        if waypoint_graph is not None:
+            self.__graph_indices = {id(waypoint): index for index, waypoint in
+                                    enumerate(waypoint_list[:len(waypoint_graph)])}
+
+        if query_cache is not None and (waypoint_graph is None or map_hash is None):
+            raise ValueError("PathMaker needs the waypoint_graph and the map_hash to use the query_cache")
+        self.__query_cache = query_cache
+        self.__map_hash = map_hash
+        self.__leg_form = (pixel_search, dense_path, any_angle)  # The shape of a cached leg depends on these
+        if query_cache is not None:
+            self.__door_positions = set(map(tuple, waypoint_graph.positions.tolist()))
+
+    @classmethod
+    def for_map(cls, loaded_map, headless: bool = True, **options):
+        """PathMaker using everything the Map has prepared - its occupancy grid, waypoint graph, closed doors,
+        flow fields (if built) and, with a query_cache, its content hash. Any of them can be replaced by a keyword
+        argument, e.g. waypoint_graph=None routes the doors with the A* on the Waypoint objects.
+        :arg loaded_map: Map (annotated loosely, core.map can't import this module)
+        :arg headless: True by default, like the constructor - if False, paths are rendered on the map image
+        :arg options: any other argument of the constructor (pixel_search, dense_path, any_angle, query_cache...)"""
+        if 'occupancy' not in options:
+            options['occupancy'] = loaded_map.get_occupancy_grid()
+        if 'waypoint_graph' not in options:
+            options['waypoint_graph'] = loaded_map.get_waypoint_graph()
+        if 'flow_fields' not in options:
+            options['flow_fields'] = loaded_map.get_flow_fields()
+        if 'closed_doors' not in options:
+            options['closed_doors'] = loaded_map.get_closed_doors()
+        if options.get('query_cache') is not None and 'map_hash' not in options:
+            options['map_hash'] = loaded_map.content_hash()
+        image = None if headless else loaded_map.get_image()
+        return cls(image, loaded_map.get_waypoints(), headless=headless, **options)
+
+    def make_path(self, query: MapQuery = None, stats: Stats = None):
+        """Calculate the path between two points.
+        :arg query: endpoints created with Map.query, without it the last two waypoints of the list are used
+        (as added by Map.locate_and_add_point)
+        :arg stats: if given, filled with the time of the 'waypoint_route', 'pixel_legs' and 'render' stages
+        and with the search counters of every pixel leg
+        :returns: pixel path (list of (y, x) tuples) and a copy of the image with the explored pixels and the path
+        drawn on it, None instead of the image if headless
+        :raises PathNotFoundError: if the end point can't be reached"""
+        chunks = self.iter_path(query, stats)
+        next(chunks)  # Door route
         pixel_path = []
-        for ind_w, waypoint in enumerate(waypoint_path):
-            if ind_w < len(waypoint_path) - 1:
-                # Calculating the path between each waypoint on the waypoint path (on pixels)
-                pixel_path += self.__astar_for_pixels(waypoint, waypoint_path[ind_w + 1])
-        return pixel_path, self.__mazeImg
-
-    def __draw_point(self, pos: tuple, color: tuple):
-        self.__mazeImg = cv2.circle(self.__mazeImg, pos, radius=0, color=color, thickness=-1)
-
-    def __astar_for_waypoints(self, startPos, endPos):
-        start = Node(None, self.__waypoint_list[startPos].position,
-                     self.__waypoint_list[startPos].accessible_waypoints)
-        end = Node(None, self.__waypoint_list[endPos].position,
-                   self.__waypoint_list[endPos].accessible_waypoints)
+        for leg in chunks:
+            pixel_path += leg
+
+        if self.__headless:
+            return pixel_path, None
+        with timed(stats, 'render'):
+            return pixel_path, self.render(pixel_path)
+
+    def iter_path(self, query: MapQuery = None, stats: Stats = None):
+        """make_path streamed and computed lazily - yields the door route (find_waypoint_path) first and then the pixel
+        leg between each pair of its consecutive positions (make_leg), a leg is searched only once it is asked for.
+        A caller can start walking the first leg before the others are found, and stop iterating (or close the
+        generator) when the route is no longer wanted, the remaining legs are never searched.
+        Explored pixels of the legs found are kept for render, like in make_path.
+        :arg query, stats: see make_path
+        :raises PathNotFoundError: on the first next if the end point can't be reached through the doors,
+        on the next of a leg if it has no pixel path"""
+        # Calculating the path using the waypoint map
+        with timed(stats, 'waypoint_route'):
+            waypoint_path = self.find_waypoint_path(query)
+
+        if not self.__headless:
+            self.__explored = np.zeros((self.__occupancy.height, self.__occupancy.width), dtype=bool)
+        yield waypoint_path
+
+        for leg_start, leg_end in zip(waypoint_path, waypoint_path[1:]):
+            # Calculating the path between each waypoint on the waypoint path (on pixels)
+            yield self.make_leg(leg_start, leg_end, stats)
+
+    def make_leg(self, start: tuple[int, int], end: tuple[int, int], stats: Stats = None) -> list[tuple[int, int]]:
+        """Pixel stage of make_path for one pair of consecutive positions (x, y) of find_waypoint_path, for callers
+        which want every leg as soon as it is found. If not headless, the explored pixels are added to the ones
+        render draws (reset by make_path).
+        :returns: pixel path of the leg (list of (y, x) tuples), both positions included
+        :raises PathNotFoundError: if there is no pixel path between the positions"""
+        if not self.__headless and self.__explored is None:
+            self.__explored = np.zeros((self.__occupancy.height, self.__occupancy.width), dtype=bool)
+        if stats is None:
+            leg = self.__astar_for_pixels(start, end)
+        else:
+            leg = self.__measured_astar_for_pixels(start, end, stats)
+        if leg is None:
+            raise PathNotFoundError(f"No pixel path between the waypoints {start} and {end}")
+        return leg
+
+    def render(self, pixel_path: list[tuple[int, int]]) -> ndarray:
+        """Draw the path and the pixels explored by the last make_path onto a copy of the image"""
+        if self.__mazeImg is None:
+            raise ValueError("PathMaker was created without an image to render on")
+        return render_path(self.__mazeImg, pixel_path, self.__explored)
+
+    def last_explored(self) -> ndarray:
+        """(height, width) bool mask of the pixels generated by the last make_path, None if headless"""
+        return self.__explored
+
+    def update(self, loaded_map, rectangle: tuple):
+        """Follow an update of the map this PathMaker was made for (Map.update_obstacles returns the rectangle),
+        the pixel search, waypoint graph, closed doors and flow fields are refreshed from it"""
+        if rectangle is None:
+            return
+        self.__occupancy = loaded_map.get_occupancy_grid()
+        self.__closed_waypoints = {id(self.__waypoint_list[door]) for door in loaded_map.get_closed_doors()}
+        if self.__pixel_search is not None:
+            self.__pixel_search.update(self.__occupancy, rectangle)
+        if self.__waypoint_graph is not None:
+            self.__waypoint_graph = loaded_map.get_waypoint_graph()
+        if self.__flow_fields is not None:
+            self.__flow_fields = loaded_map.get_flow_fields()
+        if self.__query_cache is not None:
+            map_hash = loaded_map.content_hash()
+            if map_hash != self.__map_hash:
+                self.__query_cache.invalidate(self.__map_hash)
+                self.__map_hash = map_hash
+
+    def find_waypoint_path(self, query: MapQuery = None):
+        """Door level stage of make_path - positions (x, y) of the start point, the doors to pass and the end point
+        :raises PathNotFoundError: if the end point can't be reached through the doors"""
+        if query is None:
+            start, end = self.__waypoint_list[-2], self.__waypoint_list[-1]
+            accessible_waypoints = attrgetter('accessible_waypoints')
+        else:
+            start, end, accessible_waypoints = query.start, query.end, query.accessible_waypoints
+
+        if self.__waypoint_graph is None:
+            waypoint_path = self.__astar_for_waypoints(start, end, accessible_waypoints)
+        else:
+            waypoint_path = self.__route_on_graph(start, end)
+        if waypoint_path is None:
+            raise PathNotFoundError("The end point can't be reached through the doors")
+        return waypoint_path
+
+    def __route_on_graph(self, start_waypoint: Waypoint, end_waypoint: Waypoint):
+        """Route the endpoints through the doors of the waypoint graph, returns positions like __astar_for_waypoints"""
+        graph = self.__waypoint_graph
+        start_doors = [self.__graph_indices[id(waypoint)] for waypoint in start_waypoint.accessible_waypoints
+                       if id(waypoint) in self.__graph_indices]
+        end_doors = [self.__graph_indices[id(waypoint)] for waypoint in end_waypoint.accessible_waypoints
+                     if id(waypoint) in self.__graph_indices]
+        direct = any(waypoint is end_waypoint for waypoint in start_waypoint.accessible_waypoints)
+
+        if self.__query_cache is None:
+            route = graph.route(start_waypoint.position, start_doors, end_waypoint.position, end_doors, direct)
+        else:
+            route = self.__cached_route(start_waypoint, end_waypoint, start_doors, end_doors, direct)
+        if route is None:
+            return None
+        door_positions = [tuple(graph.positions[door].tolist()) for door in route]
+        return [start_waypoint.position] + door_positions + [end_waypoint.position]
+
+    def __cached_route(self, start_waypoint: Waypoint, end_waypoint: Waypoint, start_doors: list[int],
+                       end_doors: list[int], direct: bool):
+        """graph.route with the routes between the doors of the start and end rooms taken from the query cache"""
+        start_rooms = tuple(start_waypoint.accessible_areas)
+        end_rooms = tuple(end_waypoint.accessible_areas)
+        routes = self.__query_cache.get_routes(self.__map_hash, start_rooms, end_rooms)
+        if routes is None:
+            routes = self.__waypoint_graph.door_routes(start_doors, end_doors)
+            self.__query_cache.put_routes(self.__map_hash, start_rooms, end_rooms, routes)
+
+        start, end = start_waypoint.position, end_waypoint.position
+        best_cost, best_route = (math.dist(start, end), []) if direct else (math.inf, None)
+        positions = self.__waypoint_graph.positions.tolist()
+        for (first, last), (cost, route) in routes.items():
+            total = math.dist(start, positions[first]) + cost + math.dist(positions[last], end)
+            if total < best_cost:
+                best_cost, best_route = total, route
+        return best_route
+
+    def __astar_for_waypoints(self, start_waypoint: Waypoint, end_waypoint: Waypoint, accessible_waypoints):
+        """A* on the waypoints, accessible_waypoints(waypoint) gives the waypoints connected with a waypoint"""
+        start = Node(None, start_waypoint.position, accessible_waypoints(start_waypoint))
+        end = Node(None, end_waypoint.position, accessible_waypoints(end_waypoint))
 
         open_list = []  # Points with undiscovered, seemingly profitable connections
         closed_list = []  # Points with discovered and/or unprofitable connections
@@ -85,6 +301,8 @@ class PathMaker:
                 continue
 
             for child in current_door.children:
+                if id(child) in self.__closed_waypoints:  # Door blocked by an obstacle
+                    continue
 
                 pos = child.position
                 if isinstance(pos, Area):
@@ -93,7 +311,7 @@ class PathMaker:
                 if current_door.parent and pos == current_door.parent.position:
                     continue
 
-                child = Node(current_door, pos, child.accessible_waypoints)
+                child = Node(current_door, pos, accessible_waypoints(child))
 
                 if len([closed_child for closed_child in closed_list if closed_child == child]) > 0:
                     continue
@@ -110,62 +328,64 @@ class PathMaker:
 
                 open_list.append(child)
 
-    def __astar_for_pixels(self, startPos: tuple, endPos: tuple):
-        # Convert from x, y to y, x because of the way of accessing list[y][x]
-        start = Node(None, (startPos[1], startPos[0]), [])
-        end = Node(None, (endPos[1], endPos[0]), [])
-
-        open_list = []  # Points with undiscovered, seemingly profitable connections
-        closed_list = []  # Points with discovered and/or unprofitable connections
-        open_list.append(start)
-
-        while len(open_list) > 0:
-            current_node = open_list[0]
-            current_index = 0
-            for index, item in enumerate(open_list):
-                if item.f < current_node.f:
-                    current_node = item
-                    current_index = index
-
-            open_list.pop(current_index)
-            closed_list.append(current_node)
-
-            if current_node == end:  # Found the destination
-                path = []
-                current = current_node
-                while current is not None:
-                    self.__draw_point((current.position[1], current.position[0]), color=(0, 0, 255))
-                    path.append(current.position)
-                    current = current.parent
-                path = path[::-1]
-                return path  # Finished
-
-            children = []
-            for new_position in [(-1, -1), (0, -1), (1, -1), (-1, 0), (1, 0), (-1, 1), (0, 1), (1, 1)]:
-                node_position = (current_node.position[0] + new_position[0], current_node.position[1] + new_position[1])
-                h = len(self.__mazeArray)
-                w = len(self.__mazeArray[0])
-
-                if ((node_position[0] >= h) or (node_position[0] < 0) or
-                        (node_position[1] > (w - 1)) or (node_position[1] < 0)):
-                    continue
-
-                if self.__mazeArray[node_position[0]][node_position[1]] != 255:  # 255 meaning the obstacle
-                    continue
+    def __measured_astar_for_pixels(self, startPos: tuple, endPos: tuple, stats: Stats):
+        started = time.perf_counter()
+        leg = self.__astar_for_pixels(startPos, endPos)
+        seconds = time.perf_counter() - started
 
-                children.append(Node(current_node, node_position, []))
+        stats.add_stage('pixel_legs', seconds)
+        if self.__searched:
+            search = self.__pixel_search
+            counters = (search.expanded, search.generated, search.peak_open)
+        else:  # Followed down a flow field or taken from the query cache
+            counters = (0, 0, 0)
+        stats.add_leg(LegStats(startPos, endPos, seconds, *counters, len(leg) if leg else 0))
+        return leg
 
-            for child in children:
-
-                if len([closed_child for closed_child in closed_list if closed_child == child]) > 0:
-                    continue
-
-                child.g = current_node.g + 1
-                child.h = ((child.position[0] - end.position[0]) ** 2) + ((child.position[1] - end.position[1]) ** 2)
-                child.f = child.g + child.h
+    def __astar_for_pixels(self, startPos: tuple, endPos: tuple):
+        cached = self.__query_cache is not None and startPos in self.__door_positions and \
+            endPos in self.__door_positions
+        if cached:
+            path = self.__query_cache.get_leg(self.__map_hash, self.__leg_form, startPos, endPos)
+            if path is not None:
+                self.__searched = False
+                return path
+        path = self.__pixels_for_leg(startPos, endPos)
+        if cached and path is not None:
+            self.__query_cache.put_leg(self.__map_hash, self.__leg_form, startPos, endPos, path)
+        return path
+
+    def __pixels_for_leg(self, startPos: tuple, endPos: tuple):
+        if self.__flow_fields is not None:
+            # Sparse legs are enough for the smoothing
+            dense = (self.__dense_path or not self.__jps) and not self.__any_angle
+            path = self.__flow_fields.leg(startPos, endPos, dense=dense)
+            if path is not None:
+                self.__searched = False
+                return self.__straighten(path) if self.__any_angle else path
+        self.__searched = True
 
-                if len([open_node for open_node in open_list if
-                        child.position == open_node.position and child.g > open_node.g]) > 0:
-                    continue
-                self.__draw_point((child.position[1], child.position[0]), color=(0, 255, 0))
-                open_list.append(child)
+        # Convert from x, y to y, x because of the way of accessing list[y][x]
+        start = (startPos[1], startPos[0])
+        end = (endPos[1], endPos[0])
+        if self.__pixel_search is None:
+            if self.__jps:
+                self.__pixel_search = JumpPointSearch(self.__occupancy)
+            else:
+                self.__pixel_search = PixelAStar(self.__occupancy)
+        if self.__jps:
+            # Smoothing needs only the jump points, consecutive ones lie on a straight or diagonal line
+            path = self.__pixel_search.search(start, end, expand=self.__dense_path and not self.__any_angle)
+        else:
+            path = self.__pixel_search.search(start, end)
+        if path is None:
+            return None
+        if self.__explored is not None:
+            # Explored pixels (or jump points) are only collected here, render draws them once for the whole path
+            self.__explored |= self.__pixel_search.last_generated()
+        return self.__straighten(path) if self.__any_angle else path
+
+    def __straighten(self, path: list[tuple[int, int]]) -> list[tuple[int, int]]:
+        """Any-angle form of a leg - its line of sight waypoints, joined pixel by pixel if dense_path"""
+        waypoints = smooth_path(self.__occupancy.walkable, turning_points(path))
+        return densify(waypoints) if self.__dense_path else waypoints
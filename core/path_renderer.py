@@ -0,0 +1,37 @@
+import cv2
+import numpy as np
+from numpy import ndarray
+
+EXPLORED_COLOUR = (0, 255, 0)  # BGR, pixels generated by the pixel searches
+PATH_COLOUR = (0, 0, 255)
+ROUTE_COLOUR = (255, 0, 255)  # Straight lines between the doors of the door-level route
+
+
+def render_path(image: ndarray, pixel_path: list[tuple[int, int]], explored: ndarray = None) -> ndarray:
+    """Draw a path (and optionally the pixels explored while finding it) onto a copy of the image.
+    Every colour is painted with a single indexed write, the path last, so it is never hidden by explored pixels.
+    :arg image: BGR map image, left unchanged
+    :arg pixel_path: list of (y, x) tuples, as returned by PathMaker.make_path
+    :arg explored: optional (height, width) bool mask of the explored pixels
+    :returns: the drawn copy of the image"""
+    rendered = image.copy()
+    if explored is not None:
+        rendered[explored] = EXPLORED_COLOUR
+    draw_path(rendered, pixel_path)
+    return rendered
+
+
+def draw_path(image: ndarray, pixel_path: list[tuple[int, int]]):
+    """Paint a path (list of (y, x) tuples, e.g. one leg) directly onto the BGR image"""
+    if pixel_path:
+        rows, columns = np.asarray(pixel_path, dtype=np.intp).T
+        image[rows, columns] = PATH_COLOUR
+
+
+def render_route(image: ndarray, positions: list[tuple[int, int]]) -> ndarray:
+    """Draw the door-level route (positions (x, y), as returned by PathMaker.find_waypoint_path) as straight lines
+    onto a copy of the image"""
+    rendered = image.copy()
+    if len(positions) > 1:
+        cv2.polylines(rendered, [np.asarray(positions, dtype=np.int32)], False, ROUTE_COLOUR)
+    return rendered
@@ -0,0 +1,274 @@
+import json
+import math
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from core.batch import BatchResult, PathPool
+from core.map_compiler import CompiledMap, load_map
+
+LATENCY_WINDOW = 10000  # Latest queries the latency percentiles are computed from
+PERCENTILES = (50, 90, 95, 99)
+
+
+class LatencyRecorder:
+    """Latencies of the latest queries, for the percentiles of the stats endpoint"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.__latencies = deque(maxlen=window)
+        self.__lock = threading.Lock()
+        self.count = 0  # Queries recorded since the start, including the ones out of the window
+
+    def record(self, seconds: float):
+        with self.__lock:
+            self.__latencies.append(seconds)
+            self.count += 1
+
+    def percentiles(self, percentiles: tuple = PERCENTILES) -> dict:
+        """Percentile (nearest rank) -> latency in milliseconds, empty if nothing was recorded"""
+        with self.__lock:
+            latencies = sorted(self.__latencies)
+        if not latencies:
+            return {}
+        return {f'p{percentile}': latencies[max(math.ceil(percentile / 100 * len(latencies)) - 1, 0)] * 1000
+                for percentile in percentiles}
+
+
+class QueryBatcher:
+    """Collects the queries arriving at the same time from many request threads and sends them to the pool in
+    batches per map - one round trip to a worker process for many queries instead of one for each"""
+
+    def __init__(self, pool: PathPool, batch_size: int = 32, max_wait: float = 0.002):
+        """
+        :arg batch_size: most queries sent to a worker at once
+        :arg max_wait: seconds a query waits for others to join its batch"""
+        self.__pool = pool
+        self.__batch_size = batch_size
+        self.__max_wait = max_wait
+        self.__queue = queue.Queue()
+        self.batches = 0
+        self.batched_queries = 0
+        self.__thread = threading.Thread(target=self.__run, name='QueryBatcher', daemon=True)
+        self.__thread.start()
+
+    def submit(self, map_name: str, start: tuple[int, int], end: tuple[int, int]) -> Future:
+        """:returns: Future of the BatchResult of the query"""
+        future = Future()
+        self.__queue.put((map_name, tuple(start), tuple(end), future))
+        return future
+
+    def close(self):
+        self.__queue.put(None)
+        self.__thread.join()
+
+    def __run(self):
+        while True:
+            item = self.__queue.get()
+            if item is None:
+                return
+            pending = [item]
+            deadline = time.perf_counter() + self.__max_wait
+            while len(pending) < self.__batch_size * self.__pool.workers:
+                timeout = deadline - time.perf_counter()
+                try:
+                    item = self.__queue.get(timeout=timeout) if timeout > 0 else self.__queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.__dispatch(pending)
+                    return
+                pending.append(item)
+            self.__dispatch(pending)
+
+    def __dispatch(self, pending: list):
+        by_map = {}
+        for map_name, start, end, future in pending:
+            by_map.setdefault(map_name, []).append((start, end, future))
+        for map_name, items in by_map.items():
+            # Split evenly over the workers, but not into batches above batch_size
+            chunk_count = max(min(self.__pool.workers, len(items)), -(-len(items) // self.__batch_size))
+            chunk_size = -(-len(items) // chunk_count)
+            for first in range(0, len(items), chunk_size):
+                chunk = items[first:first + chunk_size]
+                futures = [future for _, _, future in chunk]
+                try:
+                    batch = self.__pool.submit(map_name, [(index, start, end) for index, (start, end, _) in
+                                                          enumerate(chunk)])
+                except Exception as error:  # E.g. an unknown map, fail the chunk only
+                    for future in futures:
+                        future.set_exception(error)
+                    continue
+                batch.add_done_callback(lambda batch, futures=futures: self.__resolve(batch, futures))
+                self.batches += 1
+                self.batched_queries += len(chunk)
+
+    @staticmethod
+    def __resolve(batch: Future, futures: list[Future]):
+        error = batch.exception()
+        if error is not None:
+            for future in futures:
+                future.set_exception(error)
+            return
+        for result in batch.result():
+            futures[result.index].set_result(result)
+
+
+class PathService:
+    """Path queries over a fixed set of maps, preloaded into a pool of worker processes.
+    Thread safe, used by the HTTP server (make_server) and usable on its own. Doesn't import any UI code."""
+
+    def __init__(self, map_paths: dict[str, str], workers: int = None, pixel_search: str = 'astar',
+                 flow_fields: bool = False, batch_size: int = 32, max_wait: float = 0.002):
+        """
+        :arg map_paths: map name -> image path, every map is compiled (or loaded from its artifact) at startup
+        :arg flow_fields: build the flow fields of the maps, more memory and startup time for faster queries
+        :arg batch_size, max_wait: see QueryBatcher"""
+        self.started = time.time()
+        maps = {}
+        for map_name, img_path in map_paths.items():
+            compiled_map = load_map(img_path)
+            if flow_fields and compiled_map.flow_keys is None:
+                compiled_map = CompiledMap.from_map(compiled_map.to_map(), compiled_map.source_hash,
+                                                    flow_fields=True)
+            maps[map_name] = compiled_map
+        self.__map_sizes = {map_name: compiled_map.occupancy.shape[:2] for map_name, compiled_map in maps.items()}
+        self.__pool = PathPool(maps, workers, pixel_search)
+        self.__batcher = QueryBatcher(self.__pool, batch_size, max_wait)
+        self.latencies = LatencyRecorder()  # Of every query, from its request to its result
+        self.__failures = 0  # Queries without a path
+        self.__lock = threading.Lock()
+
+    def map_names(self) -> list[str]:
+        return self.__pool.map_names()
+
+    def find_path(self, map_name: str, start: tuple[int, int], end: tuple[int, int],
+                  timeout: float = None) -> BatchResult:
+        """Path between two (x, y) points of a map, error set in the result if there is none
+        :raises KeyError: if there is no such map
+        :raises ValueError: if a point is outside of the map"""
+        return self.find_paths(map_name, [(start, end)], timeout)[0]
+
+    def find_paths(self, map_name: str, endpoint_pairs: list, timeout: float = None) -> list[BatchResult]:
+        """find_path of many (start, end) pairs, in order - they are batched together with the other requests"""
+        started = time.perf_counter()
+        if map_name not in self.__map_sizes:
+            raise KeyError(map_name)
+        height, width = self.__map_sizes[map_name]
+        for point in (point for pair in endpoint_pairs for point in pair):
+            if not (0 <= point[0] < width and 0 <= point[1] < height):
+                raise ValueError(f"Point {tuple(point)} is outside of the {width}x{height} map '{map_name}'")
+
+        futures = [self.__batcher.submit(map_name, start, end) for start, end in endpoint_pairs]
+        results = []
+        for future in futures:
+            result = future.result(timeout)
+            self.latencies.record(time.perf_counter() - started)
+            if result.error is not None:
+                with self.__lock:
+                    self.__failures += 1
+            results.append(result)
+        return results
+
+    def health(self) -> dict:
+        return {'status': 'ok', 'maps': self.map_names(), 'workers': self.__pool.workers,
+                'uptime': time.time() - self.started}
+
+    def stats(self) -> dict:
+        """Query counts (a POST /paths request holds many queries), batching and latency percentiles
+        (milliseconds, latest LATENCY_WINDOW queries)"""
+        batches = self.__batcher.batches
+        return {'queries': self.latencies.count, 'failed': self.__failures,
+                'batches': batches,
+                'mean_batch_size': self.__batcher.batched_queries / batches if batches else 0.0,
+                'latency_ms': self.latencies.percentiles()}
+
+    def close(self):
+        self.__batcher.close()
+        self.__pool.close()
+
+
+class _PathRequestHandler(BaseHTTPRequestHandler):
+    """JSON API of a PathService:
+    GET /health, GET /stats, GET /maps,
+    POST /path {"map": name, "start": [x, y], "end": [x, y]} -> {"path": [[y, x], ...]},
+    POST /paths {"map": name, "queries": [[[x, y], [x, y]], ...]} -> {"results": [{"path": ...} or {"error": ...}]}"""
+
+    service: PathService = None  # Set by make_server
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.__reply(200, self.service.health())
+        elif self.path == '/stats':
+            self.__reply(200, self.service.stats())
+        elif self.path == '/maps':
+            self.__reply(200, {'maps': self.service.map_names()})
+        else:
+            self.__reply(404, {'error': f"Unknown endpoint '{self.path}'"})
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+            if not isinstance(request, dict):
+                raise ValueError(f"Expected a JSON object, got {type(request).__name__}")
+            if self.path == '/path':
+                pairs = [(self.__point(request.get('start')), self.__point(request.get('end')))]
+            elif self.path == '/paths':
+                queries = request.get('queries', [])
+                if not isinstance(queries, list):
+                    raise ValueError(f"Expected a list of queries, got {queries!r}")
+                pairs = [(self.__point(start), self.__point(end)) for start, end in queries]
+            else:
+                self.__reply(404, {'error': f"Unknown endpoint '{self.path}'"})
+                return
+            if request.get('map') not in self.service.map_names():
+                self.__reply(404, {'error': f"Unknown map {request.get('map')!r}"})
+                return
+            results = self.service.find_paths(request['map'], pairs)
+        except (ValueError, TypeError) as error:  # Bad JSON, points or fields
+            self.__reply(400, {'error': str(error)})
+            return
+        except Exception as error:  # E.g. a worker process died, the server keeps running
+            self.__reply(500, {'error': repr(error)})
+            return
+
+        if self.path == '/path':
+            result = results[0]
+            if result.error is not None:
+                self.__reply(422, {'error': result.error})
+            else:
+                self.__reply(200, {'path': result.path})
+        else:
+            self.__reply(200, {'results': [{'path': result.path} if result.error is None else {'error': result.error}
+                                           for result in results]})
+
+    def log_message(self, format, *args):
+        """Queries are counted in the stats instead of the requests logged"""
+
+    @staticmethod
+    def __point(value) -> tuple[int, int]:
+        # bool is an int too, and a float like 60.5 would be truncated to another pixel
+        if not isinstance(value, list) or len(value) != 2 or not all(
+                isinstance(coordinate, int) and not isinstance(coordinate, bool) for coordinate in value):
+            raise ValueError(f"Expected a point [x, y] of integers, got {value!r}")
+        return value[0], value[1]
+
+    def __reply(self, status: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def make_server(service: PathService, host: str = '127.0.0.1', port: int = 8765) -> ThreadingHTTPServer:
+    """HTTP server of the JSON API of the service (see _PathRequestHandler), run it with serve_forever"""
+    handler = type('PathRequestHandler', (_PathRequestHandler,), {'service': service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
@@ -0,0 +1,154 @@
+import heapq
+import math
+
+import numpy as np
+from numpy import ndarray
+
+from core.occupancy import OccupancyGrid, as_occupancy_grid, patched_grid
+
+SQRT2 = math.sqrt(2)
+
+# (row offset, column offset, step cost) of the 8 neighbours of a pixel
+NEIGHBOURS = ((-1, -1, SQRT2), (-1, 0, 1.0), (-1, 1, SQRT2), (0, -1, 1.0),
+              (0, 1, 1.0), (1, -1, SQRT2), (1, 0, 1.0), (1, 1, SQRT2))
+
+
+def octile_distance(a: tuple, b: tuple) -> float:
+    """Exact cost of the cheapest 8-connected move sequence between two pixels on an empty grid"""
+    dy = abs(a[0] - b[0])
+    dx = abs(a[1] - b[1])
+    return max(dx, dy) + (SQRT2 - 1) * min(dx, dy)
+
+
+class GridSearch:
+    """State shared by the searches over the padded cells of an OccupancyGrid (or a thresholded maze array,
+    255 - free pixel): g-scores, parents and seen/closed stamps in flat NumPy arrays preallocated once for the whole
+    image (16 bytes per cell), the counters of the last search and the path reconstruction.
+    Subclasses implement search."""
+
+    def __init__(self, occupancy: OccupancyGrid | ndarray):
+        """
+        :arg occupancy: read in place if an OccupancyGrid (e.g. Map.get_occupancy_grid), its wall border spares the
+        bounds checks of the neighbours"""
+        self._grid = as_occupancy_grid(occupancy)
+        self._owns_grid = self._grid is not occupancy  # A given grid is copied before update patches it
+        # Flat 1/0 walkable cells, indexing a memoryview is much faster than numpy scalars
+        self._cells = self._grid.cells
+        self._width = self._grid.padded_width  # Cell (y, x) of the padded grid is y * _width + x
+
+        size = (self._grid.height + 2) * self._width
+        self._g = np.zeros(size, dtype=np.float64)
+        self._parent = np.zeros(size, dtype=np.int32)  # Cells of the padded grid fit in int32
+        # Search stamps instead of flags, one per cell - a cell is seen in the current search if its stamp is the
+        # search id and closed if it is the search id + 1 (so seen too), older stamps are lower.
+        # This spares clearing the array before every search
+        self._stamps = np.zeros(size, dtype=np.uint32)
+        self._search_id = 0  # Even, raised by 2 per search
+
+        # Counters of the last search
+        self.expanded = 0  # Cells taken off the open list
+        self.generated = 0  # Pushes onto the open list
+        self.peak_open = 0  # Largest size of the open list (stale entries included)
+
+    def last_generated(self) -> ndarray:
+        """Mask (height, width) of the pixels pushed onto the open list during the last search"""
+        seen = (self._stamps >= self._search_id).reshape(self._grid.height + 2, self._width)
+        return seen[1:-1, 1:-1]
+
+    def update(self, occupancy: OccupancyGrid | ndarray, rectangle: tuple):
+        """Take in the change of the pixels of the rectangle ((x_min, y_min), (x_max, y_max)) - an updated
+        OccupancyGrid (Map.get_occupancy_grid) is read from then on, the pixels of a maze array are copied"""
+        self._grid, self._owns_grid = patched_grid(self._grid, self._owns_grid, occupancy, rectangle)
+        self._cells = self._grid.cells
+
+    def _start_search(self, start: tuple[int, int], end: tuple[int, int]) -> tuple[int, int, list]:
+        """Begin a new search between two (y, x) pixels, the start cell is seen with g 0 and no parent
+        :returns: start cell, end cell and the open heap of (f, h, cell) holding the start -
+        ties on f are broken towards the cells closer to the end"""
+        self._search_id += 2
+        start_index = self._grid.index(start)
+        end_index = self._grid.index(end)
+        self._g[start_index] = 0.0
+        self._parent[start_index] = -1
+        self._stamps[start_index] = self._search_id
+        start_h = octile_distance(start, end)
+        return start_index, end_index, [(start_h, start_h, start_index)]
+
+    def _store_counters(self, expanded: int, generated: int, peak_open: int):
+        self.expanded = expanded
+        self.generated = generated
+        self.peak_open = peak_open
+
+    def _reconstruct(self, index: int) -> list[tuple[int, int]]:
+        """(y, x) pixels of the parent chain ending at the cell, from the start"""
+        path = []
+        pixel = self._grid.pixel
+        parent = self._parent
+        while index != -1:
+            path.append(pixel(index))
+            index = parent[index]
+        return path[::-1]
+
+
+class PixelAStar(GridSearch):
+    """A* over the walkable pixels of an OccupancyGrid (or a thresholded maze array, 255 - free pixel).
+    The frontier is a binary heap, and the search state lives in the flat arrays of GridSearch,
+    so no per-pixel objects are created.
+    Diagonal moves cost sqrt(2) and may not cut a wall corner."""
+
+    def search(self, start: tuple[int, int], end: tuple[int, int]):
+        """Find the path between two (y, x) pixels.
+        :returns: list of (y, x) tuples from start to end (both included) or None if the end is unreachable"""
+        start_index, end_index, open_heap = self._start_search(start, end)
+        seen_id = self._search_id
+        closed_id = seen_id + 1
+        width = self._width
+        walkable = self._cells
+        g_score = self._g
+        parent = self._parent
+        stamps = self._stamps
+        end_y, end_x = divmod(end_index, width)
+
+        expanded = 0
+        generated = 1
+        peak_open = 1
+        while open_heap:
+            current = heapq.heappop(open_heap)[2]
+            if stamps[current] == closed_id:  # Stale heap entry, the pixel was already expanded with a lower g
+                continue
+            stamps[current] = closed_id
+            expanded += 1
+            g = g_score[current]
+
+            if current == end_index:  # Found the destination
+                self._store_counters(expanded, generated, peak_open)
+                return self._reconstruct(current)
+
+            y, x = divmod(current, width)
+            for dy, dx, cost in NEIGHBOURS:
+                # No bounds checks, the wall border of the grid is never walkable
+                neighbour = current + dy * width + dx
+                if not walkable[neighbour] or stamps[neighbour] == closed_id:
+                    continue
+                if dy and dx and not (walkable[current + dx] and walkable[current + dy * width]):
+                    continue  # Diagonal move would cut the corner of a wall
+
+                new_g = g + cost
+                if stamps[neighbour] == seen_id and new_g >= g_score[neighbour]:
+                    continue
+                stamps[neighbour] = seen_id
+                g_score[neighbour] = new_g
+                parent[neighbour] = current
+
+                # octile_distance inlined, a call per push is measurably slower
+                ady = abs(y + dy - end_y)
+                adx = abs(x + dx - end_x)
+                h = max(adx, ady) + (SQRT2 - 1) * min(adx, ady)
+                heapq.heappush(open_heap, (new_g + h, h, neighbour))
+                generated += 1
+
+            if len(open_heap) > peak_open:
+                peak_open = len(open_heap)
+
+        self._store_counters(expanded, generated, peak_open)
+        return None
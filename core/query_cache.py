@@ -0,0 +1,105 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Bounded mapping which evicts the least recently used entry, counting the hits and misses of get"""
+
+    def __init__(self, capacity: int):
+        if capacity < 0:
+            raise ValueError(f"Cache capacity must not be negative, got {capacity}")
+        self.capacity = capacity
+        self.__entries = OrderedDict()  # Least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def get(self, key, counted: bool = True):
+        """Value of the key (marking it as recently used), None if it isn't cached
+        :arg counted: if False, the lookup is not counted as a hit or miss"""
+        value = self.__entries.get(key)
+        if value is None:
+            self.misses += counted
+            return None
+        self.hits += counted
+        self.__entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.__entries[key] = value
+        self.__entries.move_to_end(key)
+        while len(self.__entries) > self.capacity:
+            self.__entries.popitem(last=False)
+            self.evictions += 1
+
+    def discard(self, predicate) -> int:
+        """Remove the entries whose key matches the predicate, returns how many were removed"""
+        keys = [key for key in self.__entries if predicate(key)]
+        for key in keys:
+            del self.__entries[key]
+        return len(keys)
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class QueryCache:
+    """Results of earlier path queries, shared by PathMakers (and threads) working on the same maps.
+    Door routes are cached per (map hash, start rooms, end rooms) as the routes between every door of the start rooms
+    and every door of the end rooms, so a hit still gives the best route for any endpoints in those rooms.
+    Pixel legs between two doors are cached per (map hash, leg form, door A, door B), so only the first and last leg
+    of a query are searched once the cache is warm. The map hash is Map.content_hash, it changes with the map,
+    so entries of an older version of the map are never hit - invalidate drops them."""
+
+    def __init__(self, route_capacity: int = 256, leg_capacity: int = 1024):
+        self.routes = LRUCache(route_capacity)
+        self.legs = LRUCache(leg_capacity)
+        self.__lock = threading.Lock()
+
+    def get_routes(self, map_hash: str, start_rooms: tuple, end_rooms: tuple):
+        """Door routes of WaypointGraph.door_routes for the rooms, None if not cached"""
+        with self.__lock:
+            return self.routes.get((map_hash, start_rooms, end_rooms))
+
+    def put_routes(self, map_hash: str, start_rooms: tuple, end_rooms: tuple, routes: dict):
+        with self.__lock:
+            self.routes.put((map_hash, start_rooms, end_rooms), routes)
+
+    def get_leg(self, map_hash: str, form: tuple, start: tuple[int, int], end: tuple[int, int]):
+        """Cached pixel leg (list of (y, x) tuples) between two door positions (x, y), a leg cached in the opposite
+        direction is returned reversed. None if not cached.
+        :arg form: anything the shape of a leg depends on (e.g. pixel search and density)"""
+        with self.__lock:
+            leg = self.legs.get((map_hash, form, start, end), counted=False)
+            if leg is not None:
+                leg = list(leg)  # Callers may extend or change the leg they get
+            else:
+                leg = self.legs.get((map_hash, form, end, start), counted=False)
+                if leg is not None:
+                    leg = leg[::-1]
+            if leg is None:
+                self.legs.misses += 1
+            else:
+                self.legs.hits += 1
+            return leg
+
+    def put_leg(self, map_hash: str, form: tuple, start: tuple[int, int], end: tuple[int, int], leg: list):
+        with self.__lock:
+            self.legs.put((map_hash, form, start, end), list(leg))
+
+    def invalidate(self, map_hash: str = None) -> int:
+        """Drop the entries of a map (of every map if None), returns how many were dropped"""
+        with self.__lock:
+            predicate = (lambda key: True) if map_hash is None else (lambda key: key[0] == map_hash)
+            return self.routes.discard(predicate) + self.legs.discard(predicate)
+
+    def stats(self) -> dict:
+        """Sizes, hits, misses and hit rates of the route and leg caches, JSON serializable"""
+        with self.__lock:
+            return {name: {'entries': len(cache), 'capacity': cache.capacity, 'hits': cache.hits,
+                           'misses': cache.misses, 'hit_rate': cache.hit_rate(), 'evictions': cache.evictions}
+                    for name, cache in (('routes', self.routes), ('legs', self.legs))}
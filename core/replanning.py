@@ -0,0 +1,259 @@
+import heapq
+import math
+
+from numpy import ndarray
+
+from core.map import Map
+from core.occupancy import OccupancyGrid, as_occupancy_grid, patched_grid
+from core.path_maker import PathMaker, PathNotFoundError
+from core.pixel_search import NEIGHBOURS, SQRT2
+
+KEY_TOLERANCE = 1e-9  # Keys are sums of floats, equal costs summed in another order may differ in the last bits
+
+
+def _key_less(key: tuple[float, float], other: tuple[float, float]) -> bool:
+    """key < other, with the first values compared within KEY_TOLERANCE"""
+    return key[0] < other[0] - KEY_TOLERANCE or (key[0] <= other[0] + KEY_TOLERANCE and key[1] < other[1])
+
+
+class DStarLite:
+    """D* Lite over the walkable pixels of an OccupancyGrid (or a thresholded maze array, 255 - free pixel) between
+    two (y, x) pixels, with the movement rules of PixelAStar. The search runs backwards from the end, so after the map
+    changes (update) or the start moves (move_start) only the part of the search affected by the change is repaired
+    instead of searching again.
+    g and rhs values are kept in dicts, so the memory grows with the explored area, not with the map."""
+
+    def __init__(self, occupancy: OccupancyGrid | ndarray, start: tuple[int, int], end: tuple[int, int]):
+        """
+        :arg occupancy: read in place if an OccupancyGrid (e.g. Map.get_occupancy_grid), update tells which pixels
+        changed
+        """
+        self.__grid = as_occupancy_grid(occupancy)
+        self.__owns_grid = self.__grid is not occupancy  # A given grid is copied before update patches it
+        self.__height, self.__width = self.__grid.height, self.__grid.width
+        self.__walkable = self.__grid.cells
+        self.__start = self.__grid.index(start)  # Cells of the padded grid
+        self.__end = self.__grid.index(end)
+        self.__last_start = self.__start
+        self.__key_modifier = 0.0  # km - sum of the heuristic distances the start moved by
+
+        self.__g = {}
+        self.__rhs = {self.__end: 0.0}
+        self.__queued = {}  # Pixel -> its key in the heap, entries with any other key are stale
+        self.__heap = []
+        self.__push(self.__end)
+
+        self.expanded = 0  # Pixels expanded by the last search (repair)
+
+    def path(self):
+        """Compute (or repair) the search and follow it from the start to the end.
+        :returns: list of (y, x) tuples from start to end (both included) or None if the end is unreachable"""
+        self.__compute_shortest_path()
+        if self.__g.get(self.__start, math.inf) == math.inf:
+            return None
+
+        pixel = self.__grid.pixel
+        current = self.__start
+        path = [pixel(current)]
+        while current != self.__end:
+            best, best_cost = -1, math.inf
+            for neighbour, cost in self.__moves(current):
+                total = cost + self.__g.get(neighbour, math.inf)
+                if total < best_cost:
+                    best, best_cost = neighbour, total
+            if best == -1 or len(path) > self.__height * self.__width:
+                return None
+            current = best
+            path.append(pixel(current))
+        return path
+
+    def move_start(self, start: tuple[int, int]):
+        """The agent moved to the given (y, x) pixel, the following paths start there"""
+        start = self.__grid.index(start)
+        self.__key_modifier += self.__heuristic(self.__last_start, start)
+        self.__last_start = start
+        self.__start = start
+
+    def update(self, occupancy: OccupancyGrid | ndarray, rectangle: tuple):
+        """Take in the change of the pixels of the rectangle ((x_min, y_min), (x_max, y_max)), an updated OccupancyGrid
+        or maze array like PixelAStar.update, the search is repaired on the next path call"""
+        self.__grid, self.__owns_grid = patched_grid(self.__grid, self.__owns_grid, occupancy, rectangle)
+        self.__walkable = self.__grid.cells
+        (x_min, y_min), (x_max, y_max) = rectangle
+        # The pixels around the change are affected too, a changed pixel may be the corner of their diagonal moves
+        y_min, x_min = max(y_min - 1, 0), max(x_min - 1, 0)
+        y_max, x_max = min(y_max + 1, self.__height - 1), min(x_max + 1, self.__width - 1)
+        width = self.__grid.padded_width
+        walkable = self.__walkable
+        g = self.__g
+        rhs = self.__rhs
+        for y in range(y_min + 1, y_max + 2):
+            for pixel in range(y * width + x_min + 1, y * width + x_max + 2):
+                # A blocked pixel never reached by the search stays out of it
+                if walkable[pixel] or pixel in rhs or pixel in g:
+                    self.__update_vertex(pixel)
+
+    def __heuristic(self, a: int, b: int) -> float:
+        width = self.__grid.padded_width
+        ay, ax = divmod(a, width)
+        by, bx = divmod(b, width)
+        dy = abs(ay - by)
+        dx = abs(ax - bx)
+        return max(dx, dy) + (SQRT2 - 1) * min(dx, dy)
+
+    def __key(self, pixel: int) -> tuple[float, float]:
+        value = min(self.__g.get(pixel, math.inf), self.__rhs.get(pixel, math.inf))
+        return value + self.__heuristic(self.__start, pixel) + self.__key_modifier, value
+
+    def __push(self, pixel: int):
+        key = self.__key(pixel)
+        self.__queued[pixel] = key
+        heapq.heappush(self.__heap, (key[0], key[1], pixel))
+
+    def __moves(self, pixel: int):
+        """(neighbour, cost) of the moves allowed from the pixel, none if it is blocked itself"""
+        walkable = self.__walkable
+        if not walkable[pixel]:
+            return
+        width = self.__grid.padded_width
+        for dy, dx, cost in NEIGHBOURS:
+            neighbour = pixel + dy * width + dx  # The wall border spares the bounds checks
+            if not walkable[neighbour]:
+                continue
+            if dy and dx and not (walkable[pixel + dx] and walkable[pixel + dy * width]):
+                continue  # Diagonal move would cut the corner of a wall
+            yield neighbour, cost
+
+    def __update_vertex(self, pixel: int):
+        g = self.__g
+        if pixel != self.__end:
+            best = math.inf
+            for neighbour, cost in self.__moves(pixel):
+                total = cost + g.get(neighbour, math.inf)
+                if total < best:
+                    best = total
+            self.__rhs[pixel] = best
+        self.__queued.pop(pixel, None)
+        if g.get(pixel, math.inf) != self.__rhs.get(pixel, math.inf):
+            self.__push(pixel)
+
+    def __compute_shortest_path(self):
+        g = self.__g
+        rhs = self.__rhs
+        heap = self.__heap
+        queued = self.__queued
+        expanded = 0
+        while heap:
+            top_key = (heap[0][0], heap[0][1])
+            pixel = heap[0][2]
+            if queued.get(pixel) != top_key:  # Stale heap entry
+                heapq.heappop(heap)
+                continue
+            start = self.__start
+            if not (_key_less(top_key, self.__key(start)) or rhs.get(start, math.inf) != g.get(start, math.inf)):
+                break
+
+            heapq.heappop(heap)
+            del queued[pixel]
+            new_key = self.__key(pixel)
+            if top_key < new_key:  # The start moved since the pixel was queued
+                self.__push(pixel)
+                continue
+
+            expanded += 1
+            neighbours = [neighbour for neighbour, _ in self.__moves(pixel)]
+            if g.get(pixel, math.inf) > rhs.get(pixel, math.inf):
+                g[pixel] = rhs[pixel]
+            else:
+                g[pixel] = math.inf
+                self.__update_vertex(pixel)
+            for neighbour in neighbours:
+                self.__update_vertex(neighbour)
+        self.expanded = expanded
+
+
+class IncrementalPath:
+    """Path of one agent between two points of a Map, kept up to date while obstacles change.
+    Every pixel leg has its own DStarLite search, so after Map.update_obstacles only the legs affected by the change
+    do any work, and the door route is searched again only if a door on it got blocked or opened."""
+
+    def __init__(self, loaded_map: Map, start: tuple[int, int], end: tuple[int, int]):
+        """
+        :arg start: (x, y) start point, likewise end
+        :raises PathNotFoundError: if any of the points is not in the "blank" space of a room"""
+        self.__map = loaded_map
+        self.__start = tuple(start)
+        self.__end = tuple(end)
+        self.__route = None  # Door route positions (x, y), searched again when None
+        self.__legs = {}  # (leg start, leg end) -> DStarLite
+        self.__query = loaded_map.query(start, end)
+        if self.__query is None:
+            raise PathNotFoundError("The start or end point is not in the blank space of a room")
+        self.__waypoint_graph = loaded_map.get_waypoint_graph()
+
+    def path(self) -> list[tuple[int, int]]:
+        """Pixel path (list of (y, x) tuples, legs concatenated like in PathMaker.make_path) from the current start.
+        :raises PathNotFoundError: if the end point can't be reached"""
+        occupancy = self.__map.get_occupancy_grid()
+        if self.__route is None:
+            if self.__query is None:
+                self.__query = self.__map.query(self.__start, self.__end)
+                if self.__query is None:
+                    raise PathNotFoundError("The door route can't be searched again while the agent stands in a door")
+            maker = PathMaker.for_map(self.__map, waypoint_graph=self.__waypoint_graph)
+            route = maker.find_waypoint_path(self.__query)
+            self.__route = [self.__start] + [tuple(position) for position in route[1:]]
+            wanted = set(zip(self.__route, self.__route[1:]))
+            self.__legs = {leg: search for leg, search in self.__legs.items() if leg in wanted}
+
+        pixel_path = []
+        for leg in zip(self.__route, self.__route[1:]):
+            search = self.__legs.get(leg)
+            if search is None:
+                (start_x, start_y), (end_x, end_y) = leg
+                search = self.__legs[leg] = DStarLite(occupancy, (start_y, start_x), (end_y, end_x))
+            leg_path = search.path()
+            if leg_path is None:
+                raise PathNotFoundError(f"No pixel path between the waypoints {leg[0]} and {leg[1]}")
+            pixel_path += leg_path
+        return pixel_path
+
+    def update(self, rectangle: tuple):
+        """Take in a change of the map (the rectangle returned by Map.update_obstacles)"""
+        if rectangle is None:
+            return
+        occupancy = self.__map.get_occupancy_grid()
+        for search in self.__legs.values():
+            search.update(occupancy, rectangle)
+
+        waypoint_graph = self.__map.get_waypoint_graph()
+        if waypoint_graph is not self.__waypoint_graph:  # A door got blocked or opened
+            self.__waypoint_graph = waypoint_graph
+            self.__route = None
+
+    def advance(self, position: tuple[int, int]):
+        """The agent moved to the given (x, y) point of the current path, the following paths start there.
+        Legs already passed are dropped."""
+        if self.__route is None:
+            self.path()
+        position = tuple(position)
+        route = self.__route
+        for index in range(len(route) - 1):
+            leg = (route[index], route[index + 1])
+            leg_path = self.__legs[leg].path() if leg in self.__legs else None
+            if leg_path is not None and (position[1], position[0]) in leg_path:
+                break
+        else:
+            raise ValueError(f"The point {position} is not on the current path")
+
+        search = self.__legs[leg]
+        search.move_start((position[1], position[0]))
+        legs = {(position, route[index + 1]): search}
+        for later_leg in zip(route[index + 1:], route[index + 2:]):
+            if later_leg in self.__legs:
+                legs[later_leg] = self.__legs[later_leg]
+        self.__legs = legs
+        self.__route = [position] + route[index + 1:]
+        self.__start = position
+        # None while the agent stands in a door, the door route can't be searched from there
+        self.__query = self.__map.query(position, self.__end)
@@ -0,0 +1,68 @@
+import numpy as np
+from numpy import ndarray
+
+NO_ROOM = -1  # Point outside of every room (wall, obstacle or outside of the image)
+OVERLAPPING_ROOMS = -2  # Point inside more than one room
+DOOR = -3  # Point on a door pixel
+
+
+class RoomIndex:
+    """Spatial index of the rooms - an integer label image with the room id of every pixel
+    and a room to doors (waypoint indices) table, so locating a point is a single array read"""
+
+    def __init__(self, shape: tuple, room_areas: list[tuple], room_doors: list[list[int]], door_mask: ndarray = None,
+                 labels: ndarray = None):
+        """
+        :arg shape: (height, width) of the map image
+        :arg room_areas: room rectangles ((x_min, y_min), (x_max, y_max)), the room interior lies strictly inside
+        :arg room_doors: waypoint indices of the doors of every room
+        :arg door_mask: (height, width) bool array, True on door pixels
+        :arg labels: label image made by label_rooms from the same room_areas, created if not given
+        """
+        self.room_areas = room_areas
+        self.room_doors = room_doors
+        self.door_mask = door_mask
+        self.labels = labels if labels is not None else self.label_rooms(shape, room_areas)
+
+    @staticmethod
+    def label_rooms(shape: tuple, room_areas: list[tuple]) -> ndarray:
+        """Label image with the index of the room of every pixel, NO_ROOM or OVERLAPPING_ROOMS"""
+        labels = np.full(shape[:2], NO_ROOM, dtype=np.int32)
+        for room_id, ((x_min, y_min), (x_max, y_max)) in enumerate(room_areas):
+            region = labels[max(y_min + 1, 0):max(y_max, 0), max(x_min + 1, 0):max(x_max, 0)]
+            if (region == NO_ROOM).all():
+                region[...] = room_id
+            else:
+                region[...] = np.where(region == NO_ROOM, room_id, OVERLAPPING_ROOMS)
+        return labels
+
+    @classmethod
+    def from_waypoints(cls, shape: tuple, waypoints: list, door_mask: ndarray = None):
+        """Build the index from the rooms (accessible areas) of the door waypoints"""
+        rooms = {}  # Area -> waypoint indices, in order of appearance
+        for index, waypoint in enumerate(waypoints):
+            for area in waypoint.accessible_areas:
+                area = ((int(area[0][0]), int(area[0][1])), (int(area[1][0]), int(area[1][1])))
+                rooms.setdefault(area, []).append(index)
+        return cls(shape, list(rooms), list(rooms.values()), door_mask)
+
+    def locate(self, point: tuple[int, int]) -> int:
+        """Room id of the (x, y) point, or NO_ROOM, OVERLAPPING_ROOMS or DOOR"""
+        x, y = int(point[0]), int(point[1])
+        height, width = self.labels.shape
+        if not (0 <= x < width and 0 <= y < height):
+            return NO_ROOM
+        if self.door_mask is not None and self.door_mask[y, x]:
+            return DOOR
+        return int(self.labels[y, x])
+
+    def rooms_at(self, point: tuple[int, int]) -> list[int]:
+        """Ids of every room containing the (x, y) point, resolves OVERLAPPING_ROOMS"""
+        room = self.locate(point)
+        if room >= 0:
+            return [room]
+        if room != OVERLAPPING_ROOMS:
+            return []
+        x, y = int(point[0]), int(point[1])
+        return [room_id for room_id, ((x_min, y_min), (x_max, y_max)) in enumerate(self.room_areas)
+                if x_min < x < x_max and y_min < y < y_max]
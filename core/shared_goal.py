@@ -0,0 +1,187 @@
+import math
+
+import numpy as np
+from numpy import ndarray
+
+from core.flow_field import flow_directions, wavefront
+from core.instrumentation import Stats, timed
+from core.map import Map
+from core.path_maker import PathMaker, PathNotFoundError
+from core.pixel_search import NEIGHBOURS
+from core.query_cache import QueryCache
+from core.room_index import RoomIndex
+
+
+class SharedGoal:
+    """Paths of many agents to one goal point of a Map.
+    The work common to all of them is done once: a Dijkstra backwards from the goal gives the cost and the next door
+    of the cheapest route from every door, and a wavefront from the goal over its room gives the way to it from
+    every pixel there. A path then only needs the legs outside of the goal room (searched by a PathMaker, so they
+    use the map's flow fields if built, and shared by the agents whose routes merge) - along the same door route
+    PathMaker.make_path would take."""
+
+    def __init__(self, loaded_map: Map, goal: tuple[int, int], pixel_search: str = 'astar', stats: Stats = None):
+        """
+        :arg goal: (x, y) point in the "blank" space of a room
+        :arg pixel_search: search of the legs outside of the goal room, 'astar' or 'jps'
+        :arg stats: if given, the time of the 'door_costs' and 'goal_field' stages is added to it
+        :raises PathNotFoundError: if the goal is not in the "blank" space of a room"""
+        self.__map = loaded_map
+        self.__goal = (int(goal[0]), int(goal[1]))
+        located = loaded_map.query(self.__goal, self.__goal)
+        if located is None:
+            raise PathNotFoundError("The goal is not in the blank space of a room")
+
+        graph = loaded_map.get_waypoint_graph()
+        waypoints = loaded_map.get_waypoints()
+        self.__graph = graph
+        self.__graph_indices = {id(waypoint): index for index, waypoint in enumerate(waypoints[:len(graph)])}
+        goal_doors = [self.__graph_indices[id(waypoint)] for waypoint in located.end.accessible_waypoints
+                      if id(waypoint) in self.__graph_indices]
+        with timed(stats, 'door_costs'):
+            self.__door_costs, self.__next_doors = graph.costs_to(self.__goal, goal_doors)
+
+        with timed(stats, 'goal_field'):
+            occupancy = loaded_map.get_occupancy_grid()
+            room_index = loaded_map.get_room_index()
+            if room_index is None:
+                room_index = RoomIndex.from_waypoints((occupancy.height, occupancy.width), waypoints[:len(graph)])
+            # The goal rooms, extended to their doors, like the region of a flow field
+            rooms = room_index.rooms_at(self.__goal)
+            xs = [self.__goal[0]] + [corner[0] for room in rooms for corner in room_index.room_areas[room]]
+            ys = [self.__goal[1]] + [corner[1] for room in rooms for corner in room_index.room_areas[room]]
+            for door in goal_doors:
+                xs.append(int(graph.positions[door][0]))
+                ys.append(int(graph.positions[door][1]))
+            height, width = occupancy.height, occupancy.width
+            self.__left, self.__top = max(min(xs), 0), max(min(ys), 0)
+            right, bottom = min(max(xs), width - 1), min(max(ys), height - 1)
+            walkable = occupancy.walkable[self.__top:bottom + 1, self.__left:right + 1]
+            self.__distances = wavefront(walkable, (self.__goal[1] - self.__top, self.__goal[0] - self.__left))
+            self.__directions = flow_directions(walkable, self.__distances)
+
+        # Routes to one goal merge, the door to door legs they share are searched once
+        self.__maker = PathMaker.for_map(loaded_map, pixel_search=pixel_search, query_cache=QueryCache())
+
+    def route(self, start: tuple[int, int]):
+        """Door level route of an agent - positions (x, y) of the start, the doors to pass and the goal,
+        like PathMaker.find_waypoint_path
+        :raises PathNotFoundError: if the start is not in the "blank" space of a room or can't reach the goal"""
+        query = self.__map.query(start, self.__goal)
+        if query is None:
+            raise PathNotFoundError("The start point is not in the blank space of a room")
+        positions = self.__graph.positions.tolist()
+        best_cost, best_door = math.inf, None
+        if any(waypoint is query.end for waypoint in query.start.accessible_waypoints):  # Start in the goal room
+            best_cost = math.dist(start, self.__goal)
+        for waypoint in query.start.accessible_waypoints:
+            door = self.__graph_indices.get(id(waypoint))
+            if door is None or (self.__graph.closed is not None and self.__graph.closed[door]):
+                continue
+            cost = math.dist(start, positions[door]) + self.__door_costs[door]
+            if cost < best_cost:
+                best_cost, best_door = cost, door
+        if best_cost == math.inf:
+            raise PathNotFoundError("The goal can't be reached through the doors")
+
+        route = [tuple(start)]
+        door = best_door
+        while door is not None and door != -1:
+            route.append(tuple(positions[door]))
+            door = int(self.__next_doors[door])
+        return route + [self.__goal]
+
+    def path(self, start: tuple[int, int], end: tuple[int, int] = None):
+        """Pixel path (list of (y, x) tuples, legs concatenated like in PathMaker.make_path) of an agent.
+        :arg end: the agent's own final (x, y) position near the goal (see slots), the goal if None
+        :raises PathNotFoundError: if the goal can't be reached"""
+        route = self.route(start)
+        pixel_path = []
+        for leg_start, leg_end in zip(route[:-2], route[1:-1]):
+            pixel_path += self.__maker.make_leg(leg_start, leg_end)
+
+        last = route[-2]
+        final_leg = self.__walk(last)
+        if final_leg is None:  # Outside of the goal field, e.g. around an obstacle which leaves the room
+            final_leg = self.__maker.make_leg(last, self.__goal)
+        if end is not None and tuple(end) != self.__goal:
+            final_leg = self.__turn_off(final_leg, end)
+        return pixel_path + final_leg
+
+    def paths(self, starts: list[tuple[int, int]], spacing: int = 0) -> list:
+        """Pixel paths of many agents, None for an agent which can't reach the goal.
+        :arg spacing: if above 0, the agents stop on different pixels (slots) at least that many pixels apart
+        (Chebyshev distance), the agent nearest to the goal on the goal itself"""
+        if spacing <= 0:
+            return [self.__path_or_none(start) for start in starts]
+        costs = []
+        for start in starts:
+            try:
+                route = self.route(start)
+            except PathNotFoundError:
+                costs.append(math.inf)
+                continue
+            costs.append(sum(math.dist(a, b) for a, b in zip(route, route[1:])))
+        order = [agent for agent in np.argsort(costs, kind='stable').tolist() if costs[agent] < math.inf]
+        slots = self.slots(len(order), spacing)
+        paths = [None] * len(starts)
+        for agent, slot in zip(order, slots):
+            paths[agent] = self.__path_or_none(starts[agent], slot)
+        return paths
+
+    def slots(self, count: int, spacing: int) -> list[tuple[int, int]]:
+        """Up to count (x, y) end positions near the goal, at least spacing pixels apart (Chebyshev distance),
+        the goal first and the others in the order of their distance to it"""
+        distances = self.__distances.ravel()
+        reachable = np.flatnonzero(np.isfinite(distances))
+        candidates = reachable[np.argsort(distances[reachable], kind='stable')]
+        width = self.__distances.shape[1]
+        chosen = np.zeros((0, 2), dtype=np.int64)
+        for candidate in candidates.tolist():
+            if len(chosen) == count:
+                break
+            point = np.array(divmod(candidate, width))
+            if len(chosen) and (np.abs(chosen - point).max(axis=1) < spacing).any():
+                continue
+            chosen = np.vstack([chosen, point])
+        return [(x + self.__left, y + self.__top) for y, x in chosen.tolist()]
+
+    def goal_field(self) -> tuple[ndarray, tuple[int, int]]:
+        """Distances to the goal (inf where unreachable) over the goal rooms and the (x, y) position of their
+        upper left corner"""
+        return self.__distances, (self.__left, self.__top)
+
+    def __path_or_none(self, start: tuple[int, int], end: tuple[int, int] = None):
+        try:
+            return self.path(start, end)
+        except PathNotFoundError:
+            return None
+
+    def __walk(self, point: tuple[int, int]):
+        """Follow the goal field from the (x, y) point, None if it doesn't cover the point"""
+        y, x = int(point[1]) - self.__top, int(point[0]) - self.__left
+        height, width = self.__directions.shape
+        if not (0 <= y < height and 0 <= x < width) or not np.isfinite(self.__distances[y, x]):
+            return None
+        path = [(y + self.__top, x + self.__left)]
+        direction = int(self.__directions[y, x])
+        while direction >= 0:
+            dy, dx, _ = NEIGHBOURS[direction]
+            y += dy
+            x += dx
+            path.append((y + self.__top, x + self.__left))
+            direction = int(self.__directions[y, x])
+        return path
+
+    def __turn_off(self, final_leg: list, end: tuple[int, int]) -> list:
+        """Make the leg towards the goal end at the (x, y) end position instead. The leg and the way from the end
+        position down the goal field meet at the latest on the goal - the leg is cut there and continues back up
+        the way to the end position."""
+        way = self.__walk(end)
+        if way is None:
+            raise PathNotFoundError(f"The end position {tuple(end)} is not reachable from the goal")
+        way_indices = {point: index for index, point in enumerate(way)}
+        for index, point in enumerate(final_leg):
+            if point in way_indices:
+                return final_leg[:index] + way[way_indices[point]::-1]
+        raise PathNotFoundError(f"The end position {tuple(end)} is not reachable from the goal")
@@ -0,0 +1,396 @@
+import json
+import os
+import struct
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+from numpy import ndarray
+
+from core.jump_point_search import JumpPointSearch
+from core.occupancy import occupancy_grid_from_image
+from core.path_maker import PathNotFoundError
+from core.pixel_search import PixelAStar
+from core.waypoint_graph import WaypointGraph
+
+TILED_MAP_VERSION = 1
+TILES_FILE_NAME = 'occupancy.tiles'
+HEADER_FILE_NAME = 'map.json'
+ARRAYS_FILE_NAME = 'map.npz'
+# Largest image (in pixels) build_tiled_map decodes at once, about 200 MB of BGR pixels - larger maps go as .npy
+MAX_DECODED_PIXELS = 1 << 26
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+class TileStore:
+    """Occupancy grid (255 - free pixel, 0 - wall) stored as square tiles in a memory-mapped file.
+    Tile (row, column) is a contiguous tile_size x tile_size block, the tiles on the right and bottom edge are padded
+    with walls. Tiles are copied out of the file on demand and kept in a bounded LRU cache, so only the tiles
+    around the searched areas are ever held in memory."""
+
+    def __init__(self, path: str, shape: tuple[int, int], tile_size: int, cache_tiles: int = 64, mode: str = 'r'):
+        """
+        :arg shape: (height, width) of the whole grid
+        :arg cache_tiles: number of tiles kept in memory
+        :arg mode: 'r' to read an existing file, 'w+' to create it
+        """
+        self.height, self.width = shape
+        self.tile_size = tile_size
+        self.tile_rows = -(-self.height // tile_size)
+        self.tile_columns = -(-self.width // tile_size)
+        self.__tiles = np.memmap(path, dtype=np.uint8, mode=mode,
+                                 shape=(self.tile_rows, self.tile_columns, tile_size, tile_size))
+        self.__cache = OrderedDict()  # (tile row, tile column) -> tile array, least recently used first
+        self.__cache_tiles = cache_tiles
+
+        # Cache counters
+        self.hits = 0
+        self.misses = 0
+
+    def tile(self, tile_row: int, tile_column: int) -> ndarray:
+        """Read-only (tile_size, tile_size) array of the tile"""
+        key = (tile_row, tile_column)
+        tile = self.__cache.get(key)
+        if tile is not None:
+            self.hits += 1
+            self.__cache.move_to_end(key)
+            return tile
+        self.misses += 1
+        tile = np.array(self.__tiles[tile_row, tile_column])
+        tile.flags.writeable = False
+        self.__cache[key] = tile
+        if len(self.__cache) > self.__cache_tiles:
+            self.__cache.popitem(last=False)
+        return tile
+
+    def write_tile(self, tile_row: int, tile_column: int, tile: ndarray):
+        """Store the tile (smaller edge tiles are padded with walls), only in the 'w+' mode"""
+        self.__tiles[tile_row, tile_column] = 0
+        self.__tiles[tile_row, tile_column, :tile.shape[0], :tile.shape[1]] = tile
+        self.__cache.pop((tile_row, tile_column), None)
+
+    def flush(self):
+        self.__tiles.flush()
+
+    def window(self, left: int, top: int, right: int, bottom: int) -> ndarray:
+        """Copy of the grid inside the rectangle, corners (x, y) included, assembled from the tiles"""
+        size = self.tile_size
+        window = np.zeros((bottom - top + 1, right - left + 1), dtype=np.uint8)
+        for tile_row in range(top // size, bottom // size + 1):
+            for tile_column in range(left // size, right // size + 1):
+                tile = self.tile(tile_row, tile_column)
+                y_from, y_to = max(top, tile_row * size), min(bottom + 1, (tile_row + 1) * size)
+                x_from, x_to = max(left, tile_column * size), min(right + 1, (tile_column + 1) * size)
+                tile_top, tile_left = tile_row * size, tile_column * size
+                window[y_from - top:y_to - top, x_from - left:x_to - left] = \
+                    tile[y_from - tile_top:y_to - tile_top, x_from - tile_left:x_to - tile_left]
+        return window
+
+    def is_free(self, point: tuple[int, int]) -> bool:
+        """Whether the (x, y) pixel is free"""
+        x, y = int(point[0]), int(point[1])
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return False
+        size = self.tile_size
+        return self.tile(y // size, x // size)[y % size, x % size] == 255
+
+    def cached_tiles(self) -> int:
+        return len(self.__cache)
+
+
+class _UnionFind:
+    """Disjoint sets of the component ids of all the tiles"""
+
+    def __init__(self):
+        self.parents = []
+
+    def add(self, count: int) -> int:
+        """Add count new sets, returns the id of the first one"""
+        first = len(self.parents)
+        self.parents.extend(range(first, first + count))
+        return first
+
+    def find(self, item: int) -> int:
+        parents = self.parents
+        root = item
+        while parents[root] != root:
+            root = parents[root]
+        while parents[item] != root:
+            parents[item], item = root, parents[item]
+        return root
+
+    def union(self, first: int, second: int):
+        first, second = self.find(first), self.find(second)
+        if first != second:
+            self.parents[max(first, second)] = min(first, second)
+
+
+class _ComponentStitcher:
+    """Bounding boxes of the 8-connected components of a mask processed tile by tile.
+    Components are labelled in every tile separately and joined where they touch across the tile borders."""
+
+    def __init__(self):
+        self.__sets = _UnionFind()
+        self.__boxes = []  # (x_min, y_min, x_max, y_max) of every tile component, in global pixel coordinates
+        self.__borders = {}  # (tile row, tile column) -> global ids on (top row, bottom row, left column, right column)
+
+    def add_tile(self, tile_row: int, tile_column: int, origin: tuple[int, int], mask: ndarray):
+        count, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        first = self.__sets.add(count - 1)
+        x, y = origin
+        for left, top, width, height, _ in stats[1:].tolist():
+            self.__boxes.append((x + left, y + top, x + left + width - 1, y + top + height - 1))
+
+        # Global ids of the border pixels, -1 outside of the mask
+        global_labels = lambda border: np.where(border > 0, border + first - 1, -1)
+        borders = (global_labels(labels[0]), global_labels(labels[-1]), global_labels(labels[:, 0]),
+                   global_labels(labels[:, -1]))
+        self.__borders[(tile_row, tile_column)] = borders
+
+        top_border, _, left_border, _ = borders
+        above = self.__borders.get((tile_row - 1, tile_column))
+        if above is not None:
+            self.__join_lines(above[1], top_border)
+        before = self.__borders.get((tile_row, tile_column - 1))
+        if before is not None:
+            self.__join_lines(before[3], left_border)
+        # Diagonal neighbours touch only in a corner pixel
+        above_before = self.__borders.get((tile_row - 1, tile_column - 1))
+        if above_before is not None:
+            self.__join(above_before[1][-1:], top_border[:1])
+        above_after = self.__borders.get((tile_row - 1, tile_column + 1))
+        if above_after is not None:
+            self.__join(above_after[1][:1], top_border[-1:])
+
+    def finish_row(self, tile_row: int):
+        """Forget the borders of the rows above the given one, they can't touch the following tiles anymore"""
+        for key in [key for key in self.__borders if key[0] < tile_row]:
+            del self.__borders[key]
+
+    def boxes(self) -> ndarray:
+        """(n, 4) bounding boxes (x_min, y_min, x_max, y_max) of the joined components, in order of appearance"""
+        if not self.__boxes:
+            return np.zeros((0, 4), dtype=np.int64)
+        boxes = np.array(self.__boxes, dtype=np.int64)
+        roots = np.array([self.__sets.find(item) for item in range(len(boxes))])
+        unique_roots, groups = np.unique(roots, return_inverse=True)
+        joined = np.empty((len(unique_roots), 4), dtype=np.int64)
+        joined[:, :2] = np.iinfo(np.int64).max
+        joined[:, 2:] = np.iinfo(np.int64).min
+        np.minimum.at(joined[:, 0], groups, boxes[:, 0])
+        np.minimum.at(joined[:, 1], groups, boxes[:, 1])
+        np.maximum.at(joined[:, 2], groups, boxes[:, 2])
+        np.maximum.at(joined[:, 3], groups, boxes[:, 3])
+        return joined
+
+    def __join_lines(self, first: ndarray, second: ndarray):
+        """Join the components of two touching parallel border lines, 8-connected (straight and diagonal)"""
+        length = min(len(first), len(second))
+        first, second = first[:length], second[:length]
+        self.__join(first, second)
+        self.__join(first[:-1], second[1:])
+        self.__join(first[1:], second[:-1])
+
+    def __join(self, first: ndarray, second: ndarray):
+        touching = (first >= 0) & (second >= 0)
+        if not touching.any():
+            return
+        for first_id, second_id in np.unique(np.stack([first[touching], second[touching]], axis=1), axis=0).tolist():
+            self.__sets.union(first_id, second_id)
+
+
+class _RoomLookup:
+    """Rooms containing a point, through buckets of the rooms overlapping every tile (no full size label image)"""
+
+    def __init__(self, room_areas: ndarray, tile_size: int):
+        self.__room_areas = room_areas  # (r, 4) (x_min, y_min, x_max, y_max), the interior lies strictly inside
+        self.__tile_size = tile_size
+        self.__buckets = {}
+        for room, (x_min, y_min, x_max, y_max) in enumerate(room_areas.tolist()):
+            for tile_row in range(max(y_min, 0) // tile_size, max(y_max, 0) // tile_size + 1):
+                for tile_column in range(max(x_min, 0) // tile_size, max(x_max, 0) // tile_size + 1):
+                    self.__buckets.setdefault((tile_row, tile_column), []).append(room)
+
+    def rooms_at(self, point: tuple[int, int]) -> list[int]:
+        x, y = int(point[0]), int(point[1])
+        areas = self.__room_areas
+        return [room for room in self.__buckets.get((y // self.__tile_size, x // self.__tile_size), ())
+                if areas[room, 0] < x < areas[room, 2] and areas[room, 1] < y < areas[room, 3]]
+
+
+def _png_size(path: str):
+    """(height, width) read from the header of a PNG file without decoding it, None for other formats"""
+    with open(path, 'rb') as image_file:
+        header = image_file.read(24)
+    if header[:8] != PNG_SIGNATURE or header[12:16] != b'IHDR':
+        return None
+    width, height = struct.unpack('>II', header[16:24])
+    return height, width
+
+
+def build_tiled_map(source: str, directory: str, tile_size: int = 512, door_colour: tuple = (0, 255, 0),
+                    obstacle_colour: tuple = (255, 0, 0), max_decoded_pixels: int = MAX_DECODED_PIXELS) -> str:
+    """Process a map image tile by tile, with the rules of MapLoader, into a directory with the tiled occupancy grid
+    and the rooms, doors and waypoint connections.
+    :arg source: .npy file with the BGR pixels, memory-mapped so maps too large for memory are read a tile at
+    a time, or a map image - an image is decoded whole, so it must fit in memory
+    :arg max_decoded_pixels: a PNG with more pixels is rejected before it is decoded
+    :returns: the directory
+    :raises ValueError: if the image can't be read or is too large to be decoded at once"""
+    if source.endswith('.npy'):
+        image = np.load(source, mmap_mode='r')
+    else:
+        size = _png_size(source)
+        if size is not None and size[0] * size[1] > max_decoded_pixels:
+            raise ValueError(f"Map image '{source}' has {size[1]}x{size[0]} pixels, too many to decode at once - "
+                             f"save its BGR pixels as a .npy file, which is read a tile at a time")
+        image = cv2.imread(source)
+        if image is None:
+            raise ValueError(f"Can't read the map image '{source}'")
+    height, width = image.shape[:2]
+    os.makedirs(directory, exist_ok=True)
+    store = TileStore(os.path.join(directory, TILES_FILE_NAME), (height, width), tile_size, cache_tiles=0,
+                      mode='w+')
+
+    doors = _ComponentStitcher()
+    rooms = _ComponentStitcher()
+    for tile_row in range(store.tile_rows):
+        for tile_column in range(store.tile_columns):
+            top, left = tile_row * tile_size, tile_column * tile_size
+            tile = np.ascontiguousarray(image[top:top + tile_size, left:left + tile_size])
+            obstacles = cv2.inRange(tile, obstacle_colour, obstacle_colour)
+            door_pixels = cv2.inRange(tile, door_colour, door_colour)
+            room_pixels = cv2.bitwise_or(cv2.inRange(tile, (255, 255, 255), (255, 255, 255)), obstacles)
+
+            # Obstacles are black on the prepared image, the occupancy is its thresholded greyscale
+            prepared = cv2.subtract(tile, tile, dst=tile.copy(), mask=obstacles)
+            store.write_tile(tile_row, tile_column, occupancy_grid_from_image(prepared))
+            doors.add_tile(tile_row, tile_column, (left, top), door_pixels)
+            rooms.add_tile(tile_row, tile_column, (left, top), room_pixels)
+        doors.finish_row(tile_row)
+        rooms.finish_row(tile_row)
+    store.flush()
+
+    # Same filter as MapLoader - thin strips are not rooms, a room includes the surrounding wall pixels
+    room_boxes = rooms.boxes()
+    area_width = room_boxes[:, 2] - room_boxes[:, 0]
+    area_height = room_boxes[:, 3] - room_boxes[:, 1]
+    accepted = (area_width >= 7) & (area_height >= 7) & (area_width < width - 1) & (area_height < height - 1)
+    room_areas = room_boxes[accepted] + np.array([-1, -1, 1, 1])
+
+    door_boxes = doors.boxes()
+    lookup = _RoomLookup(room_areas, tile_size)
+    positions = {}  # Door middle -> waypoint index
+    room_doors = [[] for _ in room_areas]
+    for x_min, y_min, x_max, y_max in door_boxes.tolist():
+        x_mid, y_mid = (x_min + x_max) // 2, (y_min + y_max) // 2
+        for sample in ((x_max + 1, y_mid), (x_min - 1, y_mid), (x_mid, y_max + 1), (x_mid, y_min - 1)):
+            sample_rooms = lookup.rooms_at(sample)
+            if len(sample_rooms) != 1:  # Outside of the rooms, or where rooms overlap (like MapLoader)
+                continue
+            door = positions.setdefault((x_mid, y_mid), len(positions))
+            if door not in room_doors[sample_rooms[0]]:
+                room_doors[sample_rooms[0]].append(door)
+
+    # Every pair of doors of a room is connected
+    connections = [dict() for _ in positions]
+    for doors_of_room in room_doors:
+        for door in doors_of_room:
+            connections[door].update(dict.fromkeys(other for other in doors_of_room if other != door))
+    adjacency_offsets = np.zeros(len(positions) + 1, dtype=np.int32)
+    adjacency_offsets[1:] = np.cumsum([len(connected) for connected in connections])
+    adjacency_indices = np.array([other for connected in connections for other in connected], dtype=np.int32)
+    room_door_offsets = np.zeros(len(room_doors) + 1, dtype=np.int32)
+    room_door_offsets[1:] = np.cumsum([len(doors_of_room) for doors_of_room in room_doors])
+    room_door_indices = np.array([door for doors_of_room in room_doors for door in doors_of_room], dtype=np.int32)
+
+    np.savez(os.path.join(directory, ARRAYS_FILE_NAME),
+             waypoint_positions=np.array(list(positions), dtype=np.int32).reshape(-1, 2),
+             room_areas=room_areas.astype(np.int32), room_door_offsets=room_door_offsets,
+             room_door_indices=room_door_indices, adjacency_offsets=adjacency_offsets,
+             adjacency_indices=adjacency_indices)
+    with open(os.path.join(directory, HEADER_FILE_NAME), 'w') as header_file:
+        json.dump({'version': TILED_MAP_VERSION, 'height': height, 'width': width, 'tile_size': tile_size}, header_file)
+    return directory
+
+
+class TiledMap:
+    """Map built with build_tiled_map. Only the rooms, doors and waypoint graph are loaded, the occupancy grid
+    stays in the tile file. Every pixel leg runs between two points of one room, so it is searched on a window
+    of the room alone, assembled from the cached tiles - the memory used depends on the rooms a path passes,
+    not on the size of the world."""
+
+    def __init__(self, directory: str, cache_tiles: int = 64):
+        with open(os.path.join(directory, HEADER_FILE_NAME)) as header_file:
+            header = json.load(header_file)
+        if header['version'] != TILED_MAP_VERSION:
+            raise ValueError(f"Tiled map '{directory}' has version {header['version']}, expected {TILED_MAP_VERSION}")
+        self.tiles = TileStore(os.path.join(directory, TILES_FILE_NAME), (header['height'], header['width']),
+                               header['tile_size'], cache_tiles)
+
+        with np.load(os.path.join(directory, ARRAYS_FILE_NAME), allow_pickle=False) as data:
+            self.room_areas = data['room_areas']  # (r, 4) (x_min, y_min, x_max, y_max)
+            offsets, indices = data['room_door_offsets'].tolist(), data['room_door_indices'].tolist()
+            self.room_doors = [indices[offsets[room]:offsets[room + 1]] for room in range(len(self.room_areas))]
+            self.waypoint_graph = WaypointGraph(data['waypoint_positions'], data['adjacency_offsets'],
+                                                data['adjacency_indices'])
+        self.__rooms = _RoomLookup(self.room_areas, header['tile_size'])
+        self.__door_rooms = [[] for _ in range(len(self.waypoint_graph))]
+        for room, doors in enumerate(self.room_doors):
+            for door in doors:
+                self.__door_rooms[door].append(room)
+
+    def rooms_at(self, point: tuple[int, int]) -> list[int]:
+        """Rooms whose interior contains the (x, y) point"""
+        return self.__rooms.rooms_at(point)
+
+    def find_path(self, start: tuple[int, int], end: tuple[int, int], pixel_search: str = 'astar'):
+        """Path between two (x, y) points, like PathMaker.make_path - first through the doors, then pixel by pixel
+        between the consecutive waypoints.
+        :arg pixel_search: 'astar' or 'jps'
+        :returns: list of (y, x) tuples, the legs concatenated
+        :raises PathNotFoundError: if a point is not in the free space of a room or the end can't be reached"""
+        start_rooms = self.rooms_at(start) if self.tiles.is_free(start) else []
+        end_rooms = self.rooms_at(end) if self.tiles.is_free(end) else []
+        if not start_rooms or not end_rooms:
+            raise PathNotFoundError("The start or end point is not in the free space of a room")
+
+        start_doors = list(dict.fromkeys(door for room in start_rooms for door in self.room_doors[room]))
+        end_doors = list(dict.fromkeys(door for room in end_rooms for door in self.room_doors[room]))
+        direct = any(room in end_rooms for room in start_rooms)
+        route = self.waypoint_graph.route(start, start_doors, end, end_doors, direct)
+        if route is None:
+            raise PathNotFoundError("The end point can't be reached through the doors")
+
+        positions = self.waypoint_graph.positions
+        points = [(tuple(start), start_rooms)] + [(tuple(positions[door].tolist()), self.__door_rooms[door])
+                                                  for door in route] + [(tuple(end), end_rooms)]
+        pixel_path = []
+        for (leg_start, rooms_of_start), (leg_end, rooms_of_end) in zip(points, points[1:]):
+            leg = None
+            for room in rooms_of_start:
+                if room in rooms_of_end:
+                    leg = self.__search_in_room(room, leg_start, leg_end, pixel_search)
+                    if leg is not None:
+                        break
+            if leg is None:
+                raise PathNotFoundError(f"No pixel path between the waypoints {leg_start} and {leg_end}")
+            pixel_path += leg
+        return pixel_path
+
+    def __search_in_room(self, room: int, start: tuple[int, int], end: tuple[int, int], pixel_search: str):
+        """Search a leg on the window of the room (its area extended to its doors)"""
+        x_min, y_min, x_max, y_max = self.room_areas[room].tolist()
+        doors = self.waypoint_graph.positions[self.room_doors[room]] if self.room_doors[room] else \
+            np.zeros((0, 2), dtype=np.int32)
+        xs = [x_min, x_max, start[0], end[0]] + doors[:, 0].tolist()
+        ys = [y_min, y_max, start[1], end[1]] + doors[:, 1].tolist()
+        left, top = max(min(xs), 0), max(min(ys), 0)
+        right, bottom = min(max(xs), self.tiles.width - 1), min(max(ys), self.tiles.height - 1)
+
+        window = self.tiles.window(left, top, right, bottom)
+        engine = JumpPointSearch(window) if pixel_search == 'jps' else PixelAStar(window)
+        path = engine.search((start[1] - top, start[0] - left), (end[1] - top, end[0] - left))
+        if path is None:
+            return None
+        return [(y + top, x + left) for y, x in path]
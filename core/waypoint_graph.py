@@ -0,0 +1,248 @@
+import heapq
+import math
+
+import numpy as np
+from numpy import ndarray
+
+
+class WaypointGraph:
+    """Array form of the door waypoints - positions in an (n, 2) int array and the connections in CSR arrays:
+    the waypoints accessible from waypoint i are indices[offsets[i]:offsets[i + 1]], with the matching weights.
+    Optionally holds all-pairs distances and a next-hop table, so routing between doors is a table walk."""
+
+    def __init__(self, positions: ndarray, offsets: ndarray, indices: ndarray, weights: ndarray = None,
+                 distances: ndarray = None, next_hops: ndarray = None):
+        self.positions = np.asarray(positions, dtype=np.int32).reshape(-1, 2)  # (x, y)
+        self.offsets = np.asarray(offsets, dtype=np.int32)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        if weights is None:  # Euclidean distance between the connected doors
+            sources = np.repeat(np.arange(len(self.positions)), np.diff(self.offsets))
+            weights = np.hypot(*(self.positions[self.indices] - self.positions[sources]).T)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.distances = distances  # (n, n) float64, inf if unreachable
+        self.next_hops = next_hops  # (n, n) int32, first waypoint after i on the way to j, -1 if unreachable
+        self.closed = None  # (n,) bool, doors which can't be passed, see without_doors
+
+        # Python lists for the heap based search, indexing them is much faster than indexing numpy arrays
+        self.__offsets = self.offsets.tolist()
+        self.__indices = self.indices.tolist()
+        self.__weights = self.weights.tolist()
+
+    @classmethod
+    def from_waypoints(cls, waypoints: list):
+        """Build the graph from linked Waypoint objects (waypoints with an Area position use its middle)"""
+        waypoint_indices = {id(waypoint): index for index, waypoint in enumerate(waypoints)}
+        positions = []
+        for waypoint in waypoints:
+            position = waypoint.position
+            if hasattr(position, 'middle'):  # Area
+                position = position.middle
+            positions.append((int(position[0]), int(position[1])))
+
+        offsets = [0]
+        indices = []
+        for waypoint in waypoints:
+            indices += [waypoint_indices[id(other)] for other in waypoint.accessible_waypoints
+                        if id(other) in waypoint_indices]
+            offsets.append(len(indices))
+        return cls(positions, offsets, indices)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def without_doors(self, doors):
+        """Copy of the graph in which the given waypoints can't be passed (doors blocked by an obstacle).
+        The all-pairs tables are not copied, so routes on the copy use Dijkstra."""
+        closed = np.zeros(len(self.positions), dtype=bool)
+        closed[list(doors)] = True
+        sources = np.repeat(np.arange(len(self.positions)), np.diff(self.offsets))
+        weights = np.where(closed[sources] | closed[self.indices], np.inf, self.weights)
+        graph = WaypointGraph(self.positions, self.offsets, self.indices, weights)
+        graph.closed = closed
+        return graph
+
+    def compute_all_pairs(self):
+        """Fill the distances and next_hops tables with the Floyd-Warshall algorithm, vectorized per intermediate
+        waypoint. O(n^3) time and 12 * n^2 bytes, meant for the compile step."""
+        count = len(self.positions)
+        distances = np.full((count, count), np.inf)
+        next_hops = np.full((count, count), -1, dtype=np.int32)
+        sources = np.repeat(np.arange(count), np.diff(self.offsets))
+        np.minimum.at(distances, (sources, self.indices), self.weights)
+        next_hops[sources, self.indices] = self.indices
+        np.fill_diagonal(distances, 0.0)
+        np.fill_diagonal(next_hops, np.arange(count, dtype=np.int32))
+
+        for via in range(count):
+            through_via = distances[:, via, None] + distances[None, via, :]
+            shorter = through_via < distances
+            np.copyto(distances, through_via, where=shorter)
+            np.copyto(next_hops, np.broadcast_to(next_hops[:, via, None], next_hops.shape), where=shorter)
+
+        self.distances = distances
+        self.next_hops = next_hops
+
+    def route(self, start: tuple[int, int], start_doors: list[int], end: tuple[int, int], end_doors: list[int],
+              direct: bool = False):
+        """Shortest route from the start point through the doors to the end point.
+        :arg start_doors: indices of the waypoints accessible from the start point, likewise end_doors
+        :arg direct: True if the end is accessible straight from the start (same room)
+        :returns: list of waypoint indices (empty for a direct route) or None if the end can't be reached"""
+        if self.closed is not None:
+            start_doors = [door for door in start_doors if not self.closed[door]]
+            end_doors = [door for door in end_doors if not self.closed[door]]
+        start_doors = np.asarray(start_doors, dtype=np.int64)
+        end_doors = np.asarray(end_doors, dtype=np.int64)
+        best_cost = math.dist(start, end) if direct else math.inf
+
+        if self.next_hops is not None:
+            if len(start_doors) == 0 or len(end_doors) == 0:
+                return [] if direct else None
+            to_start = np.hypot(*(self.positions[start_doors] - start).T)
+            to_end = np.hypot(*(self.positions[end_doors] - end).T)
+            costs = to_start[:, None] + self.distances[np.ix_(start_doors, end_doors)] + to_end[None, :]
+            first, last = np.unravel_index(np.argmin(costs), costs.shape)
+            if not costs[first, last] < best_cost:
+                return [] if direct else None
+            return self.__walk(int(start_doors[first]), int(end_doors[last]))
+
+        return self.__dijkstra(start, start_doors.tolist(), end, end_doors.tolist(), best_cost)
+
+    def door_routes(self, start_doors: list[int], end_doors: list[int]) -> dict[tuple[int, int], tuple[float, list]]:
+        """Shortest routes between every start door and every end door, with one Dijkstra per start door
+        (or the all-pairs tables). Unlike route it doesn't depend on the endpoints, so it can be cached per room pair.
+        :returns: (start door, end door) -> (cost, list of waypoint indices), unreachable pairs left out"""
+        if self.closed is not None:
+            start_doors = [door for door in start_doors if not self.closed[door]]
+            end_doors = [door for door in end_doors if not self.closed[door]]
+        routes = {}
+        for first in dict.fromkeys(start_doors):
+            if self.next_hops is not None:
+                for last in end_doors:
+                    if self.next_hops[first, last] != -1:
+                        routes[(first, last)] = (float(self.distances[first, last]), self.__walk(first, last))
+                continue
+            distances, parents = self.__distances_from(first, set(end_doors))
+            for last in end_doors:
+                if last in distances:
+                    route = [last]
+                    while route[-1] != first:
+                        route.append(parents[route[-1]])
+                    routes[(first, last)] = (distances[last], route[::-1])
+        return routes
+
+    def costs_to(self, end: tuple[int, int], end_doors: list[int]) -> tuple[ndarray, ndarray]:
+        """Dijkstra backwards from the end point over the whole graph (the connections are symmetric), for routing
+        many starts to one end point.
+        :arg end_doors: indices of the waypoints accessible from the end point
+        :returns: (n,) float64 cost of the cheapest route from every waypoint to the end (inf if unreachable) and
+        (n,) int32 next waypoint on that route, -1 where the route goes straight to the end (or is unreachable)"""
+        if self.closed is not None:
+            end_doors = [door for door in end_doors if not self.closed[door]]
+        positions = self.positions.tolist()
+        offsets = self.__offsets
+        indices = self.__indices
+        weights = self.__weights
+        costs = [math.inf] * len(positions)
+        next_doors = [-1] * len(positions)
+        heap = []
+        for door in end_doors:
+            cost = math.dist(positions[door], end)
+            if cost < costs[door]:
+                costs[door] = cost
+                heapq.heappush(heap, (cost, door))
+
+        closed = [False] * len(positions)
+        while heap:
+            cost, door = heapq.heappop(heap)
+            if closed[door]:
+                continue
+            closed[door] = True
+            for edge in range(offsets[door], offsets[door + 1]):
+                neighbour = indices[edge]
+                new_cost = cost + weights[edge]
+                if new_cost < costs[neighbour]:
+                    costs[neighbour] = new_cost
+                    next_doors[neighbour] = door
+                    heapq.heappush(heap, (new_cost, neighbour))
+        return np.array(costs, dtype=np.float64), np.array(next_doors, dtype=np.int32)
+
+    def __distances_from(self, first: int, targets: set[int]):
+        """Dijkstra from a door until all the targets are settled, returns the distances and parents"""
+        offsets = self.__offsets
+        indices = self.__indices
+        weights = self.__weights
+        distances = {first: 0.0}
+        parents = {}
+        heap = [(0.0, first)]
+        closed = set()
+        remaining = set(targets)
+        while heap and remaining:
+            distance, door = heapq.heappop(heap)
+            if door in closed:
+                continue
+            closed.add(door)
+            remaining.discard(door)
+            for edge in range(offsets[door], offsets[door + 1]):
+                neighbour = indices[edge]
+                new_distance = distance + weights[edge]
+                if new_distance < distances.get(neighbour, math.inf):
+                    distances[neighbour] = new_distance
+                    parents[neighbour] = door
+                    heapq.heappush(heap, (new_distance, neighbour))
+        return {door: distance for door, distance in distances.items() if door in closed}, parents
+
+    def __walk(self, first: int, last: int) -> list[int]:
+        route = [first]
+        while route[-1] != last:
+            route.append(int(self.next_hops[route[-1], last]))
+        return route
+
+    def __dijkstra(self, start: tuple, start_doors: list[int], end: tuple, end_doors: list[int], best_cost: float):
+        """Dijkstra from a virtual node at the start point to a virtual node at the end point"""
+        positions = self.positions.tolist()
+        offsets = self.__offsets
+        indices = self.__indices
+        weights = self.__weights
+        to_end = {door: math.dist(positions[door], end) for door in end_doors}
+
+        distances = {}
+        parents = {}
+        heap = []
+        for door in start_doors:
+            distance = math.dist(start, positions[door])
+            if distance < distances.get(door, math.inf):
+                distances[door] = distance
+                parents[door] = -1
+                heapq.heappush(heap, (distance, door))
+
+        best_door = None
+        closed = set()
+        while heap:
+            distance, door = heapq.heappop(heap)
+            if distance >= best_cost:  # Nothing left on the heap can beat the best route found
+                break
+            if door in closed:
+                continue
+            closed.add(door)
+
+            if door in to_end and distance + to_end[door] < best_cost:
+                best_cost = distance + to_end[door]
+                best_door = door
+
+            for edge in range(offsets[door], offsets[door + 1]):
+                neighbour = indices[edge]
+                new_distance = distance + weights[edge]
+                if new_distance < distances.get(neighbour, math.inf):
+                    distances[neighbour] = new_distance
+                    parents[neighbour] = door
+                    heapq.heappush(heap, (new_distance, neighbour))
+
+        if best_door is None:
+            return [] if best_cost < math.inf else None
+        route = []
+        door = best_door
+        while door != -1:
+            route.append(door)
+            door = parents[door]
+        return route[::-1]
@@ -0,0 +1,57 @@
+import argparse
+import json
+import os
+
+from core.path_service import PathService, make_server
+
+
+def parse_map(value: str) -> tuple[str, str]:
+    """'name=path' or 'path' (named after the file) -> (name, path)"""
+    name, separator, path = value.partition('=')
+    if not separator:
+        path = value
+        name = os.path.splitext(os.path.basename(value))[0]
+    return name, path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless path service - answers path queries over HTTP with JSON, '
+                                                 'without the UI')
+    parser.add_argument('--map', dest='maps', action='append', type=parse_map, required=True,
+                        help="map image to preload, 'name=path' or 'path' (named after the file), repeatable")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, the CPU count by default')
+    parser.add_argument('--pixel-search', choices=('astar', 'jps'), default='astar')
+    parser.add_argument('--flow-fields', action='store_true', help='build the flow fields of the maps at startup')
+    parser.add_argument('--batch-size', type=int, default=32, help='most queries sent to a worker at once')
+    parser.add_argument('--batch-wait-ms', type=float, default=2.0,
+                        help='milliseconds a query waits for others to join its batch')
+    parser.add_argument('--query', nargs=5, metavar=('MAP', 'START_X', 'START_Y', 'END_X', 'END_Y'),
+                        help='answer one query, print it as JSON and exit instead of serving')
+    args = parser.parse_args()
+
+    service = PathService(dict(args.maps), args.workers, args.pixel_search, args.flow_fields, args.batch_size,
+                          args.batch_wait_ms / 1000)
+    try:
+        if args.query:
+            map_name, *coordinates = args.query
+            start_x, start_y, end_x, end_y = (int(value) for value in coordinates)
+            result = service.find_path(map_name, (start_x, start_y), (end_x, end_y))
+            print(json.dumps({'path': result.path} if result.error is None else {'error': result.error}))
+            return
+
+        server = make_server(service, args.host, args.port)
+        print(f"Serving {', '.join(service.map_names())} on http://{args.host}:{server.server_port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+    finally:
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Seeded random grids and path checks shared by the search tests"""
+import math
+import random
+
+import numpy as np
+import pytest
+
+from core.occupancy import OccupancyGrid
+
+SEEDS = range(8)
+PAIRS = 15  # Start/end pairs per grid
+
+
+def random_grid(seed: int, height: int = 40, width: int = 48, wall_density: float = 0.3) -> OccupancyGrid:
+    """Grid with random wall pixels and a few wall bars, so the searches have to walk around something"""
+    rng = np.random.default_rng(seed)
+    free = rng.random((height, width)) >= wall_density
+    for _ in range(4):
+        y, x = int(rng.integers(height)), int(rng.integers(width))
+        if rng.random() < 0.5:
+            free[y, max(x - 12, 0):x + 12] = False
+        else:
+            free[max(y - 12, 0):y + 12, x] = False
+    grid = OccupancyGrid(height, width)
+    grid.write(0, 0, free)
+    return grid
+
+
+def free_pixels(grid: OccupancyGrid, rng: random.Random, count: int) -> list[tuple[int, int]]:
+    free = np.argwhere(grid.walkable)
+    return [tuple(int(v) for v in free[rng.randrange(len(free))]) for _ in range(count)]
+
+
+def cost(path: list[tuple[int, int]]) -> float:
+    return sum(math.hypot(a[0] - b[0], a[1] - b[1]) for a, b in zip(path, path[1:]))
+
+
+def assert_valid(grid: OccupancyGrid, path: list[tuple[int, int]], start: tuple, end: tuple):
+    """The path joins start and end with single 8-connected steps over free pixels, cutting no wall corner"""
+    assert path[0] == start and path[-1] == end
+    walkable = grid.walkable
+    for (y, x), (next_y, next_x) in zip(path, path[1:]):
+        dy, dx = next_y - y, next_x - x
+        assert max(abs(dy), abs(dx)) == 1
+        assert walkable[next_y, next_x]
+        if dy and dx:
+            assert walkable[y + dy, x] and walkable[y, x + dx]
+
+
+def assert_same_cost(path, reference):
+    if reference is None:
+        assert path is None
+    else:
+        assert path is not None
+        assert cost(path) == pytest.approx(cost(reference))
@@ -0,0 +1,47 @@
+"""The workers of core.batch read the map from the shared memory block instead of copying it"""
+import gc
+import math
+
+import numpy as np
+
+from benchmarks.map_generator import write_floor_plan
+from core import batch
+from core.map_compiler import CompiledMap
+from core.map_loader import MapLoader
+from core.path_maker import PathMaker
+from tests.grids import cost
+
+
+def _room_centres(compiled_map: CompiledMap) -> list[tuple[int, int]]:
+    return [((x_min + x_max) // 2, (y_min + y_max) // 2) for x_min, y_min, x_max, y_max in
+            compiled_map.room_areas.tolist()]
+
+
+def test_worker_map_reads_the_shared_block(tmp_path):
+    compiled_map = CompiledMap.from_loader(MapLoader(write_floor_plan(str(tmp_path / 'plan.png'), 160, 120, 6)))
+    shared_map = batch._SharedMap(compiled_map)
+    try:
+        # Run the worker initializer in this process
+        batch._init_worker([('plan', shared_map.memory.name, shared_map.layout, '')], 'astar')
+        worker_map, _ = batch._worker_path_makers['plan']
+        memory, = batch._worker_memories  # The worker's own mapping of the block
+        block = np.ndarray(memory.size, dtype=np.uint8, buffer=memory.buf)
+        assert worker_map.get_image() is None
+        assert np.shares_memory(worker_map.get_occupancy_grid().padded, block)
+        assert np.shares_memory(worker_map.get_room_index().labels, block)
+        del block, memory
+
+        start, *_, end = _room_centres(compiled_map)
+        result, = batch._solve_chunk('plan', [(0, start, end)])
+        local_map = compiled_map.to_map()
+        expected, _ = PathMaker.for_map(local_map).make_path(local_map.query(start, end))
+        assert result.error is None
+        assert math.isclose(cost(result.path), cost(expected))
+    finally:
+        batch._worker_path_makers.clear()
+        worker_map = None
+        gc.collect()  # Drop the views of the block before closing it
+        for memory in batch._worker_memories:
+            memory.close()
+        batch._worker_memories.clear()
+        shared_map.release()
@@ -0,0 +1,35 @@
+"""Randomized checks that the flow fields lead to the door as cheaply as the plain PixelAStar"""
+import math
+import random
+
+import pytest
+
+from core.flow_field import NO_DIRECTION, flow_directions, wavefront
+from core.pixel_search import NEIGHBOURS, PixelAStar
+from tests.grids import PAIRS, SEEDS, assert_valid, cost, free_pixels, random_grid
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_flow_field_matches_astar(seed):
+    grid = random_grid(seed)
+    walkable = grid.walkable
+    rng = random.Random(seed)
+    source = free_pixels(grid, rng, 1)[0]
+    distances = wavefront(walkable, source)
+    directions = flow_directions(walkable, distances)
+    astar = PixelAStar(grid)
+    for start in free_pixels(grid, rng, PAIRS):
+        reference = astar.search(start, source)
+        if reference is None:
+            assert distances[start] == math.inf
+            continue
+        assert distances[start] == pytest.approx(cost(reference))
+
+        # Following the directions walks the cheapest path down to the source
+        path = [start]
+        while directions[path[-1]] != NO_DIRECTION:
+            dy, dx, _ = NEIGHBOURS[directions[path[-1]]]
+            path.append((path[-1][0] + dy, path[-1][1] + dx))
+            assert len(path) <= walkable.size
+        assert_valid(grid, path, start, source)
+        assert cost(path) == pytest.approx(cost(reference))
@@ -0,0 +1,87 @@
+"""Every routing mode of PathMaker avoids a door closed by Map.update_obstacles"""
+import os
+
+import pytest
+
+from core.map_compiler import CompiledMap
+from core.map_loader import MapLoader
+from core.path_maker import PathMaker
+from core.query_cache import QueryCache
+from core.replanning import IncrementalPath
+from tests.grids import cost
+
+MAP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'map.png')
+DOOR = (142, 234)  # (x, y) of a door on the shortest route between START and END
+START = (250, 240)
+END = (60, 240)
+MODES = {
+    'waypoint_graph': {},
+    'waypoint_objects': {'waypoint_graph': None},
+    'jps': {'pixel_search': 'jps'},
+    'without_flow_fields': {'flow_fields': None},
+    'query_cache': {'query_cache': QueryCache},
+}
+
+
+@pytest.fixture(scope='module')
+def compiled_map():
+    return CompiledMap.from_loader(MapLoader(MAP_PATH), flow_fields=True)
+
+
+def _blocked_map(compiled_map: CompiledMap):
+    loaded_map = compiled_map.to_map()
+    door_index = [tuple(position) for position in compiled_map.waypoint_positions.tolist()].index(DOOR)
+    loaded_map.update_rectangle((DOOR[0] - 1, DOOR[1] - 1), (DOOR[0] + 1, DOOR[1] + 1))
+    assert loaded_map.get_closed_doors() == {door_index}
+    return loaded_map
+
+
+@pytest.fixture(scope='module')
+def rerouted_cost(compiled_map) -> float:
+    """Cost of the path around the closed door, routed on the waypoint graph"""
+    loaded_map = _blocked_map(compiled_map)
+    path, _ = PathMaker.for_map(loaded_map).make_path(loaded_map.query(START, END))
+    return cost(path)
+
+
+def _assert_rerouted(maker: PathMaker, query, rerouted_cost: float):
+    """The door route doesn't pass the closed door and the path costs as much as the one routed on the graph"""
+    assert DOOR not in maker.find_waypoint_path(query)
+    path, _ = maker.make_path(query)
+    assert cost(path) == pytest.approx(rerouted_cost)
+
+
+def test_door_is_on_the_open_route(compiled_map):
+    loaded_map = compiled_map.to_map()
+    assert DOOR in PathMaker.for_map(loaded_map).find_waypoint_path(loaded_map.query(START, END))
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_query_avoids_closed_door(compiled_map, rerouted_cost, mode):
+    loaded_map = _blocked_map(compiled_map)
+    options = {name: value() if value is QueryCache else value for name, value in MODES[mode].items()}
+    _assert_rerouted(PathMaker.for_map(loaded_map, **options), loaded_map.query(START, END), rerouted_cost)
+
+
+def test_added_points_avoid_closed_door(compiled_map, rerouted_cost):
+    loaded_map = _blocked_map(compiled_map)
+    assert loaded_map.locate_and_add_point(START) and loaded_map.locate_and_add_point(END)
+    _assert_rerouted(PathMaker.for_map(loaded_map, waypoint_graph=None), None, rerouted_cost)
+
+
+@pytest.mark.parametrize('mode', ['waypoint_graph', 'waypoint_objects'])
+def test_path_maker_made_before_the_update_avoids_closed_door(compiled_map, rerouted_cost, mode):
+    loaded_map = compiled_map.to_map()
+    maker = PathMaker.for_map(loaded_map, **MODES[mode])
+    maker.make_path(loaded_map.query(START, END))
+    rectangle = loaded_map.update_rectangle((DOOR[0] - 1, DOOR[1] - 1), (DOOR[0] + 1, DOOR[1] + 1))
+    maker.update(loaded_map, rectangle)
+    _assert_rerouted(maker, loaded_map.query(START, END), rerouted_cost)
+
+
+def test_incremental_path_avoids_closed_door(compiled_map, rerouted_cost):
+    loaded_map = compiled_map.to_map()
+    incremental = IncrementalPath(loaded_map, START, END)
+    incremental.path()
+    incremental.update(loaded_map.update_rectangle((DOOR[0] - 1, DOOR[1] - 1), (DOOR[0] + 1, DOOR[1] + 1)))
+    assert cost(incremental.path()) == pytest.approx(rerouted_cost)
@@ -0,0 +1,37 @@
+"""Randomized checks that D* Lite repairs its paths to the cost of a fresh PixelAStar after map edits"""
+import random
+
+import numpy as np
+import pytest
+
+from core.pixel_search import PixelAStar
+from core.replanning import DStarLite
+from tests.grids import SEEDS, assert_same_cost, assert_valid, free_pixels, random_grid
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_dstar_lite_matches_astar_after_edits(seed):
+    grid = random_grid(seed)
+    rng = random.Random(seed)
+    legs = [tuple(free_pixels(grid, rng, 2)) for _ in range(4)]
+    searches = [DStarLite(grid, start, end) for start, end in legs]
+    for search in searches:
+        search.path()
+
+    for _ in range(6):
+        # Block or clear a random rectangle, like Map.update_rectangle, sparing the endpoints
+        x_min, y_min = rng.randrange(grid.width - 6), rng.randrange(grid.height - 6)
+        x_max, y_max = x_min + rng.randrange(6), y_min + rng.randrange(6)
+        free = np.full((y_max - y_min + 1, x_max - x_min + 1), rng.random() < 0.5)
+        for y, x in (pixel for leg in legs for pixel in leg):
+            if y_min <= y <= y_max and x_min <= x <= x_max:
+                free[y - y_min, x - x_min] = True
+        grid.write(x_min, y_min, free)
+
+        astar = PixelAStar(grid)
+        for search, (start, end) in zip(searches, legs):
+            search.update(grid, ((x_min, y_min), (x_max, y_max)))
+            path = search.path()
+            assert_same_cost(path, astar.search(start, end))
+            if path is not None:
+                assert_valid(grid, path, start, end)
@@ -0,0 +1,23 @@
+"""Randomized checks that Jump Point Search finds paths as cheap as the plain PixelAStar"""
+import random
+
+import pytest
+
+from core.jump_point_search import JumpPointSearch
+from core.pixel_search import PixelAStar
+from tests.grids import PAIRS, SEEDS, assert_same_cost, assert_valid, free_pixels, random_grid
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_jump_point_search_matches_astar(seed):
+    grid = random_grid(seed)
+    astar = PixelAStar(grid)
+    jps = JumpPointSearch(grid)
+    rng = random.Random(seed)
+    for _ in range(PAIRS):
+        start, end = free_pixels(grid, rng, 2)
+        reference = astar.search(start, end)
+        path = jps.search(start, end)
+        assert_same_cost(path, reference)
+        if path is not None:
+            assert_valid(grid, path, start, end)
@@ -0,0 +1,31 @@
+"""build_tiled_map reads .npy sources a tile at a time and refuses to decode oversized images"""
+import cv2
+import numpy as np
+import pytest
+
+from benchmarks.map_generator import generate_floor_plan
+from core.tiled_map import TiledMap, build_tiled_map
+
+
+@pytest.fixture
+def floor_plan() -> np.ndarray:
+    return generate_floor_plan(200, 150, 6, seed=3)
+
+
+def test_oversized_png_is_rejected_before_decoding(tmp_path, floor_plan):
+    source = str(tmp_path / 'plan.png')
+    cv2.imwrite(source, floor_plan)
+    with pytest.raises(ValueError, match='200x150 pixels'):
+        build_tiled_map(source, str(tmp_path / 'tiles'), tile_size=64, max_decoded_pixels=200 * 150 - 1)
+
+
+def test_npy_source_matches_png_source(tmp_path, floor_plan):
+    png_source, npy_source = str(tmp_path / 'plan.png'), str(tmp_path / 'plan.npy')
+    cv2.imwrite(png_source, floor_plan)
+    np.save(npy_source, floor_plan)
+    # The limit only applies to the images which have to be decoded whole
+    from_npy = TiledMap(build_tiled_map(npy_source, str(tmp_path / 'npy'), tile_size=64, max_decoded_pixels=1))
+    from_png = TiledMap(build_tiled_map(png_source, str(tmp_path / 'png'), tile_size=64))
+    assert np.array_equal(from_npy.waypoint_graph.positions, from_png.waypoint_graph.positions)
+    assert np.array_equal(from_npy.room_areas, from_png.room_areas)
+    assert np.array_equal(from_npy.tiles.window(0, 0, 199, 149), from_png.tiles.window(0, 0, 199, 149))